@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''Throughput of MRETorchDataset + DataLoader (samples/s) for different worker counts,
+augmentation and smear settings, on synthetic volumes.'''
+
+import time
+import json
+import argparse
+from itertools import product
+from torch.utils.data import DataLoader
+
+from mre.mre_datasets import MRETorchDataset
+from mre.synthetic import make_synthetic_cohort
+
+
+def time_loader(ds, inputs, num_workers=0, aug=False, smear=False, smear_amt=0, batch_size=4,
+                n_epochs=1):
+    '''Samples/s of iterating the 'train' set for `n_epochs` (after one warm-up batch).'''
+    dataset = MRETorchDataset(ds, set_type='train', dims=3, inputs=list(inputs), train_aug=aug,
+                              train_smear=smear, smear_amt=smear_amt)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        persistent_workers=num_workers > 0)
+    next(iter(loader))
+    n_samples = 0
+    since = time.perf_counter()
+    for _ in range(n_epochs):
+        for data in loader:
+            n_samples += data[0].shape[0]
+    return n_samples/(time.perf_counter() - since)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the MRETorchDataset data pipeline.')
+    parser.add_argument('--n_subj', type=int, default=8)
+    parser.add_argument('--shape', type=int, nargs=3, default=[32, 256, 256])
+    parser.add_argument('--inputs', type=str, nargs='+', default=['t1_pre_water', 't2'])
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--n_epochs', type=int, default=1)
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--aug', type=int, nargs='+', default=[0, 1])
+    parser.add_argument('--smear', type=str, nargs='+', default=['none', 'gaussian', 'median'])
+    parser.add_argument('--smear_amt', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None, help='Optional JSON output file.')
+    args = parser.parse_args()
+
+    nz, ny, nx = args.shape
+    ds = make_synthetic_cohort(args.n_subj, nx, ny, nz, sequences=args.inputs)
+    results = []
+    for num_workers, aug, smear in product(args.num_workers, args.aug, args.smear):
+        if smear != 'none' and not aug:
+            continue  # smearing is only applied with augmentation
+        rate = time_loader(ds, args.inputs, num_workers, bool(aug),
+                           False if smear == 'none' else smear, args.smear_amt,
+                           args.batch_size, args.n_epochs)
+        results.append({'num_workers': num_workers, 'aug': bool(aug), 'smear': smear,
+                        'samples_per_sec': rate})
+        print(f'workers {num_workers:2d}  aug {bool(aug)!s:5s}  smear {smear:8s} '
+              f'{rate:8.2f} samples/s')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''Import time of the mre modules and CLI startup of the entry points, each in a fresh interpreter.
+
+    python benchmarks/bench_imports.py
+    python benchmarks/bench_imports.py --importtime mre.train_mre_model
+
+With `--importtime` the slowest imports (cumulative, from `python -X importtime`) of that module are
+listed, to find what is worth deferring.
+'''
+
+import sys
+import subprocess
+import argparse
+import numpy as np
+
+MODULES = ['mre.mre_datasets', 'mre.prediction', 'mre.make_xr', 'mre.train_mre_model',
+           'mre.train_seg_model', 'mre.plotting']
+# argparse exits after printing the help, which covers the imports and parser setup of the CLI
+CLIS = {'train_mre_model --help': 'mre.train_mre_model',
+        'make_xr --help': 'mre.make_xr'}
+
+
+def time_subprocess(statement, n_repeat=5):
+    '''Median wall time (s) of running `statement` in a new interpreter, excluding interpreter
+    startup itself.'''
+    code = ('import sys, time\nsince = time.perf_counter()\n'
+            f'try:\n    {statement}\nexcept SystemExit:\n    pass\n'
+            'sys.stderr.write(f"@@{time.perf_counter() - since}\\n")')
+    times = []
+    for _ in range(n_repeat):
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        lines = [line for line in proc.stderr.splitlines() if line.startswith('@@')]
+        if not lines:
+            raise RuntimeError(f'"{statement}" failed:\n{proc.stderr}')
+        times.append(float(lines[-1][2:]))
+    return float(np.median(times))
+
+
+def slowest_imports(module, n_top=15):
+    '''(cumulative seconds, package) of the `n_top` slowest imports triggered by `module`.'''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative)/1e6, name.strip()))
+    return sorted(rows, reverse=True)[:n_top]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark import and CLI startup time.')
+    parser.add_argument('--n_repeat', type=int, default=5)
+    parser.add_argument('--importtime', type=str, default=None,
+                        help='Module to list the slowest imports of.')
+    args = parser.parse_args()
+
+    if args.importtime:
+        for seconds, name in slowest_imports(args.importtime):
+            print(f'{seconds*1000:10.1f} ms  {name}')
+    else:
+        for module in MODULES:
+            seconds = time_subprocess(f'import {module}', args.n_repeat)
+            print(f'import {module:25s} {seconds*1000:8.1f} ms')
+        for name, module in CLIS.items():
+            statement = (f'import runpy; sys.argv = ["{module}", "--help"]; '
+                         f'runpy.run_module("{module}", run_name="__main__")')
+            seconds = time_subprocess(statement, args.n_repeat)
+            print(f'{name:32s} {seconds*1000:8.1f} ms')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+'''Timing comparison of the regression and wave-image spectral losses (forward + backward).'''
+
+import time
+import argparse
+import torch
+
+from mre.prediction import masked_mse_fft, masked_mse, masked_mse_subj, get_masked_mse_fused
+from mre.spectral_loss import SpectralLoss
+
+
+def time_loss(loss_fn, pred, target, mask, n_iter=20, **kwargs):
+    '''Average wall time (s) of one forward + backward pass of `loss_fn`.'''
+    for _ in range(3):
+        loss_fn(pred, target, mask, **kwargs).backward()
+    if pred.is_cuda:
+        torch.cuda.synchronize()
+    since = time.perf_counter()
+    for _ in range(n_iter):
+        pred.grad = None
+        loss_fn(pred, target, mask, **kwargs).backward()
+    if pred.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - since)/n_iter
+
+
+def bench_spectral(batch_size=4, shape=(32, 256, 256), device='cpu', n_iter=20):
+    torch.manual_seed(0)
+    size = (batch_size, 1) + tuple(shape)
+    pred = torch.randn(size, device=device, requires_grad=True)
+    target = torch.randn(size, device=device)
+    mask = (torch.rand(size, device=device) > 0.5).float()
+    names = [str(i) for i in range(batch_size)]
+
+    spectral = SpectralLoss()
+    results = {
+        'masked_mse_fft': time_loss(masked_mse_fft, pred, target, mask, n_iter),
+        'spectral_rfft': time_loss(spectral, pred, target, mask, n_iter),
+        'spectral_rfft_cached_target': time_loss(spectral, pred, target, mask, n_iter,
+                                                 names=names),
+        'spectral_rfft_band': time_loss(SpectralLoss(band=[0.02, 0.25]), pred, target, mask,
+                                        n_iter),
+    }
+    return results
+
+
+def separate_mse(pred, target, mask):
+    '''The pre-fusion calc_loss path: two independent masked losses.'''
+    return masked_mse(pred, target, mask) + masked_mse_subj(pred, target, mask)
+
+
+def bench_masked_mse(batch_size=4, shape=(32, 256, 256), device='cpu', n_iter=20,
+                     backends=('eager', 'script')):
+    torch.manual_seed(0)
+    size = (batch_size, 1) + tuple(shape)
+    pred = torch.randn(size, device=device, requires_grad=True)
+    target = torch.randn(size, device=device)
+    mask = (torch.rand(size, device=device) > 0.5).float()
+
+    results = {'masked_mse+masked_mse_subj': time_loss(separate_mse, pred, target, mask, n_iter)}
+    for backend in backends:
+        fused = get_masked_mse_fused(backend)
+        results[f'masked_mse_fused_{backend}'] = time_loss(
+            lambda p, t, m: sum(fused(p, t, m)[:2]), pred, target, mask, n_iter)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the training losses.')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--shape', type=int, nargs=3, default=[32, 256, 256])
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available()
+                        else 'cpu')
+    parser.add_argument('--n_iter', type=int, default=20)
+    parser.add_argument('--backends', type=str, nargs='*', default=['eager', 'script'])
+    args = parser.parse_args()
+
+    results = bench_masked_mse(args.batch_size, args.shape, args.device, args.n_iter,
+                               args.backends)
+    results.update(bench_spectral(args.batch_size, args.shape, args.device, args.n_iter))
+    for name, sec in results.items():
+        print(f'{name:30s} {sec*1000:8.2f} ms')
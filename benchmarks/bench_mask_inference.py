@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''CPU timing and fp32 agreement of the liver mask model (ModelsGenesis UNet3D) at reduced
+precision.'''
+
+import time
+import argparse
+from pathlib import Path
+from collections import OrderedDict
+import torch
+import xarray as xr
+
+from mre.pytorch_arch_models_genesis import UNet3D
+from mre.quantization import quantize_model, calibration_volumes, check_agreement
+
+
+def time_model(model, volume, n_iter=3):
+    '''Average wall time (s) of one forward pass.'''
+    with torch.no_grad():
+        model(volume)
+        since = time.perf_counter()
+        for _ in range(n_iter):
+            model(volume)
+    return (time.perf_counter() - since)/n_iter
+
+
+def bench_mask_inference(model, volumes, precisions=('fp32', 'bf16', 'int8'), n_iter=3):
+    '''Time each precision and report its min Dice against the production model (ContBatchNorm3d
+    with batch statistics) and against the fp32 model with fixed statistics.  Random weights give
+    near-empty masks, so the Dice scores are only meaningful with a trained `--model_path`.'''
+    fixed = quantize_model(model, 'fp32', fix_cont_bn=True)
+    results = {'fp32_contbn': (time_model(model, volumes[0], n_iter), 1.0, None)}
+    for precision in precisions:
+        reduced = quantize_model(model, precision, calib_volumes=volumes)
+        dices = check_agreement(model, reduced, volumes, min_dice=0, verbose=False)
+        dices_fixed = check_agreement(fixed, reduced, volumes, min_dice=0, verbose=False)
+        results[precision] = (time_model(reduced, volumes[0], n_iter), min(dices),
+                              min(dices_fixed))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the liver mask model on CPU.')
+    parser.add_argument('--model_path', type=str, default=None,
+                        help='ModelsGenesis state dict.  Random weights if not given.')
+    parser.add_argument('--calib_file', type=str, default=None,
+                        help='CHAOS xarray file.  Random volumes if not given.')
+    parser.add_argument('--n_volumes', type=int, default=4)
+    parser.add_argument('--shape', type=int, nargs=3, default=[32, 256, 256])
+    parser.add_argument('--n_iter', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = UNet3D()
+    if args.model_path is not None:
+        model_dict = torch.load(args.model_path, map_location='cpu')
+        model_dict = OrderedDict([(key[7:], val) for key, val in model_dict.items()])
+        model.load_state_dict(model_dict, strict=True)
+    model.eval()
+    if args.calib_file is not None:
+        volumes = calibration_volumes(xr.open_dataset(Path(args.calib_file)), args.n_volumes)
+    else:
+        volumes = [torch.randn([1, 1] + args.shape) for _ in range(args.n_volumes)]
+
+    results = bench_mask_inference(model, volumes, n_iter=args.n_iter)
+    for name, (sec, dice, dice_fixed) in results.items():
+        line = f'{name:15s} {sec*1000:10.1f} ms   min Dice vs fp32 {dice:.4f}'
+        if dice_fixed is not None:
+            line += f'   vs fixed-stat fp32 {dice_fixed:.4f}'
+        print(line)
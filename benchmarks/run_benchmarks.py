@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+'''CPU benchmark suite of the main hot paths, on synthetic data.
+
+Results are written as JSON and can be compared against a saved baseline:
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --threshold 1.25
+
+A benchmark whose median time is more than `threshold` times its baseline is a regression (exit
+code 1), one that is faster by the same factor is reported as a speed-up.  Baselines are machine
+specific, so only compare runs made on the same node type.
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import traceback
+import numpy as np
+import torch
+
+from mre.synthetic import make_synthetic_cohort
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def time_func(func, n_repeat=5, n_warmup=1):
+    '''Median wall time (s) of `func()` over `n_repeat` calls.'''
+    for _ in range(n_warmup):
+        func()
+    times = []
+    for _ in range(n_repeat):
+        since = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - since)
+    return float(np.median(times))
+
+
+@benchmark('dicom_slice_sort')
+def bench_dicom(cfg):
+    import SimpleITK as sitk
+    from mre.preprocessing import dicom_split_sort
+    nz, ny, nx = cfg['shape']
+    tmp_dir = tempfile.mkdtemp()
+    names = []
+    for i, z in enumerate(np.random.RandomState(0).permutation(nz)):
+        img = sitk.GetImageFromArray(np.random.randint(0, 1000, (ny, nx)).astype(np.int16))
+        img.SetMetaData('0020|0032', f'0\\0\\{z*3.0}')
+        img.SetMetaData('0020|0037', '1\\0\\0\\0\\1\\0')
+        img.SetMetaData('0008|0060', 'MR')
+        writer = sitk.ImageFileWriter()
+        writer.KeepOriginalImageUIDOn()
+        writer.SetFileName(os.path.join(tmp_dir, f'{i}.dcm'))
+        writer.Execute(img)
+        names.append(os.path.join(tmp_dir, f'{i}.dcm'))
+    return time_func(lambda: dicom_split_sort(names, 't2'), cfg['n_repeat'])
+
+
+@benchmark('registration')
+def bench_registration(cfg):
+    import SimpleITK as sitk
+    from mre.registration import Register
+    if not hasattr(sitk, 'ElastixImageFilter'):
+        raise ImportError('SimpleITK was built without elastix')
+    ds = cfg['ds']
+    fixed = sitk.GetImageFromArray(
+        ds['image_mri'].isel(subject=0, sequence=0).transpose('z', 'y', 'x').values)
+    moving = sitk.GetImageFromArray(
+        ds['image_mri'].isel(subject=0, sequence=1).transpose('z', 'y', 'x').values)
+    return time_func(lambda: Register(fixed, moving, verbose=False), 1, 0)
+
+
+@benchmark('gen_liver_mask')
+def bench_liver_mask(cfg):
+    from mre.mre_datasets import MREtoXr
+    from mre.pytorch_arch_models_genesis import UNet3D
+    # skip __init__, which loads the trained mask model from the cluster
+    xr_maker = MREtoXr.__new__(MREtoXr)
+    xr_maker.mask_arch = 'ModelsGenesis'
+    xr_maker.model = UNet3D().eval()
+    image = cfg['ds']['image_mri'].isel(subject=0, sequence=1).transpose('z', 'y', 'x').values
+    return time_func(lambda: xr_maker.gen_liver_mask(image), cfg['n_repeat'])
+
+
+@benchmark('dataset_getitem')
+def bench_getitem(cfg):
+    from mre.mre_datasets import MRETorchDataset
+    dataset = MRETorchDataset(cfg['ds'], set_type='train', dims=3, inputs=cfg['inputs'],
+                              wave=True, train_aug=True, train_smear='gaussian', smear_amt=3)
+    return time_func(lambda: dataset[0], cfg['n_repeat'])
+
+
+@benchmark('deeplab_step')
+def bench_deeplab(cfg):
+    from mre.pytorch_arch_deeplab import DeepLab
+    torch.manual_seed(0)
+    model = DeepLab(len(cfg['inputs']), 2, output_stride=8, norm='bn', wave=True).train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    inputs = torch.randn([2, len(cfg['inputs'])] + cfg['shape'])
+
+    def step():
+        optimizer.zero_grad()
+        outputs = model(inputs)[0]
+        outputs.pow(2).mean().backward()
+        optimizer.step()
+    return time_func(step, cfg['n_repeat'])
+
+
+@benchmark('calc_loss_wave')
+def bench_calc_loss(cfg):
+    from collections import defaultdict
+    from mre.prediction import calc_loss
+    torch.manual_seed(0)
+    size = [2, 2] + cfg['shape']
+    pred = (torch.randn(size, requires_grad=True), torch.zeros(1))
+    target = torch.randn(size)
+    mask = (torch.rand([2, 1] + cfg['shape']) > 0.5).float()
+
+    def loss_step():
+        loss = calc_loss(pred, target, mask, defaultdict(float), 'l2', wave=True,
+                         wave_hypers=[0.05, 0.05, 0.5, 0.5], fft=True)
+        loss.backward()
+    return time_func(loss_step, cfg['n_repeat'])
+
+
+@benchmark('prediction_writeback')
+def bench_writeback(cfg):
+    import xarray as xr
+    ds = cfg['ds']
+    ds_mem = xr.Dataset(
+        {'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'],
+                       np.zeros((ds.subject.size, 2, ds.x.size, ds.y.size, ds.z.size),
+                                dtype=np.int16))},
+        coords={'subject': ds.subject, 'mre_type': ['mre', 'mre_pred'], 'x': ds.x, 'y': ds.y,
+                'z': ds.z})
+    prediction = np.random.rand(1, 1, ds.z.size, ds.y.size, ds.x.size).astype(np.float32)
+
+    # the per-subject writeback loop at the end of prediction.train_model
+    def writeback():
+        for name in ds.subject.values:
+            ds_mem['image_mre'].loc[{'subject': name,
+                                     'mre_type': 'mre_pred'}] = (prediction[0, 0].T)*100
+    return time_func(writeback, cfg['n_repeat'])
+
+
+def _with_pred(ds):
+    ds = ds.copy()
+    ds['image_mre'].loc[{'mre_type': 'mre_pred'}] = (
+        ds['image_mre'].sel(mre_type='mre')*np.random.uniform(0.8, 1.2))
+    return ds
+
+
+@benchmark('get_linear_fit')
+def bench_linear_fit(cfg):
+    from mre.prediction import get_linear_fit
+    ds = _with_pred(cfg['ds'])
+    return time_func(lambda: get_linear_fit(ds, make_plot=False, verbose=False),
+                     cfg['n_repeat'])
+
+
+@benchmark('model_compare_pandas')
+def bench_compare_pandas(cfg):
+    from mre.mre_datasets import ModelComparePandas
+    ds = _with_pred(cfg['ds'])
+    ds['val_slope'] = (('subject', 'mre_type'), np.ones((ds.subject.size, ds.mre_type.size)))
+    ds['val_intercept'] = (('subject', 'mre_type'), np.zeros((ds.subject.size,
+                                                              ds.mre_type.size)))
+    return time_func(lambda: ModelComparePandas(ds, do_cor=True, do_aug=True), cfg['n_repeat'])
+
+
+def run_benchmarks(names=None, shape=(16, 64, 64), n_subj=4, n_repeat=5, verbose=True):
+    '''Run the selected benchmarks (all by default).  A benchmark that cannot run here (e.g. a
+    missing optional dependency) is recorded with its error instead of stopping the suite.'''
+    nz, ny, nx = shape
+    inputs = ['t1_pre_water', 't1_pre_in', 't1_pre_out', 't2']
+    cfg = {'shape': list(shape), 'n_repeat': n_repeat, 'inputs': inputs,
+           'ds': make_synthetic_cohort(n_subj, nx, ny, nz, sequences=inputs)}
+    results = {}
+    for name in names or BENCHMARKS:
+        try:
+            results[name] = {'status': 'ok', 'time': BENCHMARKS[name](cfg)}
+        except ImportError as e:
+            results[name] = {'status': 'skipped', 'reason': str(e)}
+        except Exception as e:
+            results[name] = {'status': 'error', 'reason': f'{type(e).__name__}: {e}'}
+            if verbose:
+                traceback.print_exc()
+        if verbose:
+            res = results[name]
+            if res['status'] == 'ok':
+                print(f'{name:25s} {res["time"]*1000:10.2f} ms')
+            else:
+                print(f'{name:25s} {res["status"]}: {res["reason"]}')
+
+    meta = {'shape': list(shape), 'n_subj': n_subj, 'n_repeat': n_repeat,
+            'torch': torch.__version__, 'numpy': np.__version__,
+            'python': platform.python_version(), 'machine': platform.node(),
+            'threads': torch.get_num_threads(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def compare(results, baseline, threshold=1.25):
+    '''Ratio of current to baseline time for every benchmark that ran in both.
+
+    Returns:
+        (ratios, regressions, speedups), the last two are lists of benchmark names.
+    '''
+    ratios = {}
+    for name, res in results['results'].items():
+        base = baseline['results'].get(name, {})
+        if res['status'] == 'ok' and base.get('status') == 'ok':
+            ratios[name] = res['time']/base['time']
+    regressions = [name for name, ratio in ratios.items() if ratio > threshold]
+    speedups = [name for name, ratio in ratios.items() if ratio < 1/threshold]
+    return ratios, regressions, speedups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the CPU benchmark suite.')
+    parser.add_argument('--benchmarks', type=str, nargs='*', default=None,
+                        choices=list(BENCHMARKS), help='Subset to run (default: all).')
+    parser.add_argument('--shape', type=int, nargs=3, default=[16, 64, 64])
+    parser.add_argument('--n_subj', type=int, default=4)
+    parser.add_argument('--n_repeat', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the results.')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare to.')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slow-down (or speed-up) factor reported as a change.')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    results = run_benchmarks(args.benchmarks, args.shape, args.n_subj, args.n_repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratios, regressions, speedups = compare(results, baseline, args.threshold)
+        print(f'\ncompared to {args.baseline} (threshold x{args.threshold}):')
+        for name, ratio in ratios.items():
+            flag = 'REGRESSION' if name in regressions else 'faster' if name in speedups else ''
+            print(f'{name:25s} x{ratio:6.2f} {flag}')
+        if regressions:
+            sys.exit(1)
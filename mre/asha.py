@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import math
+from pathlib import Path
+
+# Asynchronous successive halving (ASHA, Li et al. 2018) for the training jobs of a sweep.  Jobs
+# share a directory instead of talking to a controller:
+#   <store_dir>/<group>/<trial>.jsonl          per-epoch losses of a trial
+#   <store_dir>/<group>/rung_<epochs>/<trial>.json   best loss at a rung and the decision
+# Only trials of the same group (subj_group, i.e. the same validation subjects) compete.
+
+
+def rung_epochs(max_epochs, min_epochs=10, eta=3):
+    '''Epoch counts at which trials are compared: min_epochs*eta**k, below max_epochs.'''
+    if min_epochs < 1 or eta < 2:
+        raise ValueError(f'Need min_epochs >= 1 and eta >= 2, got {min_epochs} and {eta}')
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs
+
+
+def promotable(loss, competitors, eta=3):
+    '''Whether a trial with `loss` at a rung is in the top 1/eta of the `competitors` losses
+    recorded at that rung so far (its own included).  The first trials at a rung always go on.'''
+    ranked = sorted(competitors)
+    cutoff = ranked[max(len(ranked)//eta - 1, 0)]
+    return loss <= cutoff
+
+
+def _write_json(path, obj):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def rung_losses(store_dir, group, epochs):
+    '''{trial: best loss} of the trials that reached rung `epochs` in `group`.'''
+    losses = {}
+    for path in Path(store_dir, str(group), f'rung_{epochs}').glob('*.json'):
+        with open(path) as f:
+            losses[path.stem] = json.load(f)['loss']
+    return losses
+
+
+class ASHA:
+    '''Early stopping of one training job by asynchronous successive halving.
+
+    `train_model` calls `restore` before the first epoch (after the resumed one) and `report` after
+    every epoch; at each rung (see `rung_epochs`) the trial only continues if its best loss so far
+    is in the top 1/eta of the trials that got there before it.
+
+    Args:
+        store_dir (str): Directory shared by the jobs of the sweep.
+        trial (str): Name of this job (model_version).
+        group (str): Trials only compete within a group (subj_group).
+        max_epochs (int): Epochs of a full run, no rung at or after it.
+        min_epochs (int): Epochs before the first rung.
+        eta (int): Reduction factor, 1/eta of the trials go on at each rung.
+    '''
+
+    def __init__(self, store_dir, trial, group, max_epochs, min_epochs=10, eta=3):
+        self.store_dir = Path(store_dir)
+        self.trial = str(trial)
+        self.group = str(group)
+        self.eta = eta
+        self.rungs = rung_epochs(max_epochs, min_epochs, eta)
+        self.best_loss = math.inf
+        self.stopped_at = None
+        self.history = Path(self.store_dir, self.group, f'{self.trial}.jsonl')
+        self.history.parent.mkdir(parents=True, exist_ok=True)
+
+    def restore(self, last_epoch=-1):
+        '''Start the trial after (0-based) `last_epoch`, e.g. from a checkpoint: the history and
+        rung records of later epochs are dropped and the best loss restored from the rest.  -1
+        starts afresh.  Returns True if the trial was already stopped at a rung up to
+        `last_epoch`.'''
+        records = []
+        if self.history.exists():
+            records = [json.loads(line) for line in self.history.read_text().splitlines()]
+        records = [record for record in records if record['epoch'] <= last_epoch]
+        self.history.write_text(''.join(json.dumps(record) + '\n' for record in records))
+        self.best_loss = min([record['loss'] for record in records], default=math.inf)
+        self.stopped_at = None
+        for epochs in self.rungs:
+            rung_path = Path(self.store_dir, self.group, f'rung_{epochs}', f'{self.trial}.json')
+            if not rung_path.exists():
+                continue
+            if epochs > last_epoch + 1:
+                rung_path.unlink()
+                continue
+            with open(rung_path) as f:
+                if not json.load(f).get('promoted', True) and self.stopped_at is None:
+                    self.stopped_at = epochs
+        return self.stopped_at is not None
+
+    def report(self, epoch, loss):
+        '''Record the loss of (0-based) `epoch`.  Returns True if the trial should stop.'''
+        loss = float(loss)
+        if math.isnan(loss):
+            loss = math.inf
+        self.best_loss = min(self.best_loss, loss)
+        with open(self.history, 'a') as f:
+            f.write(json.dumps({'epoch': epoch, 'loss': loss}) + '\n')
+        if epoch + 1 not in self.rungs:
+            return False
+
+        rung_path = Path(self.store_dir, self.group, f'rung_{epoch + 1}', f'{self.trial}.json')
+        _write_json(rung_path, {'loss': self.best_loss})
+        competitors = rung_losses(self.store_dir, self.group, epoch + 1)
+        promoted = promotable(self.best_loss, list(competitors.values()), self.eta)
+        _write_json(rung_path, {'loss': self.best_loss, 'promoted': promoted,
+                                'n_competitors': len(competitors)})
+        if not promoted:
+            self.stopped_at = epoch + 1
+        return not promoted
+
+
+def summarize(store_dir):
+    '''{group: {trial: {'epochs', 'best_loss', 'stopped_at'}}} of all the trials in a store.'''
+    summary = {}
+    for group_dir in sorted(p for p in Path(store_dir).iterdir() if p.is_dir()):
+        trials = {}
+        for path in sorted(group_dir.glob('*.jsonl')):
+            losses = [json.loads(line)['loss'] for line in path.read_text().splitlines()]
+            trials[path.stem] = {'epochs': len(losses),
+                                 'best_loss': min(losses) if losses else None,
+                                 'stopped_at': None}
+        for rung_dir in group_dir.glob('rung_*'):
+            for path in rung_dir.glob('*.json'):
+                with open(path) as f:
+                    if not json.load(f).get('promoted', True) and path.stem in trials:
+                        trials[path.stem]['stopped_at'] = int(rung_dir.name[len('rung_'):])
+        summary[group_dir.name] = trials
+    return summary
+
+
+if __name__ == '__main__':
+    # python -m mre.asha <store_dir>
+    for group, trials in summarize(sys.argv[1]).items():
+        print(group)
+        for trial, info in sorted(trials.items(), key=lambda item: item[1]['best_loss']
+                                  if item[1]['best_loss'] is not None else math.inf):
+            stopped = f'stopped at {info["stopped_at"]}' if info['stopped_at'] else 'full run'
+            print(f'  {trial}: best loss {info["best_loss"]}, {info["epochs"]} epochs, {stopped}')
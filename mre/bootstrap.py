@@ -0,0 +1,68 @@
+import numpy as np
+from scipy.stats import rankdata
+
+# Vectorized bootstrap for the evaluation tables: all the resamples are drawn at once as an
+# (n_boot, size) index matrix and every statistic is computed for all of them with broadcasting.
+
+
+def resample_indices(n, n_boot=100, size=None, seed=None):
+    '''(n_boot, size) indices drawn with replacement from range(n), size defaults to n.'''
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n, size=(n_boot, n if size is None else size))
+
+
+def _take(values, idx):
+    values = np.asarray(values)
+    return values if idx is None else values[idx]
+
+
+def confusion_counts(true, pred, threshold, idx=None, inclusive=False):
+    '''TP, FN, TN and FP counts of the `pred` vs `true` classification at `threshold`, for every
+    resample in `idx` (or the sample itself).
+
+    Values equal to the threshold are not counted, except with `inclusive`, where they are
+    positives for TP and negatives for TN (the convention of the `roc_curves` point estimates).
+
+    Returns:
+        (tp, fn, tn, fp), each of shape (n_boot,) or scalars.
+    '''
+    true = _take(true, idx)
+    pred = _take(pred, idx)
+    axis = -1
+    if inclusive:
+        tp = ((true >= threshold) & (pred >= threshold)).sum(axis=axis)
+        tn = ((true <= threshold) & (pred <= threshold)).sum(axis=axis)
+    else:
+        tp = ((true > threshold) & (pred > threshold)).sum(axis=axis)
+        tn = ((true < threshold) & (pred < threshold)).sum(axis=axis)
+    fn = ((true > threshold) & (pred < threshold)).sum(axis=axis)
+    fp = ((true < threshold) & (pred > threshold)).sum(axis=axis)
+    return tp, fn, tn, fp
+
+
+def classification_rates(tp, fn, tn, fp):
+    '''(sensitivity, specificity, accuracy), NaN where undefined.'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return tp/(tp + fn), tn/(tn + fp), (tn + tp)/(tn + fp + tp + fn)
+
+
+def auroc(labels, scores, idx=None):
+    '''Area under the ROC curve from the ranks of the scores (Mann-Whitney U, ties count half),
+    equal to the trapezoidal AUC of `sklearn.metrics.roc_curve`.  NaN for a resample with only one
+    class.'''
+    labels = _take(labels, idx).astype(bool)
+    ranks = rankdata(_take(scores, idx), axis=-1)
+    n_pos = labels.sum(axis=-1)
+    n_neg = labels.shape[-1] - n_pos
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((ranks*labels).sum(axis=-1) - n_pos*(n_pos + 1)/2)/(n_pos*n_neg)
+
+
+def linear_r2(x, y, idx=None):
+    '''R^2 of the least squares line y = slope*x + intercept, for every resample.'''
+    x = _take(x, idx).astype(float)
+    y = _take(y, idx).astype(float)
+    dx = x - x.mean(axis=-1, keepdims=True)
+    dy = y - y.mean(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (dx*dy).sum(axis=-1)**2/((dx**2).sum(axis=-1)*(dy**2).sum(axis=-1))
@@ -0,0 +1,157 @@
+import os
+import random
+import threading
+from pathlib import Path
+import numpy as np
+import torch
+
+
+def to_cpu(obj):
+    '''Copy of a (nested) state dict with every tensor moved to the CPU.'''
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return {key: to_cpu(val) for key, val in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(val) for val in obj)
+    return obj
+
+
+def rng_state():
+    '''State of the python, numpy and torch (CPU and CUDA) random number generators.'''
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(),
+             'torch': torch.random.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.random.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _state_dict(obj):
+    return obj.state_dict() if hasattr(obj, 'state_dict') else None
+
+
+class BestState:
+    '''The best model weights so far, kept in preallocated CPU memory.
+
+    `update` copies a state dict into the buffers without allocating; on the GPU the buffers are
+    pinned and the copy is queued on the current stream, so it overlaps with the next batches
+    instead of stalling them like a `copy.deepcopy` of the state dict (which also doubles the GPU
+    memory taken by the weights).
+
+    Args:
+        model (nn.Module): Model whose weights are tracked, gives the buffer shapes.
+        pin (bool): Use pinned memory, default when CUDA is available.
+    '''
+
+    def __init__(self, model, pin=None):
+        if pin is None:
+            pin = torch.cuda.is_available()
+        self.buffers = {}
+        for key, val in model.state_dict().items():
+            buf = torch.empty(val.shape, dtype=val.dtype, device='cpu')
+            self.buffers[key] = buf.pin_memory() if pin else buf
+        self.event = None
+        self.update(model.state_dict())
+
+    def update(self, state_dict):
+        on_gpu = False
+        for key, val in state_dict.items():
+            self.buffers[key].copy_(val.detach(), non_blocking=True)
+            on_gpu = on_gpu or val.is_cuda
+        self.event = None
+        if on_gpu:
+            self.event = torch.cuda.Event()
+            self.event.record()
+
+    def state_dict(self):
+        '''The buffers, once the last copy into them is done.'''
+        if self.event is not None:
+            self.event.synchronize()
+        return self.buffers
+
+
+class AsyncCheckpointer:
+    '''Full training state checkpoints (model, optimizer, scheduler, loss parameters, RNGs, epoch
+    and best model), written in a background thread.
+
+    The state is copied to the CPU before `save` returns, so training can go on while it is written.
+    At most one write is in flight; files are written to a temporary name and renamed, so a job
+    killed mid-write leaves the previous checkpoint intact.
+
+    Args:
+        path (str): Checkpoint file.
+        every (int): Save every `every` epochs (see `due`).
+        fingerprint (str): Config fingerprint of the run (see `mre.fingerprint`), stored with the
+            state so `load_checkpoint` does not resume a run with a different config.
+    '''
+
+    def __init__(self, path, every=1, fingerprint=None):
+        self.path = Path(path)
+        self.every = every
+        self.fingerprint = fingerprint
+        self.thread = None
+        self.error = None
+
+    def due(self, epoch):
+        return self.every > 0 and (epoch + 1) % self.every == 0
+
+    def save(self, epoch, model, optimizer, scheduler=None, loss_func=None, best_state=None,
+             best_loss=None):
+        state = {'epoch': epoch, 'model': to_cpu(model.state_dict()),
+                 'optimizer': to_cpu(optimizer.state_dict()),
+                 'scheduler': _state_dict(scheduler), 'loss_func': to_cpu(_state_dict(loss_func)),
+                 'best_state': to_cpu(best_state), 'best_loss': best_loss, 'rng': rng_state(),
+                 'fingerprint': self.fingerprint}
+        self.wait()
+        self.thread = threading.Thread(target=self._write, args=(state,), daemon=True)
+        self.thread.start()
+
+    def _write(self, state):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+            torch.save(state, tmp_path)
+            os.replace(tmp_path, self.path)
+        except Exception as err:
+            self.error = err
+
+    def wait(self):
+        '''Block until the last checkpoint is on disk.'''
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            err, self.error = self.error, None
+            raise RuntimeError(f'Writing checkpoint {self.path} failed') from err
+
+
+def load_checkpoint(path, model, optimizer, scheduler=None, loss_func=None, fingerprint=None):
+    '''Restore the training state saved by `AsyncCheckpointer` into the given objects.  With a
+    `fingerprint`, the checkpoint must have been written by a run with the same one.
+
+    Returns:
+        (epoch, best_state, best_loss): the last completed epoch and the best model so far (on
+        the CPU).
+    '''
+    # the RNG states are not plain tensors, and the file is our own
+    state = torch.load(path, map_location='cpu', weights_only=False)
+    if fingerprint is not None and state.get('fingerprint') != fingerprint:
+        raise ValueError(f'{path} is from a run with a different config (fingerprint '
+                         f'{state.get("fingerprint")}, expected {fingerprint}), delete it to '
+                         f'start over')
+    model.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    if scheduler is not None and state['scheduler'] is not None:
+        scheduler.load_state_dict(state['scheduler'])
+    if loss_func is not None and state['loss_func'] is not None:
+        loss_func.load_state_dict(state['loss_func'])
+    set_rng_state(state['rng'])
+    return state['epoch'], state['best_state'], state['best_loss']
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import queue
+import shlex
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Thread pools of torch/numpy backends, capped for each local job
+THREAD_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+               'NUMEXPR_NUM_THREADS']
+
+
+def make_job(name, module, arg_string, log_dir, script=None, pythonpath=None):
+    '''A sweep job: `python -m mre.<module> <arg_string>`, logging to `<log_dir>/<name>.stdout` and
+    `.stderr` (the slurm_outputs layout).  `script` is the sbatch script for the slurm backend,
+    `pythonpath` a code snapshot (see `mre.snapshot`) to import mre from.'''
+    return {'name': name, 'module': module, 'args': shlex.split(arg_string),
+            'stdout': str(Path(log_dir, f'{name}.stdout')),
+            'stderr': str(Path(log_dir, f'{name}.stderr')), 'script': script,
+            'pythonpath': None if pythonpath is None else str(pythonpath)}
+
+
+# Sets the address space limit in the child itself and execs the job, since a `preexec_fn` is not
+# safe to use from the threads of LocalExecutor
+LIMIT_MEMORY = ('import os, resource, sys; limit = int(sys.argv[1]); '
+                'resource.setrlimit(resource.RLIMIT_AS, (limit, limit)); '
+                'os.execv(sys.argv[2], sys.argv[2:])')
+
+
+def job_command(job, python=sys.executable, mem_gb=None):
+    module = job['module'].replace('.py', '')
+    command = [python, '-m', f'mre.{module}'] + job['args']
+    if mem_gb:
+        command = [python, '-c', LIMIT_MEMORY, str(int(mem_gb*1024**3))] + command
+    return command
+
+
+def run_job(job, env=None, cwd=None, python=sys.executable, mem_gb=None):
+    '''Run one job in a subprocess, with its output in the job's stdout/stderr files, `env`
+    added to the environment and an address space limit of `mem_gb` GB.  Returns the exit code.'''
+    full_env = dict(os.environ, PYTHONUNBUFFERED='1')
+    if job['pythonpath'] is not None:
+        full_env['PYTHONPATH'] = os.pathsep.join(
+            [job['pythonpath']] + ([full_env['PYTHONPATH']] if full_env.get('PYTHONPATH') else []))
+    full_env.update(env or {})
+    Path(job['stdout']).parent.mkdir(parents=True, exist_ok=True)
+    with open(job['stdout'], 'w') as out, open(job['stderr'], 'w') as err:
+        proc = subprocess.run(job_command(job, python, mem_gb), stdout=out, stderr=err,
+                              env=full_env, cwd=cwd)
+    print(f'{job["name"]} finished with exit code {proc.returncode}')
+    return proc.returncode
+
+
+def pack_jobs(jobs, pack=1):
+    '''Group `jobs` into array tasks of (at most) `pack` jobs each, in submission order.'''
+    if pack < 1:
+        raise ValueError(f'pack must be at least 1, got {pack}')
+    return [jobs[i:i+pack] for i in range(0, len(jobs), pack)]
+
+
+def write_task_table(tasks, path):
+    '''Write the task index -> jobs table of a job array (see `pack_jobs`), returns its path.'''
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'tasks': tasks}, f, indent=2)
+    return str(path)
+
+
+def read_task_table(path):
+    with open(path) as f:
+        return json.load(f)['tasks']
+
+
+def run_task(table, index):
+    '''Run the jobs of array task `index` of a task table one after the other.  Every job still
+    logs to its own stdout/stderr files.  Returns 0 if all of them succeeded, else the last
+    non-zero exit code.'''
+    tasks = read_task_table(table)
+    if not 0 <= index < len(tasks):
+        raise IndexError(f'Task {index} not in {table} ({len(tasks)} tasks)')
+    code = 0
+    for job in tasks[index]:
+        code = run_job(job) or code
+    return code
+
+
+class DryExecutor:
+    '''Print the jobs of a sweep without running them.'''
+    name = 'dry'
+
+    def __init__(self, verbose=True):
+        self.verbose = verbose
+        self.jobs = []
+
+    def submit(self, job):
+        self.jobs.append(job)
+        if self.verbose:
+            print(f'[dry] {job["name"]}: {" ".join(job_command(job, "python"))}')
+
+    def wait(self):
+        return {job['name']: None for job in self.jobs}
+
+
+class SlurmExecutor:
+    '''Submit each job's sbatch script.'''
+    name = 'slurm'
+
+    def __init__(self):
+        self.job_ids = {}
+
+    def submit(self, job):
+        if job['script'] is None:
+            raise ValueError(f'Job {job["name"]} has no slurm script')
+        self.submit_script(job['name'], job['script'])
+
+    def submit_script(self, name, script):
+        '''sbatch `script` (a single job or a whole job array) and record its id under `name`.'''
+        out = subprocess.run(['sbatch', script], capture_output=True, text=True)
+        print(out.stdout.strip() or out.stderr.strip())
+        self.job_ids[name] = out.stdout.strip().split()[-1] if out.returncode == 0 else None
+
+    def wait(self):
+        '''Slurm jobs run asynchronously, returns the submitted job ids.'''
+        return self.job_ids
+
+
+class LocalExecutor:
+    '''Run the jobs of a sweep as subprocesses on this machine, `n_workers` at a time.
+
+    Args:
+        n_workers (int): Number of concurrent jobs.
+        threads (int): CPU threads per job (OMP/MKL/OpenBLAS), default unlimited.
+        mem_gb (float): Address space limit per job, in GB.  Meant for CPU jobs, CUDA reserves
+            far more virtual memory than it uses.
+        gpus (list): GPU ids.  Each running job gets one of them via CUDA_VISIBLE_DEVICES, so at
+            most len(gpus) jobs run at once.
+        cwd (str): Working directory of the jobs.
+    '''
+    name = 'local'
+
+    def __init__(self, n_workers=1, threads=None, mem_gb=None, gpus=None, cwd=None,
+                 python=sys.executable):
+        if gpus:
+            n_workers = min(n_workers, len(gpus))
+            self.gpus = queue.Queue()
+            for gpu in gpus:
+                self.gpus.put(str(gpu))
+        else:
+            self.gpus = None
+        self.threads = threads
+        self.mem_gb = mem_gb
+        self.cwd = cwd
+        self.python = python
+        self.pool = ThreadPoolExecutor(max_workers=n_workers)
+        self.futures = {}
+
+    def _run(self, job):
+        env = {var: str(self.threads) for var in THREAD_VARS} if self.threads is not None else {}
+        gpu = self.gpus.get() if self.gpus is not None else None
+        if gpu is not None:
+            env['CUDA_VISIBLE_DEVICES'] = gpu
+        try:
+            return run_job(job, env, self.cwd, self.python, self.mem_gb)
+        finally:
+            if gpu is not None:
+                self.gpus.put(gpu)
+
+    def submit(self, job):
+        self.futures[job['name']] = self.pool.submit(self._run, job)
+
+    def wait(self):
+        '''Block until all jobs are done, returns their exit codes.'''
+        codes = {name: future.result() for name, future in self.futures.items()}
+        self.pool.shutdown()
+        return codes
+
+
+EXECUTORS = {'slurm': SlurmExecutor, 'local': LocalExecutor, 'dry': DryExecutor}
+
+
+def get_executor(backend, **kwargs):
+    '''Executor for `backend` ('slurm', 'local' or 'dry'), kwargs go to its constructor.'''
+    if backend not in EXECUTORS:
+        raise ValueError(f'Unknown backend "{backend}", use one of {list(EXECUTORS)}')
+    return EXECUTORS[backend](**kwargs)
+
+
+if __name__ == '__main__':
+    # entry point of the job array tasks: python -m mre.executors <task_table> <task_index>
+    sys.exit(run_task(sys.argv[1], int(sys.argv[2])))
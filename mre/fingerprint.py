@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+
+PACKAGE_DIR = Path(__file__).parent
+
+# cfg keys that do not change the trained model or its predictions
+IGNORED_KEYS = ['model_version', 'subj_group', 'verbose', 'output_path', 'dry_run', 'num_workers',
+                'profile', 'split_cache', 'code_version', 'export_model', 'asha_dir',
+                'asha_stopped_at', 'resume', 'checkpoint_every', 'norm_clin_vals', 'best_loss',
+                'test_mse', 'true_ave_stiff', 'test_ave_stiff']
+
+
+def code_files(package_dir=PACKAGE_DIR):
+    '''Source files that define the behaviour of the package (python modules and split files).'''
+    files = [path for pattern in ['*.py', 'splits/*.json']
+             for path in Path(package_dir).glob(pattern)]
+    return sorted(files)
+
+
+def code_version(package_dir=PACKAGE_DIR):
+    '''Content hash of the package source, independent of git and of where the code lives.'''
+    sha = hashlib.sha256()
+    for path in code_files(package_dir):
+        sha.update(str(path.relative_to(package_dir)).encode())
+        sha.update(path.read_bytes())
+    return sha.hexdigest()[:16]
+
+
+def _canonical(val):
+    if isinstance(val, (list, tuple)):
+        return [_canonical(i) for i in val]
+    elif isinstance(val, dict):
+        return {str(k): _canonical(v) for k, v in val.items()}
+    elif isinstance(val, np.generic):
+        return val.item()
+    elif isinstance(val, Path):
+        return str(val)
+    return val
+
+
+def config_fingerprint(cfg, code_version):
+    '''Hash of a resolved config (see `train_mre_model.run_fingerprint`) and the code version.
+    Keys in `IGNORED_KEYS` are left out, so runs that only differ in names, logging or output
+    location get the same fingerprint.'''
+    canonical = {key: _canonical(val) for key, val in cfg.items() if key not in IGNORED_KEYS}
+    payload = json.dumps({'cfg': canonical, 'code': code_version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+
+def run_record_path(output_path, fingerprint):
+    return Path(output_path, 'fingerprints', f'{fingerprint}.json')
+
+
+def write_run_record(output_path, fingerprint, model_version, subj_group, **files):
+    '''Record a completed run under `<output_path>/fingerprints/<fingerprint>.json`.  `files` are
+    the run's outputs (config, model, predictions), stored relative to `output_path`.'''
+    record = {'fingerprint': fingerprint, 'model_version': model_version,
+              'subj_group': subj_group, 'date': datetime.today().strftime('%Y-%m-%d_%H-%M-%S'),
+              'files': {key: str(Path(path).relative_to(output_path))
+                        for key, path in files.items()}}
+    path = run_record_path(output_path, fingerprint)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def find_completed_run(output_path, fingerprint):
+    '''The record of a completed run with this fingerprint whose outputs all still exist, or
+    None.'''
+    path = run_record_path(output_path, fingerprint)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        record = json.load(f)
+    if not all(Path(output_path, rel).exists() for rel in record['files'].values()):
+        return None
+    return record
+
+
+def output_file(key, model_version, subj_group):
+    '''Path of a run output relative to output_path, in the layout of `train_model_full`: 'config',
+    'model' or 'xr_<set>' (train, val or test predictions).'''
+    if key == 'config':
+        return Path('config', f'{model_version}_{subj_group}.pkl')
+    elif key == 'model':
+        return Path('trained_models', subj_group, f'model_{model_version}.pkl')
+    elif key.startswith('xr_'):
+        return Path('XR', model_version, key[3:], f'xarray_pred_{subj_group}.nc')
+    raise ValueError(f'Unknown run output "{key}"')
+
+
+def relink_run(output_path, record, model_version, subj_group):
+    '''Symlink the outputs of a completed run under a new model_version and subj_group, so the
+    new sweep finds them where it would have written them.
+
+    Returns:
+        List of the new links.
+    '''
+    links = []
+    for key, rel in record['files'].items():
+        link = Path(output_path, output_file(key, model_version, subj_group))
+        if link == Path(output_path, rel) or link.exists():
+            continue
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(Path(output_path, rel))
+        links.append(link)
+    return links
@@ -0,0 +1,263 @@
+import copy
+from pathlib import Path
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from mre.pytorch_arch_deeplab import SeparableConv3d, _ASPPModule
+from mre.pytorch_arch_models_genesis import ContBatchNorm3d
+
+# (conv, norm) attribute pairs that are applied back to back in the forward of these modules.
+# Pairs inside an nn.Sequential are found automatically.
+_CONV_NORM_PAIRS = {
+    'AlignedXception': [('conv1', 'norm1'), ('conv2', 'norm2')],
+    'Block': [('skip', 'skipnorm')],
+    'ASPP': [('conv1', 'norm')],
+    'Decoder': [('conv1', 'norm')],
+    'DecoderFeatures': [('conv1', 'norm')],
+    'LUConv': [('conv1', 'bn1')],
+}
+
+
+def compile_model(model, mode='compile'):
+    '''Wrap a model for faster execution.  The returned module shares parameters with `model`, so
+    weights can still be saved (or loaded) through the original, uncompiled module.
+
+    Args:
+        model (nn.Module): Model to compile (DeepLab, GeneralUNet3D, UNet3D, ...).
+        mode (str): 'compile' for `torch.compile`, or False/None to return the model untouched.
+    '''
+    if not mode:
+        return model
+    elif mode in [True, 'compile']:
+        if not hasattr(torch, 'compile'):
+            raise ValueError('torch.compile requires torch >= 2.0')
+        return torch.compile(model)
+    else:
+        raise ValueError(f'Unknown compile mode "{mode}"')
+
+
+def fold_conv_bn(conv, norm):
+    '''Return a new Conv3d equal to `norm(conv(x))` for an eval-mode BatchNorm3d `norm`.'''
+    scale = norm.weight.detach()/torch.sqrt(norm.running_var + norm.eps)
+    if conv.bias is not None:
+        bias = conv.bias.detach()
+    else:
+        bias = torch.zeros_like(norm.running_mean)
+
+    fused = nn.Conv3d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+                      bias=True, padding_mode=conv.padding_mode)
+    fused = fused.to(device=conv.weight.device, dtype=conv.weight.dtype)
+    fused.weight.data.copy_(conv.weight.detach()*scale.view(-1, 1, 1, 1, 1))
+    fused.bias.data.copy_((bias - norm.running_mean)*scale + norm.bias.detach())
+    return fused
+
+
+def fix_cont_batchnorm(model):
+    '''Replace every `ContBatchNorm3d` (which always normalizes with batch statistics) by an
+    eval-mode BatchNorm3d that uses its running statistics.  This changes the predictions of
+    ModelsGenesis models, so it is opt-in.'''
+    for name, module in model.named_children():
+        if isinstance(module, ContBatchNorm3d):
+            norm = nn.BatchNorm3d(module.num_features, eps=module.eps, momentum=module.momentum,
+                                  affine=module.affine)
+            norm.load_state_dict(module.state_dict())
+            setattr(model, name, norm.to(module.running_mean.device).eval())
+        else:
+            fix_cont_batchnorm(module)
+    return model
+
+
+def _is_bn(module):
+    return type(module) is nn.BatchNorm3d
+
+
+def _fold_module(module):
+    if isinstance(module, (SeparableConv3d, _ASPPModule)):
+        module.fuse()
+    elif isinstance(module, nn.Sequential):
+        for i in range(len(module) - 1):
+            if isinstance(module[i], nn.Conv3d) and _is_bn(module[i+1]):
+                module[i] = fold_conv_bn(module[i], module[i+1])
+                module[i+1] = nn.Identity()
+    for conv_name, norm_name in _CONV_NORM_PAIRS.get(type(module).__name__, []):
+        conv = getattr(module, conv_name, None)
+        norm = getattr(module, norm_name, None)
+        if isinstance(conv, nn.Conv3d) and _is_bn(norm):
+            setattr(module, conv_name, fold_conv_bn(conv, norm))
+            setattr(module, norm_name, nn.Identity())
+    for child in module.children():
+        _fold_module(child)
+
+
+def freeze_for_inference(model, fix_cont_bn=False):
+    '''Return an inference-only copy of `model` with the norm layers folded away.
+
+    Conv3d+BatchNorm3d pairs (including the separable convs of DeepLab) are folded into a single
+    conv, parameters are frozen and the copy is put in eval mode.  GroupNorm layers cannot be
+    folded and are kept.  The frozen copy matches the eval-mode predictions of `model`.
+
+    Args:
+        model (nn.Module): DeepLab, GeneralUNet3D, UNet3D, ... (a compiled model is unwrapped).
+        fix_cont_bn (bool): Also convert ModelsGenesis' `ContBatchNorm3d` to fixed running
+            statistics (see `fix_cont_batchnorm`), so they can be folded too.  Without it those
+            layers keep normalizing with batch statistics.
+    '''
+    model = copy.deepcopy(getattr(model, '_orig_mod', model))
+    model.eval()
+    if fix_cont_bn:
+        fix_cont_batchnorm(model)
+    with torch.no_grad():
+        _fold_module(model)
+    model.requires_grad_(False)
+    return model.eval()
+
+
+def gaussian_weights(tile_size, sigma_scale=0.125, device='cpu', dtype=torch.float32):
+    '''Separable Gaussian importance map for blending overlapping tiles, peaked at the tile center.
+    Clamped away from zero so every voxel of a tile gets some weight.'''
+    weights = torch.ones(tile_size, device=device, dtype=dtype)
+    for dim, size in enumerate(tile_size):
+        coords = torch.arange(size, device=device, dtype=dtype) - (size - 1)/2
+        gauss = torch.exp(-0.5*(coords/max(size*sigma_scale, 1e-6))**2)
+        shape = [1]*len(tile_size)
+        shape[dim] = size
+        weights = weights*gauss.view(shape)
+    return weights.clamp(min=1e-3)
+
+
+def _tile_starts(size, tile, step):
+    starts = list(range(0, size - tile + 1, step))
+    if starts[-1] != size - tile:
+        starts.append(size - tile)
+    return starts
+
+
+def sliding_window_predict(model, inputs, tile_size=(32, 256, 256), overlap=0.25, tile_batch=1,
+                           clinical=None, sigma_scale=0.125, device=None, out_device='cpu'):
+    '''Predict volumes of any size by running `model` over overlapping 3D tiles.
+
+    Tile outputs are blended with a Gaussian importance map, so seams between tiles are smoothed.
+    Only `tile_batch` tiles are run at once and the blended output is accumulated on `out_device`,
+    which bounds the memory needed for large volumes.  Volumes smaller than a tile are zero-padded.
+    Works for any model whose (first) output has the same spatial shape as its input; the extra
+    outputs of a wave model (e.g. `freq`) are returned from the last tile batch.
+
+    Args:
+        model (nn.Module): Segmentation or regression model, already in eval mode (artifacts from
+            `load_model_artifact` are).
+        inputs (torch.Tensor): (N, C, Z, Y, X) volumes.
+        tile_size (tuple): (z, y, x) tile shape, usually the training volume shape.
+        overlap (float): Fraction of a tile that overlaps with its neighbour, in [0, 1).
+        tile_batch (int): Number of tiles per forward pass.
+        clinical (torch.Tensor): Optional (N, F) clinical features, passed along with every tile.
+        sigma_scale (float): Gaussian sigma as a fraction of the tile size.
+        device (str): Device to run the model on.  Defaults to the model's device.
+        out_device (str): Device the blended prediction is accumulated on.
+
+    Returns:
+        (N, C_out, Z, Y, X) prediction, or a tuple with the prediction first for wave models.
+    '''
+    if not 0 <= overlap < 1:
+        raise ValueError(f'overlap must be in [0, 1), got {overlap}')
+    if inputs.dim() != 5:
+        raise ValueError(f'expected 5D input (got {inputs.dim()}D input)')
+    if device is None:
+        device = next(model.parameters()).device
+    tile_size = tuple(int(t) for t in tile_size)
+    spatial = inputs.shape[2:]
+
+    pad = [max(t - s, 0) for t, s in zip(tile_size, spatial)]
+    if any(pad):
+        inputs = F.pad(inputs, [0, pad[2], 0, pad[1], 0, pad[0]])
+    padded = inputs.shape[2:]
+    steps = [max(int(t*(1 - overlap)), 1) for t in tile_size]
+    starts = [_tile_starts(s, t, step) for s, t, step in zip(padded, tile_size, steps)]
+    corners = [(z, y, x) for z in starts[0] for y in starts[1] for x in starts[2]]
+
+    weights = gaussian_weights(tile_size, sigma_scale, device=out_device)
+    out_sum = None
+    extra = None
+    with torch.no_grad():
+        for n in range(inputs.shape[0]):
+            for i in range(0, len(corners), tile_batch):
+                batch_corners = corners[i:i+tile_batch]
+                tiles = torch.cat([inputs[n:n+1, :, z:z+tile_size[0], y:y+tile_size[1],
+                                          x:x+tile_size[2]] for z, y, x in batch_corners])
+                tiles = tiles.to(device)
+                if clinical is None:
+                    output = model(tiles)
+                else:
+                    output = model(tiles, clinical[n:n+1].expand(len(batch_corners), -1).to(device))
+                if isinstance(output, tuple):
+                    output, extra = output[0], output[1:]
+                if tuple(output.shape[2:]) != tile_size:
+                    raise ValueError(f'model output {tuple(output.shape)} is not spatially '
+                                     f'aligned with tile {tile_size}, tiling does not apply')
+                output = output.to(out_device)
+                if out_sum is None:
+                    out_sum = torch.zeros((inputs.shape[0], output.shape[1]) + tuple(padded),
+                                          device=out_device, dtype=output.dtype)
+                    weight_sum = torch.zeros(padded, device=out_device, dtype=output.dtype)
+                for tile, (z, y, x) in zip(output, batch_corners):
+                    out_sum[n, :, z:z+tile_size[0], y:y+tile_size[1],
+                            x:x+tile_size[2]] += tile*weights
+                    if n == 0:
+                        weight_sum[z:z+tile_size[0], y:y+tile_size[1], x:x+tile_size[2]] += weights
+
+    prediction = (out_sum/weight_sum)[..., :spatial[0], :spatial[1], :spatial[2]]
+    if extra is not None:
+        return (prediction,) + tuple(extra)
+    return prediction
+
+
+def export_model(model, path, example_inputs, method='trace'):
+    '''Write a standalone inference artifact of `model`.
+
+    The model is exported in eval mode from `example_inputs`, a tuple of the forward args, i.e.
+    `(inputs,)` or `(inputs, clinical)`.  Models that return `(x, freq)` (wave=True) keep that tuple
+    output.
+
+    Args:
+        model (nn.Module): Model to export.
+        path (str or Path): Output file, without suffix.  '.pt' (TorchScript) or '.pt2'
+            (torch.export) is appended.
+        example_inputs (tuple): Example forward args (a single subject is enough).
+        method (str): 'trace' for TorchScript, 'export' for `torch.export`.
+
+    Returns:
+        Path of the written artifact.
+    '''
+    if not isinstance(example_inputs, tuple):
+        example_inputs = (example_inputs,)
+    model = getattr(model, '_orig_mod', model)
+    was_training = model.training
+    model.eval()
+    with torch.no_grad():
+        if method == 'trace':
+            path = Path(str(path)+'.pt')
+            artifact = torch.jit.trace(model, example_inputs)
+            torch.jit.save(artifact, str(path))
+        elif method == 'export':
+            if not hasattr(torch, 'export'):
+                raise ValueError('torch.export requires torch >= 2.1')
+            path = Path(str(path)+'.pt2')
+            artifact = torch.export.export(model, example_inputs)
+            torch.export.save(artifact, str(path))
+        else:
+            raise ValueError(f'Unknown export method "{method}"')
+    model.train(was_training)
+    return path
+
+
+def load_model_artifact(path, map_location='cpu'):
+    '''Load an artifact written by `export_model`.  Returns a callable module in eval mode.'''
+    path = Path(path)
+    if path.suffix == '.pt2':
+        model = torch.export.load(str(path)).module()
+        return model.to(map_location)
+    else:
+        model = torch.jit.load(str(path), map_location=map_location)
+        model.eval()
+        return model
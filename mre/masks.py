@@ -0,0 +1,133 @@
+import os
+import hashlib
+from pathlib import Path
+from collections import OrderedDict
+import numpy as np
+import xarray as xr
+from scipy import ndimage as ndi
+
+# Eroded masks for the evaluation code, computed once per (subject mask, iterations, structure).
+# Results are memoized by the content of the subject's mask, so subsets and copies of a dataset
+# (e.g. the val and test sets of `add_val_linear_cor`) share them.
+
+STRUCTURES = {'2d': ndi.generate_binary_structure(2, 1)[:, :, None],
+              '3d': ndi.generate_binary_structure(3, 1)}
+MEMO_SIZE = 1024
+_MEMO = OrderedDict()
+
+
+def erode_mask(mask, iterations=2, structure='2d'):
+    '''Binary erosion of an (x, y, z) mask.  '2d' erodes every z slice on its own (all slices in one
+    call, the structure has no extent along z), '3d' erodes the volume.  Empty slices are returned
+    unchanged, the others as 0/1 in the mask's dtype.'''
+    if structure not in STRUCTURES:
+        raise ValueError(f'Unknown structure "{structure}", use one of {list(STRUCTURES)}')
+    eroded = np.zeros_like(mask)
+    nonzero = mask != 0
+    xs = np.flatnonzero(nonzero.any(axis=(1, 2)))
+    ys = np.flatnonzero(nonzero.any(axis=(0, 2)))
+    zs = np.flatnonzero(nonzero.any(axis=(0, 1)))
+    if xs.size:
+        # only the bounding box, the voxels around it are background either way
+        box = (slice(xs[0], xs[-1] + 1), slice(ys[0], ys[-1] + 1), slice(zs[0], zs[-1] + 1))
+        eroded[box] = ndi.binary_erosion(nonzero[box], structure=STRUCTURES[structure],
+                                         iterations=iterations)
+    return np.where(mask.mean(axis=(0, 1)) > 0, eroded, mask)
+
+
+def _digest(mask):
+    sha = hashlib.blake2b(f'{mask.shape} {mask.dtype}'.encode(), digest_size=16)
+    sha.update(np.ascontiguousarray(mask).view(np.uint8))
+    return sha.hexdigest()
+
+
+def _memo_get(key):
+    if key in _MEMO:
+        _MEMO.move_to_end(key)
+        return _MEMO[key]
+    return None
+
+
+def _memo_put(key, mask):
+    _MEMO[key] = mask
+    if len(_MEMO) > MEMO_SIZE:
+        _MEMO.popitem(last=False)
+
+
+def clear_memo():
+    _MEMO.clear()
+
+
+def _cache_file(cache_dir, var, mask_type, iterations, structure):
+    return Path(cache_dir, f'eroded_{var}_{mask_type}_{structure}_i{iterations}.nc')
+
+
+def _read_cache(path):
+    '''{digest: (subject, eroded mask)} of a cache file.'''
+    if path is None or not path.exists():
+        return {}
+    with xr.open_dataarray(path) as da:
+        da = da.load()
+    return {digest: (subj, da.values[i])
+            for i, (subj, digest) in enumerate(zip(da.subject.values, da.digest.values))}
+
+
+def _write_cache(path, entries, coords):
+    '''Write {digest: (subject, eroded mask)} entries of the same shape.'''
+    digests = list(entries)
+    da = xr.DataArray(np.stack([entries[digest][1] for digest in digests]),
+                      dims=['subject', 'x', 'y', 'z'],
+                      coords=dict(coords, subject=[entries[digest][0] for digest in digests],
+                                  digest=('subject', digests)))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    da.to_netcdf(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def eroded_masks(ds, iterations=2, structure='2d', var='mask_mre', mask_type='combo',
+                 cache_dir=None):
+    '''Eroded `mask_type` masks of every subject in `ds`.
+
+    Args:
+        ds (xr.Dataset): Dataset with a (subject, mask_type, x, y, z) `var`.
+        iterations (int): Erosion iterations, 0 returns the masks as they are.
+        structure (str): '2d' (per z slice) or '3d', see `erode_mask`.
+        var (str): 'mask_mre' or 'mask_mri'.
+        mask_type (str): Mask to erode.
+        cache_dir (str): Directory (e.g. next to the dataset's netcdf files) to keep the eroded
+            masks in across sessions.
+
+    Returns:
+        (subject, x, y, z) DataArray.
+    '''
+    masks = ds[var].sel(mask_type=mask_type).transpose('subject', 'x', 'y', 'z')
+    if iterations == 0:
+        return masks.copy()
+    values = masks.values
+    path = None
+    if cache_dir is not None:
+        path = _cache_file(cache_dir, var, mask_type, iterations, structure)
+    stored = None
+    new = {}
+    eroded = np.empty_like(values)
+    for i, subj in enumerate(masks.subject.values):
+        digest = _digest(values[i])
+        key = (iterations, structure, digest)
+        mask = _memo_get(key)
+        if mask is None:
+            if stored is None:
+                stored = _read_cache(path)
+            if digest in stored:
+                mask = stored[digest][1]
+            else:
+                mask = erode_mask(values[i], iterations, structure)
+                new[digest] = (subj, mask)
+            _memo_put(key, mask)
+        eroded[i] = mask
+    if path is not None and new:
+        coords = {dim: masks[dim].values for dim in ['x', 'y', 'z'] if dim in masks.coords}
+        same_shape = {digest: entry for digest, entry in stored.items()
+                      if entry[1].shape == values.shape[1:]}
+        _write_cache(path, dict(same_shape, **new), coords)
+    return masks.copy(data=eroded)
@@ -10,28 +10,21 @@ import xarray as xr
 import pickle as pkl
 import glob
 from datetime import datetime
-from scipy import ndimage as ndi
-from scipy.signal import find_peaks
-import SimpleITK as sitk
 import skimage as skim
 from skimage import feature, morphology, exposure
 from skimage.filters import sobel
 import PIL
 from tqdm import tqdm_notebook
-from medpy.filter.smoothing import anisotropic_diffusion
 # import matplotlib.pyplot as plt
 # import holoviews as hv
 
 import torch
 from torch.utils.data import Dataset
-from torchvision import transforms
-import torchvision.transforms.functional as TF
 from scipy.ndimage import gaussian_filter, median_filter
 
-from mre.registration import RegPatient, Register
-from mre.pytorch_arch_old import GeneralUNet3D
-from mre.pytorch_arch_deeplab import DeepLab
-from mre.pytorch_arch_models_genesis import UNet3D
+
+# SimpleITK, registration, torchvision, medpy and the mask models are imported where they are used,
+# so that opening an xarray (or importing this module in a training job) stays fast.
 
 
 class MREtoXr:
@@ -128,6 +121,10 @@ class MREtoXr:
         self.nz_mri = kwargs.get('nz_mri', 32)
         self.nz_mre = kwargs.get('nz_mre', 4)
         self.mask_arch = kwargs.get('mask_arch', 'ModelsGenesis')
+        self.mask_model_file = kwargs.get('mask_model_file', None)
+        self.mask_precision = kwargs.get('mask_precision', 'fp32')
+        self.mask_calib_file = kwargs.get('mask_calib_file', None)
+        self.mask_calib_volumes = kwargs.get('mask_calib_volumes', 4)
         self.mask_types = kwargs.get('mask_types', ['liver', 'mre', 'combo'])
         self.primary_input = kwargs.get('primary_input', 't1_pre_water')
         self.mre_types = kwargs.get('mre_types', ['mre', 'mre_mask', 'mre_raw', 'wave',
@@ -159,7 +156,14 @@ class MREtoXr:
         # model_path = Path('/pghbio/dbmi/batmanlab/bpollack/predictElasticity/data/CHAOS/',
         #                   'trained_models', '001', 'model_2020-02-12_14-14-16.pkl')
         # NEWER VERSION
-        if self.mask_arch == 'DeepLab':
+        from mre.pytorch_arch_deeplab import DeepLab
+        from mre.pytorch_arch_models_genesis import UNet3D
+        from mre.inference import load_model_artifact
+        if self.mask_model_file is not None:
+            # Exported (TorchScript or torch.export) artifact of the mask_arch model
+            self.model = load_model_artifact(self.mask_model_file, map_location='cpu')
+
+        elif self.mask_arch == 'DeepLab':
             model_path = Path('/pghbio/dbmi/batmanlab/bpollack/predictElasticity/data/CHAOS/',
                               'trained_models', '001', 'model_2020-04-02_13-54-57.pkl')
             with torch.no_grad():
@@ -181,9 +185,30 @@ class MREtoXr:
                 self.model.load_state_dict(model_dict, strict=True)
                 self.model.eval()
 
+        # Optional reduced precision (bf16 or int8) mask model for CPU nodes
+        if self.mask_precision != 'fp32':
+            self.reduce_mask_precision()
+
         # Initialize empty ds
         self.init_new_ds()
 
+    def reduce_mask_precision(self):
+        '''Swap the ModelsGenesis mask model for a bf16 or int8 copy.  Calibration and the Dice
+        agreement check against fp32 use a few CHAOS volumes from `mask_calib_file`.'''
+        from mre.quantization import calibration_volumes, quantize_model, check_agreement
+        if self.mask_arch != 'ModelsGenesis' or self.mask_model_file is not None:
+            raise ValueError('mask_precision is only supported for the ModelsGenesis state dict')
+        volumes = None
+        if self.mask_calib_file is not None:
+            volumes = calibration_volumes(xr.open_dataset(self.mask_calib_file),
+                                          n_volumes=self.mask_calib_volumes)
+        elif self.mask_precision == 'int8':
+            raise ValueError('mask_calib_file is required for int8 mask_precision')
+        model = quantize_model(self.model, self.mask_precision, calib_volumes=volumes)
+        if volumes is not None:
+            check_agreement(self.model, model, volumes)
+        self.model = model
+
     def get_ds(self):
         '''Return the ds loaded via 'from_file'.'''
         return self.ds
@@ -240,6 +265,8 @@ class MREtoXr:
             )
 
     def load_xr(self):
+        import SimpleITK as sitk
+        from mre.registration import RegPatient, Register
         # Grab all available niftis using the RegPatient Class
         print(self.patient, self.data_dir)
         reg_pat = RegPatient(self.patient, self.data_dir)
@@ -353,6 +380,7 @@ class MREtoXr:
 
     def resize_wave(self, wave, mre_raw):
         '''Take an input image and resize it to the appropriate resolution.'''
+        import SimpleITK as sitk
         # Get initial and resizing params
         wave_size = wave.GetSize()
         raw_size = mre_raw.GetSize()
@@ -376,6 +404,7 @@ class MREtoXr:
 
     def resize_image(self, input_image, var_name):
         '''Take an input image and resize it to the appropriate resolution.'''
+        import SimpleITK as sitk
         # Get initial and resizing params
         init_size = input_image.GetSize()
         init_spacing = input_image.GetSpacing()
@@ -418,6 +447,7 @@ class MREtoXr:
         '''Function for changing the spacing of an image, given supplied ideal spacing.
         This is meant for use with the MRE images as they cannot be registered to the inputs.
         '''
+        import SimpleITK as sitk
         # Get initial params
         nx = self.nx
         ny = self.ny
@@ -481,19 +511,14 @@ class MREtoXr:
             output_image_np = np.transpose(model_pred.cpu().numpy()[0, 0, :], (2, 1, 0))
             output_image_np = np.where(output_image_np > 0.5, 1, 0)
         elif self.mask_arch == 'ModelsGenesis':
-            image = input_image_np*1.0
-            v_min, v_max = np.percentile(image, (0.5, 99.5))
-            for i in range(image.shape[0]):
-                image[i, :] = exposure.rescale_intensity(image[i], in_range=(v_min, v_max),
-                                                         out_range=(-1.0, 1.0))
-
-            image = image[np.newaxis, np.newaxis, :]
+            from mre.quantization import models_genesis_input
+            image = models_genesis_input(input_image_np)
 
             # get the model prediction (liver mask)
             with torch.no_grad():
                 print('starting torch model loading')
-                # model_pred = self.model(torch.Tensor(image).to('cuda:0'))
-                model_pred = self.model(torch.Tensor(image))
+                # model_pred = self.model(image.to('cuda:0'))
+                model_pred = self.model(image)
                 print('sigmoid func')
                 model_pred = torch.sigmoid(model_pred)
                 print('torch done')
@@ -528,6 +553,9 @@ class MREtoXr:
             self.ds['mask_mre'].loc[dict(mask_type='mre', z_mre=z, subject=subj)] = msk
 
     def align_mre_raw(self, fixed, moving, pat):
+        import SimpleITK as sitk
+        from scipy.signal import find_peaks
+        from mre.registration import Register
         pad = np.full((256, 256), 0, np.int16)
         ones = np.full((256, 256), 1, np.int16)
         pad = sitk.GetImageFromArray(pad)
@@ -608,6 +636,8 @@ class MREtoXr:
         return peaks
 
     def reg_inputs(self, reg_pat):
+        import SimpleITK as sitk
+        from mre.registration import Register
         for seq in self.sequences:
             if seq == self.primary_input:
                 continue
@@ -778,6 +808,12 @@ class MRETorchDataset(Dataset):
                 'subject', 'mre_type', 'z', 'y', 'x').values
             self.mask_images = self.xa_ds.sel(mask_type=[self.mask]).mask_mre.transpose(
                 'subject', 'mask_type', 'z', 'y', 'x').values
+            if self.erode_mask != 0:
+                # per z slice, as in `affine_transform`, for all subjects once
+                from mre.masks import eroded_masks
+                self.mask_images = eroded_masks(self.xa_ds, self.erode_mask,
+                                                mask_type=self.mask).transpose(
+                    'subject', 'z', 'y', 'x').values[:, None]
 
             self.names = self.xa_ds.subject.values
 
@@ -863,6 +899,7 @@ class MRETorchDataset(Dataset):
                 elif self.smear == 'median':
                     target_tmp = median_filter(target[i][j], size=sigma)
                 elif self.smear == 'aniso':
+                    from medpy.filter.smoothing import anisotropic_diffusion
                     with warnings.catch_warnings():
                         warnings.filterwarnings("ignore", message="using a non-tuple sequence")
                         target_tmp = anisotropic_diffusion(target[i][j], niter=sigma, option=2,
@@ -879,8 +916,7 @@ class MRETorchDataset(Dataset):
         mask_list = []
         for j in range(mask.shape[1]):
             mask_list.append(self.affine_transform(mask[0][j], rot_angle_xy, translations_xy,
-                                                   scale, resample=PIL.Image.NEAREST,
-                                                   erode_mask=self.erode_mask))
+                                                   scale, resample=PIL.Image.NEAREST))
         mask = torch.cat(mask_list)
 
         image = torch.FloatTensor(image)
@@ -892,9 +928,11 @@ class MRETorchDataset(Dataset):
 
     def affine_transform(self, input_slice, rot_angle=0, translations=0, scale=1, resample=None,
                          erode_mask=0):
+        from torchvision import transforms
+        import torchvision.transforms.functional as TF
         if erode_mask != 0:
-            input_slice = ndi.binary_erosion(
-                input_slice, iterations=erode_mask).astype(input_slice.dtype)
+            from mre.masks import erode_mask as erode
+            input_slice = erode(input_slice[:, :, None], erode_mask)[:, :, 0]
         outer_pixel_val = int(np.concatenate([input_slice[0, :], input_slice[-1, :],
                                               input_slice[:, 0], input_slice[:, -1]]).mean())
         input_slice = transforms.ToPILImage()(input_slice)
@@ -1079,11 +1117,20 @@ class TorchToXr:
 class ModelCompare:
     '''
     Simple Class for making an xarray made for many model predictions.
+
+    The dataset is lazy: the base and prediction files stay on disk as dask-backed variables
+    chunked along subject, and the predictions are concatenated to the base MRE images along
+    `mre_type` without materializing, so a comparison only ever holds a few subjects in memory.
+    Call `self.ds.load()` (or pass `chunks=None`) to bring it all into memory.
+
+    Args:
+        chunks (int): Subjects per chunk, None loads the dataset into memory.
+        dtype (str): dtype of `image_mre`, 'float32' halves the memory of float64 predictions.
     '''
 
     def __init__(self, base_model_path='/pghbio/dbmi/batmanlab/Data/MRE/XR_full_gold_v3/*.nc',
                  pred_dict=None, do_clin=True, wave=False, drop_eovist=False, eovist_only=False,
-                 eovist_combo=False):
+                 eovist_combo=False, chunks=1, dtype='float32'):
 
         if pred_dict is None:
             pred_dict = {}
@@ -1096,16 +1143,21 @@ class ModelCompare:
         self.drop_eovist = drop_eovist
         self.eovist_only = eovist_only
         self.eovist_combo = eovist_combo
+        self.chunks = chunks
+        self.dtype = np.dtype(dtype)
         self.eovist_list = ['0510', '1793', '0931', '0932', '0940', '1474', '1435', '0219']
         if self.drop_eovist and self.eovist_only:
             raise ValueError('cannot have both `drop_eovist` and `eovist_only`')
         self.init_new_ds(base_model_path, pred_dict.keys())
         self.add_predictions(pred_dict)
+        if self.chunks is None:
+            self.ds.load()
 
     def init_new_ds(self, base_model_path, pred_names):
         '''Initialize a new xarray dataset based on the size and shape of our inputs.'''
 
-        # Generate an xarray dataset from a saved base model and append all the saved predictions
+        # Generate an xarray dataset from a saved base model, the predictions are appended along
+        # mre_type by `add_predictions`.
         # All 4 data vars are 5D (subject, sequence/mask_type, x, y, z).
 
         print(base_model_path)
@@ -1123,103 +1175,16 @@ class ModelCompare:
 
         mre_type = list(base_ds.mre_type.values)
         mre_type.remove('mre_pred')
-        if self.eovist_combo:
-            mre_type += ['pred']
-        else:
-            mre_type += pred_names
-        # mre_type
+        image_mre = base_ds['image_mre'].sel(mre_type=mre_type).astype(self.dtype)
+        data_vars = ['image_mri', 'mask_mri', 'mask_mre', 'mri_to_mre_idx']
         if self.do_clin:
-            self.ds = xr.Dataset(
-                {'image_mri': (['subject', 'sequence', 'x', 'y', 'z'],
-                               base_ds['image_mri']),
-                 'mask_mri': (['subject', 'mask_type', 'x', 'y', 'z'],
-                              base_ds['mask_mri']),
-                 'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'],
-                               np.zeros((len(base_ds.subject),
-                                         len(mre_type),
-                                         len(base_ds.x), len(base_ds.y), len(base_ds.z)),
-                                        dtype=np.float)),
-                 'mask_mre': (['subject', 'mask_type', 'x', 'y', 'z'],
-                              base_ds['mask_mre']),
-                 'mri_to_mre_idx': (['subject', 'z_idx'],
-                                    base_ds['mri_to_mre_idx']),
-                 'val_slope': (['subject', 'mre_type'],
-                               np.ones((len(base_ds.subject),
-                                        len(mre_type)),
-                                       dtype=np.float)),
-                 'val_intercept': (['subject', 'mre_type'],
-                                   np.zeros((len(base_ds.subject),
-                                             len(mre_type)),
-                                            dtype=np.float)),
-
-                 'age': (['subject'], base_ds['age']),
-                 'gender': (['subject'], base_ds['gender']),
-                 'height': (['subject'], base_ds['height']),
-                 'weight': (['subject'], base_ds['weight']),
-                 'bmi': (['subject'], base_ds['bmi']),
-                 'htn': (['subject'], base_ds['htn']),
-                 'hld': (['subject'], base_ds['hld']),
-                 'dm': (['subject'], base_ds['dm']),
-                 'ast': (['subject'], base_ds['ast']),
-                 'alt': (['subject'], base_ds['alt']),
-                 'alk': (['subject'], base_ds['alk']),
-                 'tbili': (['subject'], base_ds['tbili']),
-                 'albumin': (['subject'], base_ds['albumin']),
-                 'plt': (['subject'], base_ds['plt'])
-                 },
-
-                coords={'subject': base_ds.subject,
-                        'sequence': base_ds.sequence,
-                        'mask_type': base_ds.mask_type,
-                        'mre_type': mre_type,
-                        'x': base_ds.x,
-                        'y': base_ds.y,
-                        'z': base_ds.z
-                        }
-            )
-        else:
-            self.ds = xr.Dataset(
-                {'image_mri': (['subject', 'sequence', 'x', 'y', 'z'],
-                               base_ds['image_mri']),
-                 'mask_mri': (['subject', 'mask_type', 'x', 'y', 'z'],
-                              base_ds['mask_mri']),
-                 'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'],
-                               np.zeros((len(base_ds.subject),
-                                         len(mre_type),
-                                         len(base_ds.x), len(base_ds.y), len(base_ds.z)),
-                                        dtype=np.float)),
-                 'mask_mre': (['subject', 'mask_type', 'x', 'y', 'z'],
-                              base_ds['mask_mre']),
-                 'mri_to_mre_idx': (['subject', 'z_idx'],
-                                    base_ds['mri_to_mre_idx']),
-                 'val_slope': (['subject', 'mre_type'],
-                               np.ones((len(base_ds.subject),
-                                        len(mre_type)),
-                                       dtype=np.float)),
-                 'val_intercept': (['subject', 'mre_type'],
-                                   np.zeros((len(base_ds.subject),
-                                             len(mre_type)),
-                                            dtype=np.float)),
-                 },
-
-                coords={'subject': base_ds.subject,
-                        'sequence': base_ds.sequence,
-                        'mask_type': base_ds.mask_type,
-                        'mre_type': mre_type,
-                        'x': base_ds.x,
-                        'y': base_ds.y,
-                        'z': base_ds.z
-                        }
-            )
-        # Fill in the model mre_types
-        self.ds['image_mre'].loc[
-            {'mre_type': 'mre'}] = base_ds['image_mre'].sel(mre_type='mre')
-        self.ds['image_mre'].loc[
-            {'mre_type': self.wave_name}] = base_ds['image_mre'].sel(mre_type=self.wave_name)
-        self.ds['image_mre'].loc[
-            {'mre_type': 'mre_mask'}] = base_ds['image_mre'].sel(mre_type='mre_mask')
-        self.ds['image_mre'].loc[
-            {'mre_type': 'mre_raw'}] = base_ds['image_mre'].sel(mre_type='mre_raw')
+            data_vars += ['age', 'gender', 'height', 'weight', 'bmi', 'htn', 'hld', 'dm', 'ast',
+                          'alt', 'alk', 'tbili', 'albumin', 'plt']
+        shape = (len(base_ds.subject), len(mre_type))
+        self.ds = base_ds[data_vars].assign(
+            image_mre=image_mre,
+            val_slope=(['subject', 'mre_type'], np.ones(shape, dtype=np.float64)),
+            val_intercept=(['subject', 'mre_type'], np.zeros(shape, dtype=np.float64)))
 
     def load_files(self, file_names):
         if type(file_names) is not list:
@@ -1230,34 +1195,98 @@ class ModelCompare:
         if '*' in file_names or type(file_names) is list:
             ds = xr.open_mfdataset(file_names, combine='nested', concat_dim='subject')
         else:
-            ds = xr.open_dataset(file_names)
+            ds = xr.open_dataset(file_names, chunks={})
+        if 'subject' in ds.dims:
+            ds = ds.chunk({'subject': self.chunks or -1})
         return ds
 
+    def prediction(self, ds_pred, name):
+        '''(image_mre, val_slope, val_intercept) of a prediction file, as lazy variables with a
+        single `mre_type` named `name`, on the subjects of self.ds.'''
+        ds_pred = ds_pred.sortby('subject').reindex(subject=self.ds.subject)
+        pred_vars = []
+        for var in ['image_mre', 'val_slope', 'val_intercept']:
+            da = ds_pred[var]
+            if 'mre_type' in da.dims:
+                da = da.squeeze('mre_type', drop=True)
+            da = da.drop_vars('mre_type', errors='ignore').expand_dims(mre_type=[name], axis=1)
+            pred_vars.append(da)
+        pred_vars[0] = pred_vars[0].transpose(*self.ds['image_mre'].dims).astype(self.dtype)
+        return pred_vars
+
     def add_predictions(self, pred_dict):
         '''Append predictions to self.ds'''
+        preds = []
         if self.eovist_combo:
             ds_pred = self.load_files(pred_dict['pred1'])
             sel_subjs = [subj for subj in ds_pred.subject.values if subj not in self.eovist_list]
             ds_pred = ds_pred.sel(subject=sel_subjs)
             ds_eovist = self.load_files(pred_dict['pred2'])
             ds_pred = ds_pred.combine_first(ds_eovist)
-            ds_pred = ds_pred.assign_coords(mre_type=['pred'])
-            ds_pred = ds_pred.sortby('subject')
             print(ds_pred)
-            self.ds['image_mre'].loc[dict(mre_type='pred')] = ds_pred['image_mre']
-            self.ds['val_slope'].loc[dict(mre_type='pred')] = ds_pred['val_slope']
-            self.ds['val_intercept'].loc[dict(mre_type='pred')] = ds_pred['val_intercept']
+            preds.append(self.prediction(ds_pred, 'pred'))
         else:
             for pred in pred_dict:
                 ds_pred = self.load_files(pred_dict[pred])
                 # if pred != 'rad_style_baseline':
                 #     ds_pred = ds_pred.sel(mre_type='mre_pred')
-                ds_pred = ds_pred.assign_coords(mre_type=[pred])
-                ds_pred = ds_pred.sortby('subject')
                 print(ds_pred)
-                self.ds['image_mre'].loc[dict(mre_type=pred)] = ds_pred['image_mre']
-                self.ds['val_slope'].loc[dict(mre_type=pred)] = ds_pred['val_slope']
-                self.ds['val_intercept'].loc[dict(mre_type=pred)] = ds_pred['val_intercept']
+                preds.append(self.prediction(ds_pred, pred))
+        if not preds:
+            return
+        # one lazy concatenation for all the predictions, the slopes and intercepts are small
+        pred_vars = {}
+        for i, var in enumerate(['image_mre', 'val_slope', 'val_intercept']):
+            das = [pred[i] if i == 0 else pred[i].load() for pred in preds]
+            pred_vars[var] = xr.concat([self.ds[var]] + das, dim='mre_type', coords='minimal',
+                                       compat='override', join='override')
+        # the new variables come with a longer mre_type
+        self.ds = self.ds.drop_vars(list(pred_vars) + ['mre_type']).assign(pred_vars)
+
+    def save(self, path, dtype='int16', scale_factor=None):
+        '''Write self.ds to netcdf one chunk at a time, with `image_mre` stored as `dtype`.
+
+        An int16 `image_mre` is packed with a scale factor (by default max |image_mre|/32766,
+        shared by all mre_types) and NaN as the fill value; `xr.open_dataset(path, chunks={})`
+        unpacks it lazily to float32.
+        '''
+        encoding = {'image_mre': {'dtype': dtype}}
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            if scale_factor is None:
+                vmax = float(abs(self.ds['image_mre']).max())
+                scale_factor = np.float32(vmax/(np.iinfo(dtype).max - 1) if vmax > 0 else 1)
+            encoding['image_mre'].update({'scale_factor': np.float32(scale_factor),
+                                          '_FillValue': np.iinfo(dtype).min})
+        self.ds.to_netcdf(path, encoding=encoding)
+
+
+def masked_means(image, mask, slope=None, intercept=None, cor=None):
+    '''Mean of each (x, y, z) `image` volume over the voxels where `mask` > 0 (weighted by the
+    mask values) and the image is not NaN.
+
+    Args:
+        image (np.ndarray): (n, x, y, z) volumes, e.g. all the predictions of one subject.
+        mask (np.ndarray): (x, y, z) mask.
+        slope, intercept (np.ndarray): (n,) linear correction, (voxel - intercept)/slope clipped at
+            0, applied per voxel to the volumes where `cor` is True.
+
+    Returns:
+        List of n means (NaN for an empty mask), in the dtype of the masked (and corrected) voxels.
+    '''
+    # only the voxels inside the mask, as an (n, voxels) array
+    idx = np.flatnonzero(mask > 0)
+    weights = mask.reshape(-1)[idx].astype(np.result_type(mask.dtype, np.nan))
+    vals = image.reshape(len(image), -1)[:, idx] * weights
+    valid = ~np.isnan(vals)
+    dtypes = [vals.dtype]*len(image)
+    if cor is not None and np.any(cor):
+        corrected = (vals - intercept[:, None])/slope[:, None]
+        corrected = np.where(corrected > 0, corrected, 0)
+        dtypes = [corrected.dtype if c else dtype for c, dtype in zip(cor, dtypes)]
+        vals = np.where(cor[:, None], corrected, vals)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(valid, vals, 0).sum(axis=1)/valid.sum(axis=1)
+    return [dtype.type(mean) for mean, dtype in zip(means, dtypes)]
 
 
 class ModelComparePandas:
@@ -1266,37 +1295,27 @@ class ModelComparePandas:
     Assumes input is the ModelCompare Xarray
     '''
 
-    def __init__(self, ds, do_cor=False, do_aug=False):
+    def __init__(self, ds, do_cor=False, do_aug=False, mask_cache=None):
+        from mre.masks import eroded_masks
         pred_names = [pred for pred in list(ds.mre_type.values) if
                       pred not in ['mre_raw', 'mre_mask', 'mre_pred', 'mre_wave', 'wave']]
-        pred_dict = {}
-
-        for subj in ds.subject:
-            mask = ds.sel(subject=subj, mask_type='combo')['mask_mre'].values.copy()
-            # print(mask.shape)
-            # print(mask.mean())
-            if do_aug:
-                for i in range(mask.shape[2]):
-                    if mask[:, :, i].mean() > 0:
-                        mask[:, :, i] = ndi.binary_erosion(
-                            mask[:, :, i], iterations=2).astype(mask.dtype)
-            mask = np.where(mask > 0, mask, np.nan)
-            # print(mask.shape)
-            for pred in pred_names:
-                if pred not in pred_dict:
-                    pred_dict[pred] = []
-
-                pred_mre_region = (ds.sel(subject=subj, mre_type=pred)['image_mre'].values * mask)
-                pred_mre_region = pred_mre_region.flatten()
-                pred_mre_region = pred_mre_region[~np.isnan(pred_mre_region)]
-                if do_cor and pred != 'best_4_class_only':
-                    slope = ds.sel(subject=subj, mre_type=pred)['val_slope'].values
-                    intercept = ds.sel(subject=subj, mre_type=pred)['val_intercept'].values
-                    pred_mre_region = (pred_mre_region-intercept)/slope
-                    pred_mre_region = np.where(pred_mre_region > 0, pred_mre_region, 0)
-                mean_pred = np.nanmean(pred_mre_region)
-
-                pred_dict[pred].append(mean_pred)
+        cor = np.array([do_cor and pred != 'best_4_class_only' for pred in pred_names])
+
+        # all predictions of a subject at once
+        images = ds['image_mre'].sel(mre_type=pred_names).transpose(
+            'subject', 'mre_type', 'x', 'y', 'z')
+        masks = eroded_masks(ds, 2 if do_aug else 0, cache_dir=mask_cache).values
+        slopes = intercepts = [None]*len(ds.subject)
+        if cor.any():
+            slopes = ds['val_slope'].sel(mre_type=pred_names).transpose(
+                'subject', 'mre_type').values
+            intercepts = ds['val_intercept'].sel(mre_type=pred_names).transpose(
+                'subject', 'mre_type').values
+        pred_dict = {pred: [] for pred in pred_names}
+        for i in range(len(ds.subject)):
+            means = masked_means(images[i].values, masks[i], slopes[i], intercepts[i], cor)
+            for pred, mean in zip(pred_names, means):
+                pred_dict[pred].append(mean)
 
         self.df = pd.DataFrame(pred_dict, index=ds.subject.values)
 
@@ -1307,12 +1326,13 @@ class ModelCompareDice:
     Assumes input is the ModelCompare Xarray
     '''
 
-    def __init__(self, base_ds, do_cor=True, do_aug=True, pred='best_4'):
+    def __init__(self, base_ds, do_cor=True, do_aug=True, pred='best_4', mask_cache=None):
+        from mre.masks import eroded_masks
         self.ds = xr.Dataset(
             {'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'],
                            np.empty((len(base_ds.subject), 2,
                                      len(base_ds.x), len(base_ds.y), 4),
-                                    dtype=np.float)),
+                                    dtype=np.float64)),
              },
 
             coords={'subject': base_ds.subject,
@@ -1324,14 +1344,9 @@ class ModelCompareDice:
         )
 
         self.ds['image_mre'][:] = np.nan
+        masks = eroded_masks(base_ds, 2 if do_aug else 0, var='mask_mri', cache_dir=mask_cache)
         for subj in base_ds.subject:
-            mask = base_ds.sel(subject=subj, mask_type='combo')['mask_mri'].values.copy()
-            # print(mask.mean())
-            if do_aug:
-                for i in range(mask.shape[2]):
-                    if mask[:, :, i].mean() > 0:
-                        mask[:, :, i] = ndi.binary_erosion(
-                            mask[:, :, i], iterations=2).astype(mask.dtype)
+            mask = masks.sel(subject=subj).values
             mask = np.where(mask > 0, mask, np.nan)
             for i, z in enumerate(base_ds.sel(subject=subj)['mri_to_mre_idx'].values):
                 mask_slice = mask[:, :, z]
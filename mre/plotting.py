@@ -7,7 +7,6 @@ from sklearn.metrics import roc_auc_score, accuracy_score
 from sklearn.metrics import confusion_matrix
 from sklearn.preprocessing import normalize
 from skimage import morphology
-from scipy import ndimage as ndi
 import pandas as pd
 import xarray as xr
 from lmfit.models import LinearModel
@@ -25,6 +24,9 @@ from torch.utils.data import DataLoader
 from mre.preprocessing import MRIImage
 from mre.pytorch_arch_deeplab import DeepLabFeatures
 from mre.mre_datasets import MRETorchDataset
+from mre.masks import eroded_masks
+from mre.bootstrap import (resample_indices, confusion_counts, classification_rates, auroc,
+                           linear_r2)
 from fractions import Fraction
 
 
@@ -703,12 +705,9 @@ def miccai_plots(ds, do_cor=True, save_name='test', erode=0):
     #     slope = np.mean(ds['val_slope'].values)
     #     intercept = np.mean(ds['val_intercept'].values)
     #     print(slope, intercept)
+    masks = eroded_masks(ds, erode)
     for subj in ds.subject:
-        mask = ds.sel(subject=subj, mask_type='combo')['mask_mre'].values
-        if erode != 0:
-            for i in range(mask.shape[-1]):
-                mask[:, :, i] = ndi.binary_erosion(mask[:, :, i],
-                                                   iterations=erode).astype(mask.dtype)
+        mask = masks.sel(subject=subj).values
         mask = np.where(mask > 0, mask, np.nan)
         true_mre_region = (ds.sel(subject=subj, mre_type='mre')['image_mre'].values * mask)
         true_mre_region = true_mre_region.flatten()
@@ -895,7 +894,9 @@ def xr_viewer_models(xr_ds, size=250, do_cor=False):
 
 
 def roc_curves(df, true='mre', pred='baseline', threshold=4, label=None, title=None, ax=None,
-               plot=True, frac=False):
+               plot=True, frac=False, n_boot=100, seed=None):
+    '''ROC curve, sensitivity, specificity and accuracy of `pred` vs `true` at `threshold` (kPa),
+    with their standard deviations over `n_boot` bootstrap resamples (see `mre.bootstrap`).'''
     if label is None:
         label = pred
     if title is None:
@@ -908,14 +909,8 @@ def roc_curves(df, true='mre', pred='baseline', threshold=4, label=None, title=N
     fpr, tpr, _ = roc_curve(df_labels.true_labels, df_labels.pred_probs)
     roc_auc = auc(fpr, tpr)
     # print('true_auc:', roc_auc)
-    auc_std = []
-    for i in range(100):
-        df_labels_boot = df_labels.sample(n=len(df_labels), replace=True)
-        fpr_boot, tpr_boot, _ = roc_curve(df_labels_boot.true_labels, df_labels_boot.pred_probs)
-        roc_auc_boot = auc(fpr_boot, tpr_boot)
-        auc_std.append(roc_auc_boot)
-        # print('boot_auc:', roc_auc_boot)
-    auc_std = np.std(auc_std)
+    idx = resample_indices(len(df), n_boot, seed=seed)
+    auc_std = np.std(auroc(true_labels, pred_probs, idx))
     lw = 2
     if plot:
         if ax is None:
@@ -938,65 +933,30 @@ def roc_curves(df, true='mre', pred='baseline', threshold=4, label=None, title=N
             ax.set_title(title, size=22)
             ax.legend(loc="lower right", fontsize=15)
 
-    tp = df.query(f'{true}>={threshold} and {pred}>={threshold}').count()[0]
-    fn = df.query(f'{true}>{threshold} and {pred}<{threshold}').count()[0]
+    tp, fn, tn, fp = confusion_counts(df[true].values, df[pred].values, threshold,
+                                      inclusive=True)
     if frac:
         sens = f'{tp}/{tp+fn}'
-    else:
-        sens = tp/(tp+fn)
-    # print('tp', tp)
-    # print('fn', fn)
-    # print('sensitivity', tp/(tp+fn))
-
-    # Specificity: TN/(TN+FP)
-    tn = df.query(f'{true}<={threshold} and {pred}<={threshold}').count()[0]
-    fp = df.query(f'{true}<{threshold} and {pred}>{threshold}').count()[0]
-    if frac:
         spec = f'{tn}/{tn+fp}'
-    else:
-        spec = tn/(tn+fp)
-    # print('tn', tn)
-    # print('fp', fp)
-    # print('specificity', spec)
-
-    if frac:
         acc = f'{tn+tp}/{tn+fp+tp+fn}'
     else:
-        acc = (tn+tp)/(tn+fp+tp+fn)
-    sens_std = []
-    spec_std = []
-    acc_std = []
-
-    # print('accuracy', acc)
-    for i in range(100):
-        df_boot = df.sample(n=len(df), replace=True)
-        tp_boot = df_boot.query(f'{true}>{threshold} and {pred}>{threshold}').count()[0]
-        fn_boot = df_boot.query(f'{true}>{threshold} and {pred}<{threshold}').count()[0]
-        sens_boot = tp_boot/(tp_boot+fn_boot)
-        # print('tp', tp)
-        # print('fn', fn)
-        # print('sensitivity', tp/(tp+fn))
-
-        # Specificity: TN/(TN+FP)
-        tn_boot = df_boot.query(f'{true}<{threshold} and {pred}<{threshold}').count()[0]
-        fp_boot = df_boot.query(f'{true}<{threshold} and {pred}>{threshold}').count()[0]
-        spec_boot = tn_boot/(tn_boot+fp_boot)
-        # print('tn', tn)
-        # print('fp', fp)
-        # print('specificity', spec)
+        sens, spec, acc = classification_rates(tp, fn, tn, fp)
 
-        acc_boot = (tn_boot+tp_boot)/(tn_boot+fp_boot+tp_boot+fn_boot)
-        # print('acc boot', acc_boot)
+    boot_rates = classification_rates(*confusion_counts(df[true].values, df[pred].values,
+                                                        threshold, idx))
+    sens_std, spec_std, acc_std = [np.std(rates) for rates in boot_rates]
 
-        sens_std.append(sens_boot)
-        spec_std.append(spec_boot)
-        acc_std.append(acc_boot)
+    return sens, sens_std, spec, spec_std, acc, acc_std, roc_auc, auc_std
 
-    sens_std = np.std(sens_std)
-    spec_std = np.std(spec_std)
-    acc_std = np.std(acc_std)
 
-    return sens, sens_std, spec, spec_std, acc, acc_std, roc_auc, auc_std
+def roc_table(df, preds, thresholds, true='mre', n_boot=100, seed=None):
+    '''`roc_curves` statistics of several predictions at several thresholds (kPa), one row per
+    (pred, threshold).'''
+    columns = ['sens', 'sens_std', 'spec', 'spec_std', 'acc', 'acc_std', 'auroc', 'auroc_std']
+    rows = [(pred, threshold) + roc_curves(df, true, pred, threshold, plot=False, n_boot=n_boot,
+                                           seed=seed)
+            for pred in preds for threshold in thresholds]
+    return pd.DataFrame(rows, columns=['pred', 'threshold'] + columns)
 
 
 def example_images(ds, subj='0219', z=18):
@@ -1198,7 +1158,8 @@ def model_feature_extractor(ds, model_path=None, subj='0219'):
 
 
 def radiology_cor_plots(ds, df=None, do_aug=True, do_cor=True,
-                        pred='pred', save_name='test', plot=True, eovist=False):
+                        pred='pred', save_name='test', plot=True, eovist=False, n_boot=100,
+                        seed=None):
     import seaborn as sns
     sns.set()
     sns.set_palette(sns.color_palette('colorblind'))
@@ -1211,15 +1172,9 @@ def radiology_cor_plots(ds, df=None, do_aug=True, do_cor=True,
     #     slope = np.mean(ds['val_slope'].values)
     #     intercept = np.mean(ds['val_intercept'].values)
     #     print(slope, intercept)
+    masks = eroded_masks(ds, 2 if do_aug else 0, var='mask_mri')
     for subj in ds.subject:
-        mask = ds.sel(subject=subj, mask_type='combo')['mask_mri'].values.copy()
-        # print(mask.shape)
-        # print(mask.mean())
-        if do_aug:
-            for i in range(mask.shape[2]):
-                if mask[:, :, i].mean() > 0:
-                    mask[:, :, i] = ndi.binary_erosion(
-                        mask[:, :, i], iterations=2).astype(mask.dtype)
+        mask = masks.sel(subject=subj).values
         mask = np.where(mask > 0, mask, np.nan)
         true_mre_region = (ds.sel(subject=subj, mre_type='mre')['image_mre'].values * mask)
         true_mre_region = true_mre_region.flatten()
@@ -1247,14 +1202,9 @@ def radiology_cor_plots(ds, df=None, do_aug=True, do_cor=True,
     model = LinearModel()
     params = model.make_params(slope=1, intercept=0)
     result = model.fit(df_subj['predict'], params, x=df_subj['true'])
-    r2_subj_std = []
-    for i in range(100):
-        df_subj_boot = df_subj.sample(n=len(df_subj), replace=True)
-        model_boot = LinearModel()
-        params_boot = model.make_params(slope=1, intercept=0)
-        result_boot = model_boot.fit(df_subj_boot['predict'], params_boot, x=df_subj_boot['true'])
-        r2_subj_boot = 1 - result_boot.residual.var() / np.var(df_subj_boot['predict'])
-        r2_subj_std.append(r2_subj_boot)
+    rng = np.random.default_rng(seed)
+    r2_subj_std = linear_r2(df_subj['true'].values, df_subj['predict'].values,
+                            resample_indices(len(df_subj), n_boot, seed=rng))
 
     if plot:
         if eovist:
@@ -1314,16 +1264,8 @@ def radiology_cor_plots(ds, df=None, do_aug=True, do_cor=True,
     model = LinearModel()
     params = model.make_params(slope=1, intercept=0)
     result = model.fit(pred_pixel, params, x=true_pixel)
-    r2_pixel_std = []
-    for i in range(100):
-        idx = np.random.choice(np.arange(len(true_pixel)), 1000, replace=True)
-        pred_pixel_boot = pred_pixel[idx]
-        true_pixel_boot = true_pixel[idx]
-        model_boot = LinearModel()
-        params_boot = model.make_params(slope=1, intercept=0)
-        result_boot = model_boot.fit(pred_pixel_boot, params_boot, x=true_pixel_boot)
-        r2_pixel_boot = 1 - result_boot.residual.var() / np.var(pred_pixel_boot)
-        r2_pixel_std.append(r2_pixel_boot)
+    r2_pixel_std = linear_r2(true_pixel, pred_pixel,
+                             resample_indices(len(true_pixel), n_boot, size=1000, seed=rng))
     if plot and not eovist:
         thresholds = ['2.88', '3.54', '3.77', '4.09']
 
@@ -1,14 +1,12 @@
 import time
-import copy
 from collections import defaultdict
 import warnings
 from datetime import datetime
+from pathlib import Path
 import numpy as np
 import pandas as pd
 from tqdm import tqdm_notebook
-from lmfit.models import LinearModel
 import xarray as xr
-from scipy import ndimage as ndi
 
 import torch
 import torch.fft
@@ -16,16 +14,15 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.optim import lr_scheduler
 from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms, datasets, models
 import torch.nn.functional as F
-import torchvision.transforms.functional as TF
 from torch.utils.data.sampler import RandomSampler
-from tensorboardX import SummaryWriter
 
 # from mre.plotting import hv_dl_vis
 from mre.mre_datasets import MRETorchDataset
-from robust_loss_pytorch import adaptive
-import kornia
+from mre.spectral_loss import SpectralLoss
+from mre.inference import load_model_artifact, sliding_window_predict
+from mre.profiling import StepProfiler, write_profile_json
+from mre.checkpoint import BestState
 
 
 def masked_L1(pred, target, mask):
@@ -87,23 +84,67 @@ def full_mse(pred, target):
     return mse
 
 
-def helmholtz(mu, wave, freq, lap_kernel=25):
-    laplace_wave = torch.zeros_like(wave)
-    if lap_kernel > 0:
-        laplace = kornia.filters.Laplacian(lap_kernel)
-        for z in range(wave.size()[2]):
-            laplace_slice = laplace(wave[:, :, z, :, :])
-            laplace_wave[:, :, z, :, :] = laplace_slice
-    elif lap_kernel == -1:
-        kernel = torch.tensor([[
-            [1., 4., 1.],
-            [4., -20., 4.],
-            [1., 4., 1.]]])
-        for z in range(wave.size()[2]):
-            laplace_slice = kornia.filter.filter2D(wave[:, :, z, :, :], kernel)
-            laplace_wave[:, :, z, :, :] = laplace_slice
+_laplace_kernels = {}
+_laplace_kernel_ffts = {}
+
+
+def get_laplace_kernel(lap_kernel, device, dtype=torch.float32):
+    '''Return the 2D Laplacian kernel for a given `lap_kernel` setting, cached per
+    (size, device, dtype).  Positive sizes reproduce `kornia.filters.Laplacian` (normalized), -1
+    gives the unnormalized 3x3 isotropic stencil.'''
+    key = (lap_kernel, str(device), dtype)
+    if key not in _laplace_kernels:
+        if lap_kernel > 0:
+            kernel = torch.ones((lap_kernel, lap_kernel))
+            mid = lap_kernel // 2
+            kernel[mid, mid] = 1 - lap_kernel**2
+            kernel = kernel/kernel.abs().sum()
+        elif lap_kernel == -1:
+            kernel = torch.tensor([
+                [1., 4., 1.],
+                [4., -20., 4.],
+                [1., 4., 1.]])
+        else:
+            raise KeyError('lap_kernel is wrong')
+        _laplace_kernels[key] = kernel.to(device=device, dtype=dtype)
+    return _laplace_kernels[key]
+
+
+def _get_laplace_kernel_fft(lap_kernel, shape, device, dtype):
+    '''rfft2 of the flipped Laplacian kernel, zero-padded to `shape`.  Cached alongside the kernel
+    so the spectrum is only computed once per volume size.'''
+    key = (lap_kernel, tuple(shape), str(device), dtype)
+    if key not in _laplace_kernel_ffts:
+        kernel = get_laplace_kernel(lap_kernel, device, dtype)
+        _laplace_kernel_ffts[key] = torch.fft.rfft2(kernel.flip(-2, -1), s=tuple(shape))
+    return _laplace_kernel_ffts[key]
+
+
+def laplacian_slices(wave, lap_kernel=25, fft_min_kernel=9):
+    '''Apply the 2D Laplacian to every z-slice of a (batch, channel, z, y, x) volume at once.
+
+    Z is folded into the batch dimension and the (reflect padded) slices are filtered with a single
+    grouped convolution.  Kernels of size `fft_min_kernel` or larger are applied in the Fourier
+    domain instead, which is much cheaper for the large kernels used in the wave scans.
+    '''
+    b, c, nz, ny, nx = wave.shape
+    kernel = get_laplace_kernel(lap_kernel, wave.device, wave.dtype)
+    k = kernel.shape[-1]
+    pad = k // 2
+    slices = wave.transpose(1, 2).reshape(b*nz, c, ny, nx)
+    slices = F.pad(slices, (pad, pad, pad, pad), mode='reflect')
+    if k >= fft_min_kernel:
+        shape = slices.shape[-2:]
+        kernel_fft = _get_laplace_kernel_fft(lap_kernel, shape, wave.device, wave.dtype)
+        laplace = torch.fft.irfft2(torch.fft.rfft2(slices)*kernel_fft, s=tuple(shape))
+        laplace = laplace[..., k-1:k-1+ny, k-1:k-1+nx]
     else:
-        raise KeyError('lap_kernel is wrong')
+        laplace = F.conv2d(slices, kernel.expand(c, 1, k, k), groups=c)
+    return laplace.reshape(b, nz, c, ny, nx).transpose(1, 2)
+
+
+def helmholtz(mu, wave, freq, lap_kernel=25):
+    laplace_wave = laplacian_slices(wave, lap_kernel)
     freq = torch.clamp(freq, -1e6, -1e-6)
     l_hh = torch.abs(mu*laplace_wave - freq*wave).sum()/torch.numel(mu)
     # print(freq)
@@ -168,6 +209,48 @@ def masked_mse_slice(pred, target, mask):
     return slice_mse
 
 
+def masked_mse_fused(pred, target, mask, do_slice: bool = False):
+    '''Pixel, subject-mean and (optionally) slice-mean masked MSE in a single pass.
+
+    Equivalent to `masked_mse`, `masked_mse_subj` and `masked_mse_slice`, but the residual, the
+    masked residual and the mask sums are only computed once.  The subject and slice terms use
+    sum(pred*mask) - sum(target*mask) == sum((pred - target)*mask).  The slice term is zero unless
+    `do_slice` is set.'''
+    diff = pred - target
+    diff_mask = diff*mask
+    pixel_mse = (diff*diff_mask).sum()/mask.ceil().sum()
+
+    subj_dims = [i for i in range(1, pred.dim())]
+    subj_mean = diff_mask.sum(subj_dims)/mask.sum(subj_dims)
+    subj_mse = (subj_mean**2).mean()
+
+    if do_slice:
+        slice_dims = [1] + [i for i in range(3, pred.dim())]
+        slice_mean = diff_mask.sum(slice_dims)/mask.sum(slice_dims)
+        slice_mse = (slice_mean**2).mean()
+    else:
+        slice_mse = torch.zeros_like(pixel_mse)
+    return pixel_mse, subj_mse, slice_mse
+
+
+_fused_losses = {}
+
+
+def get_masked_mse_fused(backend='eager'):
+    '''Return `masked_mse_fused` for the requested backend ('eager', 'script' or 'compile').
+    Compiled versions are built once per process.'''
+    if backend not in _fused_losses:
+        if backend == 'eager':
+            _fused_losses[backend] = masked_mse_fused
+        elif backend == 'script':
+            _fused_losses[backend] = torch.jit.script(masked_mse_fused)
+        elif backend == 'compile':
+            _fused_losses[backend] = torch.compile(masked_mse_fused, dynamic=True)
+        else:
+            raise ValueError(f'Unknown loss backend "{backend}"')
+    return _fused_losses[backend]
+
+
 def get_labels_sid(args, depth):
     if args.dataset == 'kitti':
         alpha = 0.001
@@ -224,16 +307,17 @@ def get_depth_sid(args, labels):
 
 
 def calc_loss(pred, target, mask, metrics, loss_func=None, pixel_weight=0.05,
-              wave=False, class_only=False, wave_hypers=None, fft=True, lap_kernel=25):
+              wave=False, class_only=False, wave_hypers=None, fft=True, lap_kernel=25,
+              spectral_loss=None, names=None, loss_backend='eager'):
 
+    fused_mse = get_masked_mse_fused(loss_backend)
     if class_only:
         label_class = masked_class_subj(target, mask)
         loss = nn.CrossEntropyLoss()
         loss = loss(pred, label_class)
 
     elif not wave and (loss_func is None or loss_func == 'l2'):
-        pixel_loss = masked_mse(pred, target, mask)
-        subj_loss = masked_mse_subj(pred, target, mask)
+        pixel_loss, subj_loss, _ = fused_mse(pred, target, mask)
         loss = pixel_weight*pixel_loss + (1-pixel_weight)*subj_loss
         metrics['pixel_loss'] += pixel_loss.data.cpu().numpy() * target.size(0)
         metrics['subj_loss'] += subj_loss.data.cpu().numpy() * target.size(0)
@@ -241,15 +325,18 @@ def calc_loss(pred, target, mask, metrics, loss_func=None, pixel_weight=0.05,
         if wave_hypers is None:
             wave_hypers = [0.05, 0.5, 0.5]
         # do stiffness
-        pixel_loss_stiff = masked_mse(pred[0][:, 0:1, :, :, :], target[:, 0:1, :, :, :], mask)
-        subj_loss = masked_mse_subj(pred[0][:, 0:1, :, :, :], target[:, 0:1, :, :, :], mask)
-        if fft:
+        pixel_loss_stiff, subj_loss, _ = fused_mse(pred[0][:, 0:1, :, :, :],
+                                                   target[:, 0:1, :, :, :], mask)
+        if fft and spectral_loss is not None:
+            pixel_loss_wave = spectral_loss(pred[0][:, 1:2, :, :, :],
+                                            target[:, 1:2, :, :, :], mask, names=names)
+        elif fft:
             pixel_loss_wave = masked_mse_fft(pred[0][:, 1:2, :, :, :],
                                              target[:, 1:2, :, :, :], mask)
         else:
             pixel_loss_wave = masked_mse(pred[0][:, 1:2, :, :, :], target[:, 1:2, :, :, :], mask)
         # freq = 5*pred[1]
-        freq = torch.FloatTensor([-5]).to('cuda:0')
+        freq = torch.FloatTensor([-5]).to(pred[0].device)
         helmholtz_loss = helmholtz(pred[0][:, 0:1, :, :, :], pred[0][:, 1:2, :, :, :], freq,
                                    lap_kernel=lap_kernel)
         loss = (wave_hypers[0]*pixel_loss_stiff +
@@ -291,16 +378,43 @@ def print_metrics(metrics, epoch_samples, phase):
 def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25, tb_writer=None,
                 verbose=True, loss_func=None, pixel_weight=1, do_val=True, ds=None,
                 bins=None, nbins=0, do_clinical=False, wave=False, class_only=False,
-                wave_hypers=None, fft=True, lap_kernel=25):
+                wave_hypers=None, fft=True, lap_kernel=25, fft_type='fftn', fft_band=None,
+                loss_backend='eager', channels_last=False, profile=False, profile_path=None,
+                pruner=None, checkpointer=None, resume=False):
+    '''Train `model`, keeping the weights of the epoch with the best val (or train) loss.
+    `pruner` (e.g. `mre.asha.ASHA`) gets that loss after every epoch and can stop the training.
+    `checkpointer` (`mre.checkpoint.AsyncCheckpointer`) saves the full training state, and with
+    `resume` training continues from its last checkpoint if there is one.'''
     if loss_func is None:
         loss_func = 'l2'
-    best_model_wts = copy.deepcopy(model.state_dict())
+    if fft_type not in ['fftn', 'rfft']:
+        raise ValueError(f'Unknown fft_type "{fft_type}"')
+    spectral_loss = None
+    if wave and fft and fft_type == 'rfft':
+        spectral_loss = SpectralLoss(band=fft_band)
+    memory_format = torch.channels_last_3d if channels_last else torch.contiguous_format
+    profile_log = defaultdict(list)
+    best_state = BestState(model)
     best_loss = 1e16
+    start_epoch = 0
+    if resume and checkpointer is not None and checkpointer.path.exists():
+        from mre.checkpoint import load_checkpoint
+        last_epoch, best_model_wts, best_loss = load_checkpoint(
+            checkpointer.path, model, optimizer, scheduler,
+            loss_func if isinstance(loss_func, nn.Module) else None, checkpointer.fingerprint)
+        if best_model_wts is not None:
+            best_state.update(best_model_wts)
+        start_epoch = last_epoch + 1
+        print(f'Resuming from {checkpointer.path} at epoch {start_epoch}')
+    if pruner is not None and pruner.restore(start_epoch - 1):
+        # stopped at a rung before the job was requeued
+        print(f'Stopped by {type(pruner).__name__} after {pruner.stopped_at} epochs.')
+        start_epoch = num_epochs
     if do_val:
         phases = ['train', 'val', 'test']
     else:
         phases = ['train', 'test']
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
         try:
             if verbose:
                 print('Epoch {}/{}'.format(epoch, num_epochs - 1))
@@ -319,46 +433,56 @@ def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
                     model.eval()   # Set model to evaluate mode
                 metrics = defaultdict(float)
                 epoch_samples = 0
+                prof = StepProfiler(device, enabled=profile)
+                # target spectra can only be reused if the targets are not augmented
+                cache_targets = not getattr(dataloaders[phase].dataset, 'aug', True)
 
                 # iterate through batches of data for each epoch
-                for data in dataloaders[phase]:
-                    inputs = data[0].to(device)
-                    labels = data[1].to(device)
-                    masks = data[2].to(device)
-                    if do_clinical:
-                        clinical = data[4].to(device)
+                for data in prof.wrap(dataloaders[phase]):
+                    with prof.section('transfer'):
+                        inputs = data[0].to(device, memory_format=memory_format)
+                        labels = data[1].to(device)
+                        masks = data[2].to(device)
+                        names = data[3] if cache_targets else None
+                        if do_clinical:
+                            clinical = data[4].to(device)
                     # zero the parameter gradients
                     optimizer.zero_grad()
                     # forward
                     # track history if only in train
                     with torch.set_grad_enabled(phase == 'train'):
-                        if do_clinical:
-                            outputs = model(inputs, clinical)
-                        else:
-                            outputs = model(inputs)
-                        # backward + optimize only if in training phase
-                        if phase == 'train':
-                            # with torch.autograd.detect_anomaly():
-                            loss = calc_loss(outputs, labels, masks, metrics, loss_func,
-                                             pixel_weight, wave=wave, class_only=class_only,
-                                             wave_hypers=wave_hypers, fft=fft,
-                                             lap_kernel=lap_kernel)
-                            loss.backward()
-                            optimizer.step()
-                        else:
+                        with prof.section('forward'):
+                            if do_clinical:
+                                outputs = model(inputs, clinical)
+                            else:
+                                outputs = model(inputs)
+                        with prof.section('loss'):
                             loss = calc_loss(outputs, labels, masks, metrics, loss_func,
                                              pixel_weight, wave=wave, class_only=class_only,
                                              wave_hypers=wave_hypers, fft=fft,
-                                             lap_kernel=lap_kernel)
+                                             lap_kernel=lap_kernel,
+                                             spectral_loss=spectral_loss, names=names,
+                                             loss_backend=loss_backend)
+                        # backward + optimize only if in training phase
+                        if phase == 'train':
+                            with prof.section('backward'):
+                                # with torch.autograd.detect_anomaly():
+                                loss.backward()
+                                optimizer.step()
                     # accrue total number of samples
                     epoch_samples += inputs.size(0)
+                    prof.end_step(inputs.size(0))
 
+                if profile:
+                    profile_log[phase].append(prof.write(tb_writer, phase, epoch))
                 if phase == 'train':
                     scheduler.step()
 
                 if verbose:
                     print_metrics(metrics, epoch_samples, phase)
                 epoch_loss = metrics['loss'] / epoch_samples
+                if phase == ('val' if do_val else 'train'):
+                    report_loss = epoch_loss
 
                 # deep copy the model if is it best
                 if do_val:
@@ -379,7 +503,7 @@ def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
                             print("updating best model floor")
                             print("saving best model")
                         best_loss = epoch_loss
-                        best_model_wts = copy.deepcopy(model.state_dict())
+                        best_state.update(model.state_dict())
 
                     # elif phase == 'val' and epoch_loss < best_loss*1.01 and epoch > 51:
                     #     if verbose:
@@ -390,7 +514,7 @@ def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
                         if verbose:
                             print("saving best model (training)")
                         best_loss = epoch_loss
-                        best_model_wts = copy.deepcopy(model.state_dict())
+                        best_state.update(model.state_dict())
 
                 if tb_writer:
                     tb_writer.add_scalar(f'loss_{phase}', epoch_loss, epoch)
@@ -420,19 +544,31 @@ def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
             if verbose:
                 time_elapsed = time.time() - since
                 print('{:.0f}m {:.0f}s'.format(time_elapsed // 60, time_elapsed % 60))
+            if checkpointer is not None and checkpointer.due(epoch):
+                checkpointer.save(epoch, model, optimizer, scheduler,
+                                  loss_func if isinstance(loss_func, nn.Module) else None,
+                                  best_state.state_dict(), best_loss)
+            if pruner is not None and pruner.report(epoch, report_loss):
+                print(f'Stopped by {type(pruner).__name__} after {epoch + 1} epochs.')
+                break
         except KeyboardInterrupt:
             print('Breaking out of training early.')
             break
+    if checkpointer is not None:
+        checkpointer.wait()
     if verbose:
         if do_val:
             print('Best val loss: {:4f}'.format(best_loss))
         else:
             print('Best training loss: {:4f}'.format(best_loss))
+    if profile and profile_path is not None and profile_log:
+        write_profile_json(profile_log, profile_path)
 
     # load best model weights
-    model.load_state_dict(best_model_wts)
+    model.load_state_dict(best_state.state_dict())
     model.eval()   # Set model to evaluate mode
     # iterate through batches of data for each epoch
+    ds_mem = None
     if ds:
         print('converting prediction to correct units')
 
@@ -518,18 +654,20 @@ def train_model(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
                     else:
                         raise ValueError('Cannot save predictions due to unknown loss function'
                                          f' {loss_func}')
-    del inputs
-    del labels
-    del masks
-    del outputs
+    # none of them are set if a resumed run had no epochs left
+    inputs = labels = masks = outputs = None
     torch.cuda.empty_cache()
 
     return model, best_loss, ds_mem
 
 
-def add_predictions(ds, model, model_params, dims=2, inputs=None):
+def add_predictions(ds, model, model_params, dims=2, inputs=None, tile_size=None, tile_batch=1):
     '''Given a standard MRE dataset, a model, and the associated params, generate MRE predictions
-    and load them into that dataset.'''
+    and load them into that dataset.  `model` may also be the path of an exported model artifact
+    (see `mre.inference.export_model`).  If `tile_size` is given (3D only), volumes are predicted
+    tile by tile with `mre.inference.sliding_window_predict`.'''
+    if isinstance(model, (str, Path)):
+        model = load_model_artifact(model, map_location='cuda:0')
     if inputs is None:
         inputs = ['t1_pre_water', 't1_pre_in', 't1_pre_out', 't1_pre_fat', 't2', 't1_pos_0_water',
                   't1_pos_70_water', 't1_pos_160_water', 't1_pos_300_water']
@@ -538,7 +676,14 @@ def add_predictions(ds, model, model_params, dims=2, inputs=None):
     eval_set = MRETorchDataset(ds, set_type='eval', dims=dims, inputs=inputs)
     dataloader = DataLoader(eval_set, batch_size=4, shuffle=False, num_workers=2)
     for inputs, targets, masks, names in dataloader:
-        prediction = model(inputs.to('cuda:0')).data.cpu().numpy()
+        if tile_size is not None and dims == 3:
+            prediction = sliding_window_predict(model, inputs, tile_size, tile_batch=tile_batch,
+                                                device='cuda:0')
+        else:
+            prediction = model(inputs.to('cuda:0'))
+        if isinstance(prediction, tuple):
+            prediction = prediction[0]
+        prediction = prediction.data.cpu().numpy()
         if dims == 2:
             for i, name in enumerate(names):
                 subj, z = name.split('_')
@@ -553,63 +698,108 @@ def add_predictions(ds, model, model_params, dims=2, inputs=None):
                                      'mre_type': 'mre_pred'}] = (prediction[i, 0].T)*200
 
 
+def subject_mean_stiffness(ds, erode=0, do_cor=False, slope=1, intercept=0, chunk_size=16):
+    '''Mean true ('mre') and predicted ('mre_pred') stiffness of every subject, over the positive
+    voxels of the masked images.  With `do_cor` the predictions are corrected as
+    (pred - intercept)/slope, clipped at 0, and averaged over the whole volume.
+
+    The images are read `chunk_size` subjects at a time (one dask compute per chunk for lazily
+    opened datasets) and reduced without a per-subject loop.
+
+    Returns:
+        (true, pred) arrays of shape (subject,), pred with NaN replaced by 0.
+    '''
+    from mre.masks import eroded_masks
+    masks = eroded_masks(ds, erode).values
+    images = ds['image_mre'].sel(mre_type=['mre', 'mre_pred']).transpose(
+        'subject', 'mre_type', 'x', 'y', 'z')
+    true, pred = [], []
+    for start in range(0, len(ds.subject), chunk_size):
+        block = images[start:start+chunk_size].values * masks[start:start+chunk_size, None]
+        positive = block > 0
+        axes = (1, 2, 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            true.append(np.where(positive[:, 0], block[:, 0], 0).sum(axis=axes) /
+                        positive[:, 0].sum(axis=axes))
+            if do_cor:
+                # non-positive voxels count as 0 after the correction
+                corrected = np.where(positive[:, 1], (block[:, 1] - intercept)/slope, 0)
+                pred.append(np.where(corrected > 0, corrected, 0).mean(axis=axes))
+            else:
+                pred.append(np.where(positive[:, 1], block[:, 1], 0).sum(axis=axes) /
+                            positive[:, 1].sum(axis=axes))
+    return np.concatenate(true), np.nan_to_num(np.concatenate(pred))
+
+
+def linear_fit(x, y):
+    '''Closed-form least squares fit of y = slope*x + intercept over the finite points.
+
+    Returns:
+        (slope, intercept, r2)
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    x_mean, y_mean = x.mean(), y.mean()
+    slope = ((x - x_mean)*(y - y_mean)).sum()/((x - x_mean)**2).sum()
+    intercept = y_mean - slope*x_mean
+    r2 = 1 - (y - slope*x - intercept).var()/y.var()
+    return slope, intercept, r2
+
+
 def get_linear_fit(ds, do_cor=False, make_plot=True, verbose=True, return_df=False, erode=0):
     '''Generate a linear fit between the average stiffness values for the true and predicted MRE
-    values.  Only consider pixels in the mask region.'''
+    values.  Only consider pixels in the mask region.  The fit is closed-form least squares; lmfit
+    is only used (if installed) for the plot and the verbose fit report.'''
 
-    true = []
-    pred = []
+    slope, intercept = 1, 0
     if do_cor:
         slope = np.mean(ds['val_slope'].values)
         intercept = np.mean(ds['val_intercept'].values)
         print(slope, intercept)
-    for subj in ds.subject:
-        mask = ds.sel(subject=subj, mask_type='combo')['mask_mre'].values
-        if erode != 0:
-            for i in range(mask.shape[-1]):
-                mask[:, :, i] = ndi.binary_erosion(mask[:, :, i],
-                                                   iterations=erode).astype(mask.dtype)
-        true_mre_region = (ds.sel(subject=subj, mre_type='mre')['image_mre'].values * mask)
-        true_mre_region = np.where(true_mre_region > 0, true_mre_region, np.nan)
-        pred_mre_region = (ds.sel(subject=subj, mre_type='mre_pred')['image_mre'].values * mask)
-        pred_mre_region = np.where(pred_mre_region > 0, pred_mre_region, np.nan)
-        if do_cor:
-            # slope = np.mean(ds.sel(subject=subj)['val_slope'].values)
-            # intercept = np.mean(ds.sel(subject=subj)['val_intercept'].values)
-            # print(slope, intercept)
-            pred_mre_region = (pred_mre_region-intercept)/slope
-            pred_mre_region = np.where(pred_mre_region > 0, pred_mre_region, 0)
-        true.append(np.nanmean(true_mre_region))
-        pred.append(np.nan_to_num(np.nanmean(pred_mre_region)))
+    true, pred = subject_mean_stiffness(ds, erode, do_cor, slope, intercept)
 
     df_results = pd.DataFrame({'true': true, 'predict': pred, 'subject': ds.subject.values})
     df_results['fibrosis'] = np.where(df_results.true > 4000,
                                       'Severe Fibrosis', 'Mild Fibrosis')
-    model = LinearModel()
-    # params = model.guess(df_results['predict'], x=df_results['true'])
-    params = model.make_params(slope=0.5, intercept=0)
-    result = model.fit(df_results['predict'], params, x=df_results['true'])
-
-    if make_plot:
-        import matplotlib.pyplot as plt
-        result.plot()
-        plt.title('Mre_true vs Mre_pred')
-        plt.ylim(0, 12000)
-        plt.xlim(0, 12000)
-        plt.xlabel('True MRE')
-        plt.ylabel('Predicted MRE')
+    fit_slope, fit_intercept, r2 = linear_fit(df_results['true'], df_results['predict'])
 
-    if verbose:
-        print(result.fit_report())
-        print('R2:', 1 - result.residual.var() / np.var(df_results['predict']))
+    if make_plot or verbose:
+        try:
+            from lmfit.models import LinearModel
+        except ImportError:
+            LinearModel = None
+        if LinearModel is not None:
+            model = LinearModel()
+            params = model.make_params(slope=fit_slope, intercept=fit_intercept)
+            result = model.fit(df_results['predict'], params, x=df_results['true'])
+        if make_plot:
+            import matplotlib.pyplot as plt
+            if LinearModel is not None:
+                result.plot()
+            else:
+                plt.plot(df_results['true'], df_results['predict'], 'o')
+                plt.plot(df_results['true'], fit_slope*df_results['true'] + fit_intercept)
+            plt.title('Mre_true vs Mre_pred')
+            plt.ylim(0, 12000)
+            plt.xlim(0, 12000)
+            plt.xlabel('True MRE')
+            plt.ylabel('Predicted MRE')
+        if verbose:
+            if LinearModel is not None:
+                print(result.fit_report())
+            else:
+                print(f'slope: {fit_slope}, intercept: {fit_intercept}')
+            print('R2:', r2)
     if return_df:
         return df_results
     else:
-        return result.params['slope'].value, result.params['intercept'].value
+        return fit_slope, fit_intercept
 
 
 def add_val_linear_cor(ds_val, ds_test, erode=0):
-    slope, intercept = get_linear_fit(ds_val, False, False, erode=erode)
+    slope, intercept = get_linear_fit(ds_val, False, False, verbose=False, erode=erode)
     ds_test['val_slope'] = (('subject'), np.asarray([slope]*len(ds_test.subject)))
     ds_test['val_intercept'] = (('subject'), np.asarray([intercept]*len(ds_test.subject)))
     ds_test['erode'] = (('subject'), np.asarray([erode]*len(ds_test.subject)))
@@ -0,0 +1,106 @@
+import time
+import json
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+import torch
+
+
+class StepProfiler:
+    '''Per-step timing of a training loop, split into data wait, host-to-device transfer, forward,
+    loss and backward (incl. the optimizer step).
+
+    Usage::
+
+        prof = StepProfiler(device, enabled=profile)
+        for data in prof.wrap(dataloader):
+            with prof.section('transfer'):
+                inputs = data[0].to(device)
+            ...
+            prof.end_step(inputs.size(0))
+
+    CUDA is synchronized at every section boundary so asynchronous kernels are charged to the
+    section that launched them.  That stalls the pipeline a little, so only enable it to profile.
+    When disabled, every call is a no-op.
+    '''
+    sections = ('data', 'transfer', 'forward', 'loss', 'backward')
+
+    def __init__(self, device='cpu', enabled=True):
+        self.enabled = enabled
+        self.cuda = torch.device(device).type == 'cuda'
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.steps = 0
+        self.samples = 0
+        self._since = None
+
+    def _sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def wrap(self, iterable):
+        '''Iterate over `iterable` (a DataLoader), charging the time spent waiting for each batch to
+        the 'data' section.'''
+        if not self.enabled:
+            yield from iterable
+            return
+        self._since = time.perf_counter()
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                data = next(iterator)
+            except StopIteration:
+                break
+            self.times['data'] += time.perf_counter() - start
+            yield data
+
+    @contextmanager
+    def section(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._sync()
+        start = time.perf_counter()
+        yield
+        self._sync()
+        self.times[name] += time.perf_counter() - start
+
+    def end_step(self, n_samples):
+        if self.enabled:
+            self.steps += 1
+            self.samples += n_samples
+
+    def summary(self):
+        '''Total and per-step seconds for each section, plus samples/s over the whole loop.'''
+        wall = time.perf_counter() - self._since if self._since is not None else 0.0
+        summary = {'steps': self.steps, 'samples': self.samples, 'wall_time': wall,
+                   'samples_per_sec': self.samples/wall if wall > 0 else 0.0}
+        for name in self.sections:
+            summary[f'{name}_time'] = self.times[name]
+            summary[f'{name}_per_step'] = self.times[name]/max(self.steps, 1)
+        return summary
+
+    def write(self, tb_writer, phase, epoch):
+        '''Add the summary of this loop to TensorBoard (as `profile/<key>_<phase>`) and return
+        it.'''
+        summary = self.summary()
+        if tb_writer:
+            for key in ['samples_per_sec'] + [f'{name}_per_step' for name in self.sections]:
+                tb_writer.add_scalar(f'profile/{key}_{phase}', summary[key], epoch)
+        return summary
+
+
+def write_profile_json(profile_log, path):
+    '''Dump {phase: [per-epoch summaries]} to `path`, with a mean over epochs for each phase.'''
+    output = {}
+    for phase, epochs in profile_log.items():
+        mean = {key: sum(epoch[key] for epoch in epochs)/len(epochs) for key in epochs[0]}
+        output[phase] = {'epochs': epochs, 'mean': mean}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    return path
@@ -2,8 +2,6 @@
 import numpy as np
 import torch
 import torch.nn as nn
-from torchvision import models
-from tensorboardX import SummaryWriter
 from mre.CoordConv import CoordConv
 
 
@@ -328,6 +326,7 @@ class GeneralUNet3D(nn.Module):
 class PretrainedModel(nn.Module):
     def __init__(self, arch_name):
         super().__init__()
+        from torchvision import models
         self.model_trans = models.resnet50(pretrained=True)
         self.transfer_layer1 = nn.Sequential(*list(self.model_trans.children())[0:3])
         self.transfer_layer2 = nn.Sequential(*list(self.model_trans.children())[3:5])
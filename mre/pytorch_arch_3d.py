@@ -2,8 +2,6 @@
 import numpy as np
 import torch
 import torch.nn as nn
-from torchvision import models
-from tensorboardX import SummaryWriter
 from mre.CoordConv import CoordConv
 
 
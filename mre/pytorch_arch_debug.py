@@ -4,8 +4,6 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torchvision import models
-from tensorboardX import SummaryWriter
 from mre.CoordConv import CoordConv
 
 
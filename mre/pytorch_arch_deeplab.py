@@ -6,8 +6,6 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torchvision import models
-from tensorboardX import SummaryWriter
 
 
 class SeparableConv3d(nn.Module):
@@ -37,6 +35,78 @@ class SeparableConv3d(nn.Module):
         x = self.norm(x)
         return x
 
+    def fuse(self):
+        '''Fold the norm (and a 1x1 depthwise conv) into the pointwise conv for inference.'''
+        self.conv1, self.pointwise, self.norm = fuse_separable(self.conv1, self.pointwise,
+                                                               self.norm)
+
+
+def fuse_separable(depthwise, pointwise, norm):
+    '''Fold an eval-mode separable conv (depthwise -> pointwise -> norm) into as few ops as
+    possible.
+
+    BatchNorm is folded into the pointwise weights and bias (GroupNorm is data dependent and is
+    kept).  A 1x1 depthwise conv is only a per-channel scale and shift, so it is folded into the
+    pointwise conv as well and the depthwise output is never materialized.  Larger depthwise kernels
+    are kept, as merging them would turn the block into a dense conv.  Replaced modules become
+    `nn.Identity`.  The fused pointwise conv only has a bias if there is one to fold (a conv bias or
+    a BatchNorm), so its `pointwise.bias` key may appear where the block had none.
+
+    Returns:
+        (depthwise, pointwise, norm) modules to use in place of the inputs.
+    '''
+    if depthwise.training or pointwise.training or norm.training:
+        raise ValueError('Separable conv fusion uses running stats, call model.eval() first')
+
+    weight = pointwise.weight.detach().flatten(1)
+    has_bias = pointwise.bias is not None
+    if has_bias:
+        bias = pointwise.bias.detach().clone()
+    else:
+        bias = torch.zeros(pointwise.out_channels, device=weight.device, dtype=weight.dtype)
+    stride = pointwise.stride
+
+    fold_depthwise = (all(k == 1 for k in depthwise.kernel_size) and
+                      all(p == 0 for p in depthwise.padding))
+    if fold_depthwise:
+        dw_weight = depthwise.weight.detach().flatten()
+        if depthwise.bias is not None:
+            bias = bias + weight @ depthwise.bias.detach()
+            has_bias = True
+        weight = weight*dw_weight.unsqueeze(0)
+        stride = depthwise.stride
+
+    if isinstance(norm, nn.BatchNorm3d):
+        scale = norm.weight.detach()/torch.sqrt(norm.running_var + norm.eps)
+        bias = (bias - norm.running_mean)*scale + norm.bias.detach()
+        weight = weight*scale.unsqueeze(1)
+        norm = nn.Identity()
+        has_bias = True
+
+    fused = nn.Conv3d(pointwise.in_channels, pointwise.out_channels, 1, stride=stride,
+                      bias=has_bias)
+    fused = fused.to(device=weight.device, dtype=weight.dtype)
+    fused.weight.data.copy_(weight.view_as(fused.weight))
+    if has_bias:
+        fused.bias.data.copy_(bias)
+    fused.eval()
+    if fold_depthwise:
+        depthwise = nn.Identity()
+    return depthwise, fused, norm
+
+
+def fuse_separable_convs(model, channels_last=False):
+    '''Fuse every SeparableConv3d and ASPP branch of an eval-mode model in place (see
+    `fuse_separable`).  Load checkpoints before fusing: the fused modules drop the norm params.
+    If `channels_last` is set, the weights are also converted to `torch.channels_last_3d`; inputs
+    should then be converted with `x.contiguous(memory_format=torch.channels_last_3d)`.'''
+    for module in model.modules():
+        if isinstance(module, (SeparableConv3d, _ASPPModule)):
+            module.fuse()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last_3d)
+    return model
+
 
 def fixed_padding(inputs, kernel_size, dilation):
     # unclear why this would be needed
@@ -314,6 +384,11 @@ class _ASPPModule(nn.Module):
 
         return self.relu(x)
 
+    def fuse(self):
+        '''Fold the norm (and the 1x1 atrous conv of the first branch) into the pointwise conv.'''
+        self.atrous_conv, self.pointwise, self.norm = fuse_separable(self.atrous_conv,
+                                                                     self.pointwise, self.norm)
+
     def _init_weight(self):
         for m in self.modules():
             if isinstance(m, nn.Conv3d):
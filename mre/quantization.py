@@ -0,0 +1,145 @@
+import warnings
+import numpy as np
+from skimage import exposure
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from mre.inference import freeze_for_inference
+
+
+def models_genesis_input(image):
+    '''Rescale a (z, y, x) MRI volume to [-1, 1] (0.5-99.5 percentile window, per slice) and return
+    it as a (1, 1, z, y, x) tensor, as expected by the ModelsGenesis liver segmentation model.'''
+    image = image*1.0
+    v_min, v_max = np.percentile(image, (0.5, 99.5))
+    for i in range(image.shape[0]):
+        image[i, :] = exposure.rescale_intensity(image[i], in_range=(v_min, v_max),
+                                                 out_range=(-1.0, 1.0))
+    return torch.Tensor(image[np.newaxis, np.newaxis, :])
+
+
+def calibration_volumes(ds, n_volumes=4, sequences=('t1_in', 't1_out', 't2'), seed=100):
+    '''Pick a few CHAOS MR volumes (the segmentation model's training data) for int8 calibration
+    and agreement checks.
+
+    Args:
+        ds (xr.Dataset): CHAOS dataset with an 'image' variable (subject, sequence, z, y, x).
+        n_volumes (int): Number of volumes to return.
+        sequences (tuple): MR sequences to draw from.
+        seed (int): Seed for the subject shuffle.
+
+    Returns:
+        List of (1, 1, z, y, x) tensors, preprocessed with `models_genesis_input`.
+    '''
+    ds = ds.sel(sequence=list(sequences))
+    subjects = np.random.RandomState(seed).permutation(ds.subject.values)
+    volumes = []
+    for subj in subjects:
+        for seq in sequences:
+            image = ds['image'].sel(subject=subj, sequence=seq).transpose('z', 'y', 'x').values
+            if not np.any(image):
+                continue
+            volumes.append(models_genesis_input(image))
+            if len(volumes) == n_volumes:
+                return volumes
+    return volumes
+
+
+class CastModel(nn.Module):
+    '''Run a model in reduced precision, taking and returning float32 tensors.'''
+
+    def __init__(self, model, dtype=torch.bfloat16):
+        super().__init__()
+        self.model = model.to(dtype)
+        self.dtype = dtype
+
+    def forward(self, x):
+        return self.model(x.to(self.dtype)).float()
+
+
+def quantize_model(model, precision='int8', calib_volumes=None, backend=None, fix_cont_bn=False):
+    '''Return a reduced-precision copy of a segmentation model for CPU inference.
+
+    The model is first frozen with `inference.freeze_for_inference`.  'int8' uses static post-
+    training quantization (FX graph mode): the ContBatchNorm3d layers of ModelsGenesis are fixed to
+    their running statistics (quantized kernels cannot compute batch statistics), and activation
+    ranges are calibrated on `calib_volumes`.  Trilinear resizing stays in float.  Dynamic
+    quantization only covers Linear and RNN layers, which these conv nets do not have, so it is not
+    offered.
+
+    Args:
+        model (nn.Module): UNet3D (ModelsGenesis), GeneralUNet3D or DeepLab.
+        precision (str): 'fp32' (frozen copy only), 'bf16' or 'int8'.
+        calib_volumes (list): Input tensors for int8 calibration (see `calibration_volumes`).
+        backend (str): Quantized engine, defaults to 'x86' (or 'fbgemm' on older torch).
+        fix_cont_bn (bool): Fix ContBatchNorm3d statistics for 'fp32' and 'bf16' as well (opt-in,
+            as in `freeze_for_inference`).  Always done for 'int8'.
+    '''
+    if precision in ['fp32', 'bf16']:
+        frozen = freeze_for_inference(model, fix_cont_bn=fix_cont_bn)
+        if precision == 'bf16':
+            return CastModel(frozen, torch.bfloat16).eval()
+        return frozen
+
+    elif precision == 'int8':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        if not calib_volumes:
+            raise ValueError('int8 quantization needs calib_volumes for calibration')
+        if backend is None:
+            engines = torch.backends.quantized.supported_engines
+            backend = 'x86' if 'x86' in engines else 'fbgemm'
+        torch.backends.quantized.engine = backend
+
+        frozen = freeze_for_inference(model, fix_cont_bn=True)
+        qconfig_mapping = get_default_qconfig_mapping(backend)
+        qconfig_mapping.set_object_type(F.interpolate, None)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            prepared = prepare_fx(frozen, qconfig_mapping, (calib_volumes[0],))
+            calibrate(prepared, calib_volumes)
+            quantized = convert_fx(prepared)
+        return quantized.eval()
+
+    else:
+        raise ValueError(f'Unknown precision "{precision}", use one of "fp32", "bf16", "int8"')
+
+
+def calibrate(model, volumes):
+    '''Feed `volumes` through a model prepared for static quantization to record activation
+    ranges.'''
+    with torch.no_grad():
+        for volume in volumes:
+            model(volume)
+    return model
+
+
+def dice_agreement(reference, candidate, threshold=0.5):
+    '''Dice coefficient between the binary masks of two logit predictions.'''
+    ref = torch.sigmoid(reference) > threshold
+    cand = torch.sigmoid(candidate) > threshold
+    denom = ref.sum() + cand.sum()
+    if denom == 0:
+        return 1.0
+    return (2*(ref & cand).sum().float()/denom).item()
+
+
+def check_agreement(reference_model, model, volumes, min_dice=0.95, verbose=True):
+    '''Compare the liver masks of a reduced-precision `model` against the fp32 `reference_model`.
+    Warns if any volume falls below `min_dice`.
+
+    Returns:
+        List of Dice scores, one per volume.
+    '''
+    dices = []
+    with torch.no_grad():
+        for volume in volumes:
+            dices.append(dice_agreement(reference_model(volume), model(volume)))
+    if verbose:
+        print(f'mask Dice agreement with fp32: min {min(dices):.4f}, mean {np.mean(dices):.4f}')
+    if min(dices) < min_dice:
+        warnings.warn(f'Reduced-precision mask model disagrees with fp32 (min Dice '
+                      f'{min(dices):.4f} < {min_dice})')
+    return dices
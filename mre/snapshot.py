@@ -0,0 +1,41 @@
+import os
+import stat
+import shutil
+from pathlib import Path
+
+from mre.fingerprint import PACKAGE_DIR, code_files, code_version
+
+
+def snapshot_code(snapshot_root, package_dir=PACKAGE_DIR):
+    '''Immutable copy of the package source for sweep jobs, keyed by its content hash.
+
+    The source files (see `fingerprint.code_files`) are copied to
+    `<snapshot_root>/<code_version>/mre` once; later sweeps with the same code reuse that
+    directory.  Jobs import it by putting the returned directory first on PYTHONPATH, so the
+    package keeps its name.
+
+    Returns:
+        The snapshot directory (to prepend to PYTHONPATH).
+    '''
+    version = code_version(package_dir)
+    snap_dir = Path(snapshot_root, version)
+    if snap_dir.exists():
+        return snap_dir
+
+    # Build next to the final location and rename, so a half-written snapshot is never used
+    tmp_dir = Path(snapshot_root, f'.{version}.{os.getpid()}.tmp')
+    for path in code_files(package_dir):
+        dest = Path(tmp_dir, 'mre', path.relative_to(package_dir))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, dest)
+        dest.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    if code_version(Path(tmp_dir, 'mre')) != version:
+        raise RuntimeError(f'Snapshot of {package_dir} does not match its code version')
+    try:
+        os.rename(tmp_dir, snap_dir)
+    except OSError:
+        # another sweep staged the same code first
+        if not snap_dir.exists():
+            raise
+        shutil.rmtree(tmp_dir)
+    return snap_dir
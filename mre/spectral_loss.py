@@ -0,0 +1,92 @@
+import torch
+import torch.fft
+
+
+class SpectralLoss:
+    '''Masked MSE between the normalized power spectra of a prediction and its target.
+
+    This is the spectral counterpart of `prediction.masked_mse_fft`, but with a real FFT restricted
+    to the spatial dims (z, y, x) instead of a complex FFT over all five dims.  The half spectrum
+    returned by `rfftn` is weighted by its Hermitian multiplicity, so the statistics (and the loss)
+    are those of the full spatial spectrum.  Each sample is normalized by its own mean and std,
+    which makes the loss independent of batch composition and lets target spectra be cached per
+    subject.
+
+    Args:
+        band (list): Optional [low, high] radial frequency band (cycles/voxel).  Frequencies inside
+            the band get weight 1, frequencies outside get `band_weight`.
+        band_weight (float): Weight for frequencies outside `band`.  Default 0 (band-pass).
+        cache_target (bool): Reuse target spectra for subjects that are passed in via `names`.
+            Only pass names for data that is not augmented (e.g. val/test phases).
+    '''
+    def __init__(self, band=None, band_weight=0.0, cache_target=True):
+        if band is not None and len(band) != 2:
+            raise ValueError(f'band must be [low, high], got {band}')
+        self.band = band
+        self.band_weight = band_weight
+        self.cache_target = cache_target
+        self._weights = {}
+        self._target_cache = {}
+
+    def __call__(self, pred, target, mask, names=None):
+        pow_pred = self.power_spectrum(pred*mask)
+        if names is None or not self.cache_target:
+            pow_target = self.power_spectrum(target*mask)
+        else:
+            pow_target = self.cached_target_spectrum(target, mask, names)
+
+        herm, band = self.weights(pred.shape[2:], pred.device, pow_pred.dtype)
+        n_full = pred[0, 0].numel()
+        fft_mse = (herm*band*(pow_pred - pow_target)**2).sum()/(n_full*pred.shape[0]*pred.shape[1])
+        return fft_mse
+
+    def power_spectrum(self, x):
+        '''Per-sample, per-channel standardized power spectrum over the spatial dims.'''
+        spec = torch.fft.rfftn(x, dim=(-3, -2, -1))
+        power = torch.view_as_real(spec).pow(2).sum(-1)
+
+        herm, _ = self.weights(x.shape[2:], x.device, power.dtype)
+        n_full = x[0, 0].numel()
+        mean = (herm*power).sum((-3, -2, -1), keepdim=True)/n_full
+        var = (herm*(power - mean)**2).sum((-3, -2, -1), keepdim=True)/(n_full - 1)
+        return (power - mean)/var.sqrt()
+
+    def cached_target_spectrum(self, target, mask, names):
+        '''Return target spectra for `names`, computing only the ones not already cached.'''
+        missing = [i for i, name in enumerate(names) if name not in self._target_cache]
+        if missing:
+            idx = torch.as_tensor(missing, device=target.device)
+            spec = self.power_spectrum(target.index_select(0, idx)*mask.index_select(0, idx))
+            for j, i in enumerate(missing):
+                self._target_cache[names[i]] = spec[j].detach()
+        return torch.stack([self._target_cache[name] for name in names])
+
+    def weights(self, shape, device, dtype):
+        '''Hermitian multiplicity and band weights for a spatial `shape`, cached per
+        (shape, device, dtype).'''
+        key = (tuple(shape), str(device), dtype)
+        if key not in self._weights:
+            nz, ny, nx = shape
+            herm = torch.full((nx//2 + 1,), 2.0)
+            herm[0] = 1.0
+            if nx % 2 == 0:
+                herm[-1] = 1.0
+            herm = herm.view(1, 1, 1, 1, -1)
+
+            if self.band is None:
+                band = torch.ones(1)
+            else:
+                fz = torch.fft.fftfreq(nz).view(-1, 1, 1)
+                fy = torch.fft.fftfreq(ny).view(1, -1, 1)
+                fx = torch.fft.rfftfreq(nx).view(1, 1, -1)
+                radius = torch.sqrt(fz**2 + fy**2 + fx**2)
+                in_band = (radius >= self.band[0]) & (radius <= self.band[1])
+                band = torch.where(in_band, torch.tensor(1.0),
+                                   torch.tensor(float(self.band_weight)))
+                band = band.unsqueeze(0).unsqueeze(0)
+            self._weights[key] = (herm.to(device=device, dtype=dtype),
+                                  band.to(device=device, dtype=dtype))
+        return self._weights[key]
+
+    def clear_cache(self):
+        self._target_cache = {}
@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import hashlib
+from pathlib import Path
+from functools import lru_cache
+
+SPLIT_DIR = Path(__file__).parent / 'splits'
+
+
+def available_splits(split_dir=SPLIT_DIR):
+    '''Names of the registered splits and their available versions, e.g. {'smart_wave_v1': [1]}.'''
+    splits = {}
+    for path in Path(split_dir).glob('*.v*.json'):
+        name, version = re.fullmatch(r'(.+)\.v(\d+)\.json', path.name).groups()
+        splits.setdefault(name, []).append(int(version))
+    return {name: sorted(versions) for name, versions in sorted(splits.items())}
+
+
+@lru_cache(maxsize=None)
+def load_split(name, version=None, split_dir=SPLIT_DIR):
+    '''Load a split definition from the registry (`<split_dir>/<name>.v<version>.json`).
+
+    A definition has either fixed 'train' and 'val' subject lists, or ordered subject 'groups' (e.g.
+    high and low stiffness) with the number of validation subjects taken from the head of each
+    group in 'n_val'.
+
+    Args:
+        name (str): Registered split name (see `available_splits`).
+        version (int): Version of the split, defaults to the latest.
+        split_dir (Path): Registry directory.
+    '''
+    versions = available_splits(split_dir).get(name)
+    if not versions:
+        raise KeyError(f'No split named "{name}" in {split_dir}')
+    if version is None:
+        version = versions[-1]
+    elif version not in versions:
+        raise KeyError(f'Split "{name}" has no version {version} (available: {versions})')
+    with open(Path(split_dir, f'{name}.v{version}.json')) as f:
+        return json.load(f)
+
+
+def split_name(sampling_breakdown, dataset_ver):
+    '''Registry name of the split used by `train_model_full` for a sampling_breakdown and
+    dataset_ver, or None if the split is not a fixed one.'''
+    if sampling_breakdown == 'smart':
+        return f'smart_{dataset_ver}'
+    elif sampling_breakdown in ['smart_LOO', 'stratified_fixed']:
+        return sampling_breakdown
+    return None
+
+
+def _drop(subjects, test_set):
+    return [subj for subj in subjects if subj not in test_set]
+
+
+def _cache_path(cache_dir, name, key):
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    return Path(cache_dir, f'{name}_{digest}.json')
+
+
+def _read_cache(path):
+    if path is not None and path.exists():
+        with open(path) as f:
+            folds = json.load(f)
+        return folds['train'], folds['val'], folds['test']
+    return None
+
+
+def _write_cache(path, key, folds):
+    if path is None:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write-then-rename, other jobs of the sweep may be reading the same file
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(zip(['train', 'val', 'test'], folds), key=key), f)
+    os.replace(tmp_path, path)
+
+
+_RESOLVED = {}
+
+
+def resolve_split(name, test_list, version=None, cache_dir=None, split_dir=SPLIT_DIR):
+    '''Train, val and test subject lists of a registered split, with the `test_list` subjects
+    removed from train and val.
+
+    Resolved folds are cached in memory, and in `cache_dir` (if given) so all the jobs of a sweep
+    share them.
+
+    Returns:
+        (train_list, val_list, test_list)
+    '''
+    split = load_split(name, version, split_dir)
+    test_list = list(test_list or [])
+    key = {'name': name, 'version': split['version'], 'test': sorted(test_list)}
+    mem_key = json.dumps(key, sort_keys=True)
+    if mem_key in _RESOLVED:
+        return _RESOLVED[mem_key]
+
+    path = _cache_path(cache_dir, name, key) if cache_dir is not None else None
+    folds = _read_cache(path)
+    if folds is None:
+        test_set = set(test_list)
+        if 'groups' in split:
+            train_list, val_list = [], []
+            for group, subjects in split['groups'].items():
+                subjects = _drop(subjects, test_set)
+                n_val = split['n_val'][group]
+                val_list += subjects[:n_val]
+                train_list += subjects[n_val:]
+        else:
+            train_list = _drop(split['train'], test_set)
+            val_list = _drop(split['val'], test_set)
+        folds = (train_list, val_list, test_list)
+        _write_cache(path, key, folds)
+    _RESOLVED[mem_key] = folds
+    return folds
+
+
+def stratified_split(strat_file, test_list, seed, test_size=28, cache_dir=None):
+    '''Gender-stratified train/val shuffle split of the subjects in `strat_file` (a pickled
+    DataFrame indexed by subject), with the `test_list` subjects removed.  The pickle is only read
+    when the folds are not already in `cache_dir`.
+
+    Returns:
+        (train_list, val_list, test_list)
+    '''
+    test_list = list(test_list or [])
+    key = {'name': 'stratified', 'file': str(strat_file), 'seed': seed, 'test_size': test_size,
+           'test': sorted(test_list)}
+    path = _cache_path(cache_dir, 'stratified', key) if cache_dir is not None else None
+    folds = _read_cache(path)
+    if folds is not None:
+        return folds
+
+    import pandas as pd
+    from sklearn.model_selection import StratifiedShuffleSplit
+    df_strat = pd.read_pickle(strat_file)
+    mskf = StratifiedShuffleSplit(n_splits=1, test_size=test_size, random_state=seed)
+    splits = mskf.split(df_strat.index.values, df_strat[['gender']].values.flatten())
+    train_index, val_index = next(splits)
+    test_set = set(test_list)
+    train_list = _drop(df_strat.index[train_index].values.tolist(), test_set)
+    val_list = _drop(df_strat.index[val_index].values.tolist(), test_set)
+    folds = (train_list, val_list, test_list)
+    _write_cache(path, key, folds)
+    return folds
@@ -0,0 +1,170 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+SEQUENCES = ['t1_pre_water', 't1_pre_in', 't1_pre_out', 't1_pre_fat', 't2', 't1_pos_0_water',
+             't1_pos_70_water', 't1_pos_160_water', 't1_pos_300_water']
+CLINICAL = ['age', 'gender', 'height', 'weight', 'bmi', 'htn', 'hld', 'dm', 'ast', 'alt', 'alk',
+            'tbili', 'albumin', 'plt']
+
+
+def _ellipsoid(nx, ny, nz, center, radii):
+    x, y, z = np.meshgrid(np.arange(nx), np.arange(ny), np.arange(nz), indexing='ij')
+    dist = (((x - center[0])/radii[0])**2 + ((y - center[1])/radii[1])**2 +
+            ((z - center[2])/radii[2])**2)
+    return dist <= 1
+
+
+def synthetic_subject(rng, sequences, mre_types, nx, ny, nz, wave_name='wave'):
+    '''Random (x, y, z) volumes for one subject: a liver-like ellipsoid with a per-subject
+    stiffness, an MRE confidence region, and a wave image if `wave_name` is in `mre_types`.
+
+    Returns:
+        (image_mri, mask_mri, image_mre, mask_mre, stiffness) with the leading sequence/mask_type/
+        mre_type axis, as int16 arrays (mask_type order: liver, mre, combo).
+    '''
+    center = rng.uniform(0.4, 0.6, 3)*(nx, ny, nz)
+    radii = rng.uniform(0.2, 0.3, 3)*(nx, ny, nz)
+    liver = _ellipsoid(nx, ny, nz, center, radii)
+    mre_region = liver & _ellipsoid(nx, ny, nz, center, radii*(1.2, 0.8, 0.7))
+    masks = np.stack([liver, mre_region, liver & mre_region]).astype(np.int16)
+
+    image_mri = np.empty((len(sequences), nx, ny, nz), dtype=np.int16)
+    for i in range(len(sequences)):
+        body = rng.uniform(200, 600)
+        organ = rng.uniform(300, 1200)
+        vol = rng.normal(body, 40, (nx, ny, nz)) + organ*liver
+        image_mri[i] = np.clip(vol, 0, 1500).astype(np.int16)
+
+    stiffness = rng.uniform(1500, 8000)
+    x = np.arange(nx)[:, None, None]/nx
+    smooth = 1 + 0.1*np.sin(2*np.pi*(x + rng.uniform()))
+    image_mre = np.zeros((len(mre_types), nx, ny, nz), dtype=np.int16)
+    for i, mre_type in enumerate(mre_types):
+        if mre_type == 'mre':
+            image_mre[i] = (stiffness*smooth*masks[0]).astype(np.int16)
+        elif mre_type == 'mre_mask':
+            image_mre[i] = (stiffness*smooth*masks[2]).astype(np.int16)
+        elif mre_type == 'mre_raw':
+            image_mre[i] = rng.normal(stiffness, 500, (nx, ny, nz)).clip(0, 20000).astype(np.int16)
+        elif mre_type == wave_name:
+            k = rng.uniform(4, 10)
+            wave = 1000*np.sin(2*np.pi*k*x + rng.uniform(0, 2*np.pi))
+            image_mre[i] = np.broadcast_to(wave*masks[0], (nx, ny, nz)).astype(np.int16)
+    return image_mri, masks, image_mre, masks.copy(), stiffness
+
+
+def synthetic_clinical(rng, stiffness):
+    '''Plausible clinical values for one subject, loosely correlated with stiffness (Pa).'''
+    fib = (stiffness - 1500)/6500
+    height = rng.normal(170, 10)
+    weight = rng.normal(85, 15)
+    return {'age': rng.randint(20, 80), 'gender': rng.randint(0, 2), 'height': height,
+            'weight': weight, 'bmi': weight/(height/100)**2, 'htn': rng.randint(0, 2),
+            'hld': rng.randint(0, 2), 'dm': rng.randint(0, 2), 'ast': rng.normal(30 + 60*fib, 10),
+            'alt': rng.normal(30 + 40*fib, 10), 'alk': rng.normal(90, 25),
+            'tbili': abs(rng.normal(0.7 + fib, 0.3)), 'albumin': rng.normal(4.2 - fib, 0.3),
+            'plt': rng.normal(250 - 120*fib, 40)}
+
+
+def make_synthetic_cohort(n_subj=8, nx=256, ny=256, nz=32, nz_mre=4, sequences=None, wave=True,
+                          wave_name='wave', clinical=True, layout='gold', seed=0, out_dir=None):
+    '''Generate a random MRE cohort in the xarray schema of the real data, for benchmarks and tests
+    that cannot reach the cluster data.
+
+    Args:
+        n_subj (int): Number of subjects (named '0000', '0001', ...).
+        nx, ny, nz (int): Volume size.
+        nz_mre (int): Number of MRE slices (only used by the 'raw' layout and `mri_to_mre_idx`).
+        sequences (list): MRI sequences, defaults to the 9 training inputs.
+        wave (bool): Include a wave image channel, named `wave_name` ('wave' or 'mre_wave').
+        clinical (bool): Include the 14 per-subject clinical variables.
+        layout (str): 'gold' for the processed files read by `train_model_full`, `MRETorchDataset`
+            and `ModelCompare` (one shared z dim), or 'raw' for the output of
+            `MREtoXr.init_new_ds` (separate z_mri/z_mre dims, no clinical variables).
+        seed (int): Random seed, cohorts are reproducible.
+        out_dir (str): If given, write one 'xarray_<subject>.nc' file per subject there.
+
+    Returns:
+        xr.Dataset with all subjects.
+    '''
+    if layout not in ['gold', 'raw']:
+        raise ValueError(f'Unknown layout "{layout}"')
+    if sequences is None:
+        sequences = SEQUENCES
+    mre_types = ['mre', 'mre_mask', 'mre_raw'] + ([wave_name] if wave else []) + ['mre_pred']
+    mask_types = ['liver', 'mre', 'combo']
+    subjects = [f'{i:04d}' for i in range(n_subj)]
+    rng = np.random.RandomState(seed)
+
+    subj_ds = []
+    for subj in subjects:
+        image_mri, mask_mri, image_mre, mask_mre, stiffness = synthetic_subject(
+            rng, sequences, mre_types, nx, ny, nz, wave_name)
+        mri_to_mre_idx = np.linspace(nz//4, 3*nz//4, nz_mre).astype(np.int16)
+        if layout == 'gold':
+            data_vars = {
+                'image_mri': (['subject', 'sequence', 'x', 'y', 'z'], image_mri[None]),
+                'mask_mri': (['subject', 'mask_type', 'x', 'y', 'z'], mask_mri[None]),
+                'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'], image_mre[None]),
+                'mask_mre': (['subject', 'mask_type', 'x', 'y', 'z'], mask_mre[None]),
+                'mri_to_mre_idx': (['subject', 'z_idx'], mri_to_mre_idx[None]),
+            }
+            if clinical:
+                for key, val in synthetic_clinical(rng, stiffness).items():
+                    data_vars[key] = (['subject'], np.asarray([val], dtype=np.float64))
+            coords = {'subject': [subj], 'sequence': sequences, 'mask_type': mask_types,
+                      'mre_type': mre_types, 'x': range(nx), 'y': range(ny)[::-1],
+                      'z': range(nz)}
+        else:
+            data_vars = {
+                'image_mri': (['subject', 'sequence', 'x', 'y', 'z_mri'], image_mri[None]),
+                'mask_mri': (['subject', 'mask_type', 'x', 'y', 'z_mri'], mask_mri[None]),
+                'image_mre': (['subject', 'mre_type', 'x', 'y', 'z_mre'],
+                              image_mre[None][..., mri_to_mre_idx]),
+                'mask_mre': (['subject', 'mask_type', 'x', 'y', 'z_mre'],
+                             mask_mre[None][..., mri_to_mre_idx]),
+                'mri_to_mre_idx': (['subject', 'z_mre'], mri_to_mre_idx[None]),
+                'mutual_info': (['subject', 'sequence', 'z_mre'],
+                                np.zeros((1, len(sequences), nz_mre), dtype=np.int16)),
+            }
+            coords = {'subject': [subj], 'sequence': sequences, 'mask_type': mask_types,
+                      'mre_type': mre_types, 'x': range(nx), 'y': range(ny)[::-1],
+                      'z_mri': range(nz), 'z_mre': range(nz_mre)}
+        ds = xr.Dataset(data_vars, coords=coords)
+        if out_dir is not None:
+            Path(out_dir).mkdir(parents=True, exist_ok=True)
+            ds.to_netcdf(Path(out_dir, f'xarray_{subj}.nc'))
+        subj_ds.append(ds)
+
+    return xr.concat(subj_ds, dim='subject')
+
+
+def synthetic_clinical_df(ds):
+    '''The clinical variables of a synthetic cohort as a DataFrame, in the format of
+    `mre_datasets.clinical_df_maker`.'''
+    df = pd.DataFrame({key: ds[key].values for key in CLINICAL if key in ds},
+                      index=pd.Index(ds.subject.values, name='subject'))
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a synthetic MRE cohort.')
+    parser.add_argument('--out_dir', type=str, help='Output directory for xarray_<subj>.nc files.',
+                        required=True)
+    parser.add_argument('--n_subj', type=int, default=8)
+    parser.add_argument('--shape', type=int, nargs=3, default=[32, 256, 256],
+                        help='Volume size (z, y, x).')
+    parser.add_argument('--nz_mre', type=int, default=4)
+    parser.add_argument('--no_wave', action='store_true')
+    parser.add_argument('--no_clinical', action='store_true')
+    parser.add_argument('--layout', type=str, default='gold', choices=['gold', 'raw'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    nz, ny, nx = args.shape
+    make_synthetic_cohort(args.n_subj, nx, ny, nz, args.nz_mre, wave=not args.no_wave,
+                          clinical=not args.no_clinical, layout=args.layout, seed=args.seed,
+                          out_dir=args.out_dir)
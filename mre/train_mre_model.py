@@ -7,25 +7,20 @@ import warnings
 import argparse
 import pickle as pkl
 import numpy as np
-import pandas as pd
 from itertools import chain
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from torch.utils.data.sampler import RandomSampler
-from torchsummary import summary
-from tensorboardX import SummaryWriter
-from iterstrat.ml_stratifiers import MultilabelStratifiedShuffleSplit
-from sklearn.model_selection import StratifiedShuffleSplit
 
 from mre.mre_datasets import MREtoXr, MRETorchDataset
 from mre.prediction import train_model, add_predictions, add_val_linear_cor
-from mre import pytorch_arch_2d, pytorch_arch_3d
-from robust_loss_pytorch import adaptive
-from mre.pytorch_arch_deeplab import AlignedXception, DeepLab
-from mre.pytorch_arch_debug import Debug
-from mre.pytorch_arch_clinical import Clinical
+from mre.inference import compile_model, export_model
+from mre.splits import split_name, resolve_split, stratified_split
+from mre.fingerprint import config_fingerprint, code_version, write_run_record, output_file
+# The architectures, tensorboardX, torchsummary, sklearn and robust_loss_pytorch are imported in the
+# branches that use them, to keep the startup of each slurm job short.
 
 # import sls
 
@@ -56,6 +51,7 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
     cfg = process_kwargs(kwargs)
     if verbose:
         print(cfg)
+    fingerprint = run_fingerprint(data_path, data_file, cfg)
     torch.manual_seed(cfg['seed'])
     np.random.seed(cfg['seed'])
 
@@ -81,6 +77,7 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
 
     # Start filling dataloaders
     dataloaders = {}
+    split_cache = Path(output_path, 'splits') if cfg['split_cache'] else None
     if cfg['subj'] is None:
         shuffle_list = np.asarray(ds.subject)
         np.random.shuffle(shuffle_list)
@@ -91,7 +88,8 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         test_list = list(shuffle_list[val_idx:])
     elif cfg['sampling_breakdown'] == 'dumb':
         test_list = cfg['subj']
-        shuffle_list = [subj for subj in ds.subject.values if subj not in test_list]
+        test_set = set(test_list)
+        shuffle_list = [subj for subj in ds.subject.values if subj not in test_set]
         shuffle_list = np.asarray(shuffle_list)
         np.random.shuffle(shuffle_list)
         if cfg['do_val']:
@@ -101,184 +99,18 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         else:
             train_list = list(shuffle_list)
 
-    elif cfg['sampling_breakdown'] == 'smart_LOO':
-        train_subj = ['1550', '1839', '0126', '0890', '1899', '1456', '1851', '0415', '0937',
-                      '1829', '0173', '1083', '1561', '1795', '1033', '1123', '0659', '1504',
-                      '0932', '1417', '1491', '1798', '0693', '0029', '1748', '1287', '2034',
-                      '0655', '0954', '1103', '0491', '1603', '1843', '1791', '0975', '1311',
-                      '1948', '1367', '1979', '1727', '0401', '1667', '0735', '1453', '0006',
-                      '0734', '0898', '1793', '0612', '1940', '1699', '1883', '1526', '0461',
-                      '0747', '1595', '1578', '1893', '1474', '0210', '1574', '1736', '0737',
-                      '1400', '0628', '1106', '0509', '1722', '1530', '1896', '0556', '1435',
-                      '1149', '1554', '1790', '0020', '1110', '0564', '1980', '1786', '0291',
-                      '1144', '0872', '0931', '0344', '1715', '1590', '0704', '0830', '2007',
-                      '1765', '1217', '1819', '1119', '1395', '2029', '0510', '1642', '2046',
-                      '1714', '0235', '1789', '0929', '1045', '1447', '1935', '1541', '1853',
-                      '1072', '1412', '0043']
-        val_subj = ['1720', '1077', '1448', '1329', '1903', '1464', '1967', '1360', '0979', '1337',
-                    '1529', '1341', '1336', '1121', '0860', '1706', '0914', '1679', '1076', '1712',
-                    '0135', '1671', '0904', '1785', '1806', '0748', '1271', '0995', '2001', '1577',
-                    '0234', '1694', '1404', '0940', '0653', '1382', '0492', '0219']
-
-        test_list = cfg['subj']
-        train_list = [subj for subj in train_subj if subj not in test_list]
-        val_list = [subj for subj in val_subj if subj not in test_list]
-
-    elif cfg['sampling_breakdown'] == 'smart':
-        if cfg['dataset_ver'] == 'old':
-            # Needs to be hardcoded for now, problem with calc on the fly
-            high_subj = ['1106', '1853', '0173', '1033', '0954', '1427', '2007', '1736', '1967',
-                         '1474', '1343', '0135', '0890', '1296', '1839', '1395', '1526', '0838',
-                         '1336', '1103', '0929', '1149', '1577', '0747', '2001', '1590', '1083',
-                         '0932', '1530', '0291', '1790', '0210', '1785', '1574', '1896', '1789',
-                         '1979', '1311', '1722', '0491', '1714', '1595', '1367', '1935', '0344',
-                         '0931', '1798', '1287', '0659', '0234', '1715', '0126', '1271', '1791',
-                         '1851', '0219', '1550', '0693', '0461', '1720', '2046', '1077', '0235',
-                         '0898', '0628']
-            low_subj = ['0737', '1426', '1712', '0995', '1464', '1123', '1400', '1278',
-                        '1072', '0704', '1360', '1209', '0564', '1883', '1806', '1045',
-                        '1417', '1404', '1893', '0655', '1699', '1028', '1144', '1554',
-                        '1795', '1578', '0164', '1579', '0020', '1453', '1341', '1903',
-                        '1679', '1447', '0006', '1344', '0904', '1215', '1456', '1671',
-                        '1483', '1121', '0612', '1765', '0914', '1748', '0395', '1727',
-                        '1940', '1948', '0415', '1110', '2034', '1217', '1603', '0734',
-                        '1504', '0830', '0860', '0979', '1819', '1119', '1642', '1491',
-                        '1694', '1843', '1433', '1529', '1706', '0872', '1541', '1561',
-                        '0401', '1382', '1667', '1980', '1545', '0653', '1829', '0043',
-                        '0975', '1076', '2029', '0556', '1435', '0735', '0029', '1303',
-                        '0509', '1899', '1412', '1337', '1329', '1793', '0937', '1786',
-                        '0492', '0940', '0748', '1448', '0510', '0989']
-            test_list = cfg['subj']
-            high_subj = [subj for subj in high_subj if subj not in test_list]
-            low_subj = [subj for subj in low_subj if subj not in test_list]
-
-            val_list = high_subj[:14] + low_subj[:24]
-            train_list = high_subj[14:] + low_subj[24:]
-
-        elif cfg['dataset_ver'] == 'rad_freeze':
-            # Needs to be hardcoded for now, problem with calc on the fly
-            high_subj = ['1736', '2001', '1935', '0898', '1149', '0931', '1590', '1033',
-                         '0135', '1271', '1474', '1577', '1851', '1103', '0173', '1106',
-                         '1790', '0747', '1979', '1077', '0954', '1530', '0291', '0210',
-                         '1550', '1798', '1574', '0890', '1336', '1395', '1853', '1896',
-                         '1967', '2046', '1722', '0491', '1714', '1715', '1526', '1720',
-                         '0344', '0932', '1791', '1311', '0659', '0234', '1785', '0126',
-                         '1287', '1839', '0219', '1595', '0693', '0461', '1789', '2007',
-                         '1083', '0235', '0929', '0628', '1367']
-            low_subj = ['0735', '1529', '1806', '1144', '1110', '1795', '1843', '2029',
-                        '1712', '0020', '1883', '1699', '1076', '1786', '0653', '1448',
-                        '0006', '1464', '1793', '1119', '2034', '1360', '1667', '1382',
-                        '1400', '0940', '1329', '1679', '1578', '1727', '1893', '1899',
-                        '1903', '1948', '1447', '0737', '1341', '0872', '0904', '1045',
-                        '1453', '1404', '0655', '1765', '1694', '1121', '0734', '1706',
-                        '0914', '0401', '1491', '0509', '1829', '1217', '1337', '0937',
-                        '0492', '1456', '1541', '1642', '1554', '0415', '1748', '0704',
-                        '1819', '0043', '0995', '1980', '1940', '0612', '1561', '0748',
-                        '0029', '1412', '0556', '1504', '1435', '1417', '0975', '0510',
-                        '0979', '0860', '1603', '0564', '1072', '1123', '0830', '1671']
-            test_list = cfg['subj']
-            high_subj = [subj for subj in high_subj if subj not in test_list]
-            low_subj = [subj for subj in low_subj if subj not in test_list]
-
-            val_list = high_subj[:10] + low_subj[:20]
-            train_list = high_subj[10:] + low_subj[20:]
-
-        elif cfg['dataset_ver'] == 'rad_freeze_no_eovist':
-            # Needs to be hardcoded for now, problem with calc on the fly
-            high_subj = ['1736', '2001', '1935', '0898', '1149', '1590', '1033',
-                         '0135', '1271', '1577', '1851', '1103', '0173', '1106',
-                         '1790', '0747', '1979', '1077', '0954', '1530', '0291', '0210',
-                         '1550', '1798', '1574', '0890', '1336', '1395', '1853', '1896',
-                         '1967', '2046', '1722', '0491', '1714', '1715', '1526', '1720',
-                         '0344', '1791', '1311', '0659', '0234', '1785', '0126',
-                         '1287', '1839', '1595', '0693', '0461', '1789', '2007',
-                         '1083', '0235', '0929', '0628', '1367']
-            low_subj = ['0735', '1529', '1806', '1144', '1110', '1795', '1843', '2029',
-                        '1712', '0020', '1883', '1699', '1076', '1786', '0653', '1448',
-                        '0006', '1464', '1119', '2034', '1360', '1667', '1382',
-                        '1400', '1329', '1679', '1578', '1727', '1893', '1899',
-                        '1903', '1948', '1447', '0737', '1341', '0872', '0904', '1045',
-                        '1453', '1404', '0655', '1765', '1694', '1121', '0734', '1706',
-                        '0914', '0401', '1491', '0509', '1829', '1217', '1337', '0937',
-                        '0492', '1456', '1541', '1642', '1554', '0415', '1748', '0704',
-                        '1819', '0043', '0995', '1980', '1940', '0612', '1561', '0748',
-                        '0029', '1412', '0556', '1504', '1417', '0975',
-                        '0979', '0860', '1603', '0564', '1072', '1123', '0830', '1671']
-            test_list = cfg['subj']
-            high_subj = [subj for subj in high_subj if subj not in test_list]
-            low_subj = [subj for subj in low_subj if subj not in test_list]
-
-            val_list = high_subj[:10] + low_subj[:20]
-            train_list = high_subj[10:] + low_subj[20:]
-
-        elif cfg['dataset_ver'] == 'wave_v1':
-            # Needs to be hardcoded for now, problem with calc on the fly
-            train_list = ['0898', '0924', '1119', '1795', '2007', '1712', '0234', '1076', '0384',
-                          '0989', '1039', '0221', '1138', '0344', '1110', '0084', '1215', '1028',
-                          '0693', '1250', '1807', '0979', '0024', '1045', '0604', '0164', '1149',
-                          '0291', '0653', '0704', '0659', '1239', '0628', '1979', '1077', '0929',
-                          '1209', '1336', '1367', '1287', '1841', '0043', '0415', '0235', '0401',
-                          '0914', '0210', '0556', '1072', '0135', '0457', '1829', '0516', '0727',
-                          '1948', '1433', '0650', '1217', '0995', '1106', '0219', '1741', '0964',
-                          '1337', '1075', '1400', '0509', '0492', '0378', '1426', '0175', '1296',
-                          '1714', '1699', '1785', '1706', '1344', '0615', '1839', '1736', '0975',
-                          '0639', '2034', '1453', '1303', '1278', '0740', '1417', '0510', '0747',
-                          '1798', '1311', '0155', '1715', '0395', '1360', '1103', '1834', '1850',
-                          '1266', '1967', '0173', '1382', '0461', '0047', '1412', '0491', '0020',
-                          '1793', '0213', '0900', '1765', '1819', '1205', '0490', '1404', '1448',
-                          '0954', '0006', '1935', '1671', '1108', '1903', '1121']
-            val_list = ['1917', '2046', '1694', '0748', '0496', '2001', '1789', '1447',
-                        '1083', '1851', '0029', '1395', '1727', '1940', '0564', '0734',
-                        '0931', '1341', '0892', '1790', '1459', '1980', '0648', '1427',
-                        '1853', '0735', '0525', '1207', '0222', '1806', '0737', '1271',
-                        '1896', '1033', '0932', '1123', '0172', '1843', '1679', '0937',
-                        '1343', '2029', '1932', '1435', '0612', '0126', '1053', '1893',
-                        '1144', '1791', '1464', '1899', '1456', '0655', '1329', '1230']
-
-            test_list = cfg['subj']
-            val_list = [subj for subj in val_list if subj not in test_list]
-            train_list = [subj for subj in train_list if subj not in test_list]
-
     elif cfg['sampling_breakdown'] == 'stratified':
-        test_list = cfg['subj']
-        df_strat = pd.read_pickle(
-            '/pghbio/dbmi/batmanlab/bpollack/predictElasticity/data/MRE/df_strat_v0.pkl')
-        # df_strat = df_strat.drop(index=test_list)
-        # mskf = MultilabelStratifiedShuffleSplit(n_splits=1, test_size=30,
-        #                                         random_state=cfg['seed'])
-        mskf = StratifiedShuffleSplit(n_splits=1, test_size=28, random_state=cfg['seed'])
-        splits = mskf.split(df_strat.index.values, df_strat[['gender']].values.flatten())
-        train_index, val_index = next(splits)
-        print(val_index)
-        train_list = df_strat.index[train_index].values
-        val_list = df_strat.index[val_index].values
-        train_list = [i for i in train_list if i not in test_list]
-        val_list = [i for i in val_list if i not in test_list]
-        # train_list = list(df_strat.index.values[train_list])
-        # val_list = list(df_strat.index.values[val_list])
-
-    elif cfg['sampling_breakdown'] == 'stratified_fixed':
-        train_subj = ['1727', '1903', '2034', '1072', '1382', '0830', '0655', '1851', '1980',
-                      '1839', '1554', '0234', '1967', '1149', '0020', '0653', '1935', '1360',
-                      '0043', '1144', '1899', '1694', '1577', '0135', '1574', '1395', '1033',
-                      '0937', '1404', '1578', '1456', '0556', '0126', '1474', '1789', '0219',
-                      '1819', '1679', '1893', '0904', '0659', '1526', '1367', '1217', '1447',
-                      '1504', '1541', '1720', '1529', '1699', '1671', '1714', '1329', '0510',
-                      '0401', '1603', '0929', '0890', '1798', '1793', '1400', '1561', '1722',
-                      '0734', '0693', '1642', '1979', '1795', '1271', '2046', '1948', '0461',
-                      '0210', '0509', '0898', '1435', '0872', '0564', '1123', '0747', '1896',
-                      '1712', '1448', '0006', '0975', '1464', '1336', '0173', '1843', '0932',
-                      '0748', '1736', '1083', '0995', '1667', '1791', '1715', '1412', '0291',
-                      '0704', '1853', '2001', '1341', '0029', '0931', '1790', '1076', '1786',
-                      '1110', '1748', '1829', '1550', '1311', '0415', '0491', '0735', '0914']
-        val_subj = ['2007', '1045', '0612', '1530', '1417', '0628', '0979', '1106', '1765', '1077',
-                    '1806', '0235', '1287', '0492', '0344', '1337', '1883', '1453', '1491', '1785',
-                    '0940', '2029', '1103', '0954', '0737', '0860', '1595', '1121', '1119', '1590',
-                    '1706', '1940']
+        train_list, val_list, test_list = stratified_split(
+            '/pghbio/dbmi/batmanlab/bpollack/predictElasticity/data/MRE/df_strat_v0.pkl',
+            cfg['subj'], cfg['seed'], cache_dir=split_cache)
 
-        test_list = cfg['subj']
-        train_list = [subj for subj in train_subj if subj not in test_list]
-        val_list = [subj for subj in val_subj if subj not in test_list]
+    else:
+        # Fixed splits (smart, smart_LOO, stratified_fixed) live in the mre/splits registry
+        name = split_name(cfg['sampling_breakdown'], cfg['dataset_ver'])
+        if name is None:
+            raise ValueError(f'Unknown sampling_breakdown "{cfg["sampling_breakdown"]}"')
+        train_list, val_list, test_list = resolve_split(name, cfg['subj'], cfg['split_version'],
+                                                        cache_dir=split_cache)
 
     train_set = MRETorchDataset(ds.sel(subject=train_list), set_type='train', **cfg)
     cfg['norm_clin_vals'] = train_set.norm_clin_vals
@@ -340,14 +172,17 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
     if cfg['model_arch'] == 'base':
         raise NotImplementedError('"base" no longer valid model_arch.')
     elif cfg['model_arch'] == 'transfer':
+        from mre import pytorch_arch_2d
         model = pytorch_arch_2d.PretrainedModel('name').to(device)
     elif cfg['model_arch'] == 'modular':
         if cfg['dims'] == 2:
+            from mre import pytorch_arch_2d
             model = pytorch_arch_2d.GeneralUNet2D(cfg['n_layers'], in_channels,
                                                   cfg['model_cap'], cfg['out_channels_final'],
                                                   cfg['channel_growth'], cfg['coord_conv'],
                                                   cfg['transfer_layer']).to(device)
         elif cfg['dims'] == 3:
+            from mre import pytorch_arch_3d
             model = pytorch_arch_3d.GeneralUNet3D(cfg['n_layers'], in_channels,
                                                   cfg['model_cap'], cfg['out_channels_final'],
                                                   cfg['channel_growth'], cfg['coord_conv'],
@@ -357,6 +192,7 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         #                      input_channels=in_channels, resnet='resnet34_os8',
         #                      last_activation=None)
 
+        from mre.pytorch_arch_deeplab import DeepLab
         print(cfg['norm'])
         model = DeepLab(in_channels=in_channels, out_channels=cfg['out_channels_final'],
                         output_stride=8, norm=cfg['norm'],
@@ -395,14 +231,17 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
             #         param.requires_grad = False
 
     elif cfg['model_arch'] == 'clinical':
+        from mre.pytorch_arch_clinical import Clinical
         model = Clinical(in_channels=in_channels, out_channels=cfg['out_channels_final'])
 
     elif cfg['model_arch'] == 'debug':
+        from mre.pytorch_arch_debug import Debug
         model = Debug(in_channels=in_channels, out_channels=cfg['out_channels_final'])
 
     # Set up adaptive loss if selected
     loss_func = None
     if loss_type == 'robust':
+        from robust_loss_pytorch import adaptive
         n_dims = train_set.target_images.shape[-1]*train_set.target_images.shape[-2]
         loss_func = adaptive.AdaptiveLossFunction(n_dims, np.float32, alpha_init=1.9, scale_lo=0.5)
         loss_params = torch.nn.ParameterList(loss_func.parameters())
@@ -432,6 +271,8 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         model = nn.DataParallel(model, [0, 1])
 
     model.to(device)
+    if cfg['channels_last']:
+        model.to(memory_format=torch.channels_last_3d)
     print('model loaded to gpu')
 
     if cfg['dry_run']:
@@ -448,6 +289,7 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         print('masks', masks.shape)
         print('names', names)
 
+        from torchsummary import summary
         print('Model Summary:')
         if cfg['do_clinical']:
             summary(model, input_size=[(in_channels, 32, 256, 256), clinical.shape[1:]])
@@ -471,26 +313,52 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         if cfg['do_val']:
             Path(xr_dir, 'val').mkdir(parents=True, exist_ok=True)
         model_dir.mkdir(parents=True, exist_ok=True)
+        from tensorboardX import SummaryWriter
         writer = SummaryWriter(str(writer_dir)+f'/{model_version}_{subj_group}')
         # Model graph is useless without additional tweaks to name layers appropriately
         # writer.add_graph(model, torch.zeros(1, 3, 256, 256).to(device), verbose=True)
 
-        # Train Model
-        model, best_loss, ds_mem = train_model(model, optimizer, exp_lr_scheduler, device,
-                                               dataloaders, num_epochs=cfg['num_epochs'],
-                                               tb_writer=writer, verbose=verbose,
-                                               loss_func=loss_func,
-                                               pixel_weight=cfg['pixel_weight'],
-                                               do_val=cfg['do_val'], ds=ds, bins=cfg['bins'],
-                                               nbins=cfg['out_channels_final'],
-                                               do_clinical=cfg['do_clinical'],
-                                               wave=cfg['wave'], class_only=cfg['class_only'],
-                                               wave_hypers=cfg['wave_hypers'], fft=cfg['fft'],
-                                               lap_kernel=cfg['lap_kernel'])
+        # Early stopping against the other jobs of the sweep (see mre.asha)
+        pruner = None
+        if cfg['asha_dir'] is not None:
+            from mre.asha import ASHA
+            pruner = ASHA(cfg['asha_dir'], model_version, subj_group, cfg['num_epochs'],
+                          cfg['asha_min_epochs'], cfg['asha_eta'])
+
+        # Full training state every checkpoint_every epochs, to --resume preempted jobs
+        checkpointer = None
+        checkpoint_file = Path(output_path, 'checkpoints', f'{model_version}_{subj_group}.pt')
+        if cfg['checkpoint_every']:
+            from mre.checkpoint import AsyncCheckpointer
+            checkpointer = AsyncCheckpointer(checkpoint_file, cfg['checkpoint_every'],
+                                             fingerprint)
+
+        # Train Model (a compiled model shares its parameters with `model`)
+        train_net = compile_model(model, cfg['compile_model'])
+        _, best_loss, ds_mem = train_model(train_net, optimizer, exp_lr_scheduler, device,
+                                           dataloaders, num_epochs=cfg['num_epochs'],
+                                           tb_writer=writer, verbose=verbose,
+                                           loss_func=loss_func,
+                                           pixel_weight=cfg['pixel_weight'],
+                                           do_val=cfg['do_val'], ds=ds, bins=cfg['bins'],
+                                           nbins=cfg['out_channels_final'],
+                                           do_clinical=cfg['do_clinical'],
+                                           wave=cfg['wave'], class_only=cfg['class_only'],
+                                           wave_hypers=cfg['wave_hypers'], fft=cfg['fft'],
+                                           lap_kernel=cfg['lap_kernel'],
+                                           fft_type=cfg['fft_type'], fft_band=cfg['fft_band'],
+                                           loss_backend=cfg['loss_backend'],
+                                           channels_last=cfg['channels_last'],
+                                           profile=cfg['profile'],
+                                           profile_path=Path(output_path, 'profile',
+                                                             f'{model_version}_{subj_group}.json'),
+                                           pruner=pruner, checkpointer=checkpointer,
+                                           resume=cfg['resume'])
         print('model trained, handed off new mem_ds')
 
         # Write outputs and save model
         cfg['best_loss'] = best_loss
+        cfg['asha_stopped_at'] = pruner.stopped_at if pruner is not None else None
         if cfg['do_clinical']:
             inputs, targets, masks, names, clinical = next(iter(dataloaders['test']))
         else:
@@ -524,6 +392,14 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
 
         writer.close()
         torch.save(model.state_dict(), str(model_dir)+f'/model_{model_version}.pkl')
+        if cfg['export_model']:
+            if cfg['do_clinical']:
+                example_inputs = (inputs[0:1], clinical[0:1])
+            else:
+                example_inputs = (inputs[0:1],)
+            export_path = export_model(model, Path(model_dir, f'model_{model_version}'),
+                                       example_inputs, method=cfg['export_model'])
+            print(f'exported model to {export_path}')
         # del model_pred
         # del masks
         # del targets
@@ -563,15 +439,37 @@ def train_model_full(data_path: str, data_file: str, output_path: str, model_ver
         ds_train.close()
         ds_train_stub.close()
 
+        # The outputs are written, a rerun must not resume from the checkpoint
+        if checkpoint_file.exists():
+            checkpoint_file.unlink()
+
+        # Mark the run as complete, so sweeps can skip this config x subject group.  Runs stopped
+        # early are not, their outcome depends on the other jobs of the sweep.
+        if cfg['asha_stopped_at'] is not None:
+            return inputs, targets, masks, names, model
+        set_types = ['train', 'val', 'test'] if cfg['do_val'] else ['train', 'test']
+        files = {key: Path(output_path, output_file(key, model_version, subj_group))
+                 for key in ['config', 'model'] + [f'xr_{set_type}' for set_type in set_types]}
+        write_run_record(output_path, fingerprint, model_version, subj_group, **files)
+
         # consider changing output to just ds?
         return inputs, targets, masks, names, model
 
 
+def run_fingerprint(data_path, data_file, cfg):
+    '''Fingerprint of a run (see `mre.fingerprint`): the resolved cfg, the input data and the code
+    version (the 'code_version' cfg, or the hash of this package).'''
+    code = cfg['code_version'] or code_version()
+    return config_fingerprint(dict(cfg, data_path=str(data_path), data_file=data_file), code)
+
+
 def process_kwargs(kwargs):
     cfg = default_cfg()
     for key in kwargs:
         if key == 'wave_hypers':
             val = [float(i) for i in kwargs[key]]
+        elif key == 'fft_band' and kwargs[key] is not None:
+            val = [float(i) for i in kwargs[key]]
         else:
             val = str2bool(kwargs[key])
         cfg[key] = val
@@ -611,7 +509,13 @@ def default_cfg():
            'resize': False, 'patient_list': False, 'num_workers': 0, 'lr_scheduler': 'step',
            'lr': 1e-2, 'lr_max': 1e-2, 'lr_min': 1e-4, 'step_size': 20, 'dims': 2,
            'pixel_weight': 1.0, 'depth': False, 'bins': 'none', 'fft': True,
-           'sampling_breakdown': 'smart', 'do_clinical': False, 'do_clinical_only': False,
+           'fft_type': 'fftn', 'fft_band': None, 'loss_backend': 'eager',
+           'compile_model': False, 'export_model': False, 'channels_last': False,
+           'profile': False,
+           'sampling_breakdown': 'smart', 'split_version': None, 'split_cache': True,
+           'code_version': None, 'asha_dir': None, 'asha_min_epochs': 10, 'asha_eta': 3,
+           'resume': False, 'checkpoint_every': 0,
+           'do_clinical': False, 'do_clinical_only': False,
            'dataset_ver': 'wave_v1', 'in_channels': 1,
            'norm_clinical': False, 'norm_clin_vals': None, 'erode_mask': 0,
            'do_val': True, 'norm': 'bn', 'transfer': False, 'weight_decay': 0.1,
@@ -620,7 +524,8 @@ def default_cfg():
     return cfg
 
 
-if __name__ == "__main__":
+def build_parser():
+    '''Command line parser of `train_model_full`, with one flag per `default_cfg` key.'''
     parser = argparse.ArgumentParser(description='Train a model.')
     parser.add_argument('--data_path', type=str, help='Path to input data.',
                         default='/pghbio/dbmi/batmanlab/Data/MRE/')
@@ -647,13 +552,24 @@ if __name__ == "__main__":
         elif key == 'wave_hypers':
             parser.add_argument(f'--{key}', nargs='*',
                                 default=val)
+        elif key == 'fft_band':
+            parser.add_argument(f'--{key}', nargs=2,
+                                default=val)
+        elif key == 'split_version':
+            parser.add_argument(f'--{key}', type=int, default=val)
+        elif key in ['code_version', 'asha_dir']:
+            parser.add_argument(f'--{key}', type=str, default=val)
         elif type(val) is bool:
             parser.add_argument(f'--{key}', action='store', type=str2bool,
                                 default=val)
         else:
             parser.add_argument(f'--{key}', action='store', type=type(val),
                                 default=val)
+    return parser
 
+
+if __name__ == "__main__":
+    parser = build_parser()
     args = parser.parse_args()
     print(args)
     train_model_full(**vars(args))
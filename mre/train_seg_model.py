@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import time
-import copy
 from pathlib import Path
 import warnings
 import argparse
@@ -21,6 +20,8 @@ from tensorboardX import SummaryWriter
 from mre.segmentation import ChaosDataset
 from mre import pytorch_arch_old
 from mre.pytorch_arch_deeplab import DeepLab
+from mre.profiling import StepProfiler, write_profile_json
+from mre.checkpoint import BestState
 from robust_loss_pytorch import adaptive
 
 
@@ -192,7 +193,8 @@ def train_seg_model(data_path: str, data_file: str, output_path: str, model_vers
         # Train Model
         model, best_loss, best_dice, best_bce = train_model_core(
             model, optimizer, exp_lr_scheduler, device, dataloaders, num_epochs=cfg['num_epochs'],
-            tb_writer=writer, verbose=verbose, loss_func=loss)
+            tb_writer=writer, verbose=verbose, loss_func=loss, profile=cfg['profile'],
+            profile_path=Path(output_path, 'profile', f'{model_version}_subj_{subj}.json'))
 
         # Write outputs and save model
         cfg['best_loss'] = best_loss
@@ -274,13 +276,16 @@ def default_cfg():
            'model_arch': 'modular', 'n_layers': 3, 'in_channels': 1, 'out_channels_final': 1,
            'channel_growth': False, 'transfer_layer': False, 'bce_weight': 0.5,
            'resize': False, 'transform': False,
-           'train_color_aug': False, 'val_color_aug': False, 'test_color_aug': False}
+           'train_color_aug': False, 'val_color_aug': False, 'test_color_aug': False,
+           'profile': False}
     return cfg
 
 
 def train_model_core(model, optimizer, scheduler, device, dataloaders, num_epochs=25,
-                     loss_func='dice', bce_weight=0.5, tb_writer=None, verbose=True):
-    best_model_wts = copy.deepcopy(model.state_dict())
+                     loss_func='dice', bce_weight=0.5, tb_writer=None, verbose=True,
+                     profile=False, profile_path=None):
+    best_state = BestState(model)
+    profile_log = defaultdict(list)
     best_loss = 1e16
     best_dice = 1e16
     best_bce = 1e16
@@ -303,25 +308,33 @@ def train_model_core(model, optimizer, scheduler, device, dataloaders, num_epoch
                     model.eval()   # Set model to evaluate mode
                 metrics = defaultdict(float)
                 epoch_samples = 0
+                prof = StepProfiler(device, enabled=profile)
 
                 # iterate through batches of data for each epoch
-                for data in dataloaders[phase]:
-                    inputs = data[0].to(device)
-                    labels = data[1].to(device)
+                for data in prof.wrap(dataloaders[phase]):
+                    with prof.section('transfer'):
+                        inputs = data[0].to(device)
+                        labels = data[1].to(device)
                     # zero the parameter gradients
                     optimizer.zero_grad()
                     # forward
                     # track history if only in train
                     with torch.set_grad_enabled(phase == 'train'):
-                        outputs = model(inputs)
-                        loss, dice, bce  = calc_loss(outputs, labels,
-                                                     metrics, bce_weight=bce_weight)
+                        with prof.section('forward'):
+                            outputs = model(inputs)
+                        with prof.section('loss'):
+                            loss, dice, bce  = calc_loss(outputs, labels,
+                                                         metrics, bce_weight=bce_weight)
                         # backward + optimize only if in training phase
                         if phase == 'train':
-                            loss.backward()
-                            optimizer.step()
+                            with prof.section('backward'):
+                                loss.backward()
+                                optimizer.step()
                     # accrue total number of samples
                     epoch_samples += inputs.size(0)
+                    prof.end_step(inputs.size(0))
+                if profile:
+                    profile_log[phase].append(prof.write(tb_writer, phase, epoch))
                 if phase == 'train':
                     scheduler.step()
 
@@ -338,7 +351,7 @@ def train_model_core(model, optimizer, scheduler, device, dataloaders, num_epoch
                     best_loss = epoch_loss
                     best_dice = epoch_dice
                     best_bce = epoch_bce
-                    best_model_wts = copy.deepcopy(model.state_dict())
+                    best_state.update(model.state_dict())
 
                 if tb_writer:
                     tb_writer.add_scalar(f'loss_{phase}', epoch_loss, epoch)
@@ -353,9 +366,11 @@ def train_model_core(model, optimizer, scheduler, device, dataloaders, num_epoch
     if verbose:
         # print('Best val loss: {:4f}'.format(best_loss))
         print(f'Best val bce: {best_bce:.3f}, dice: {best_dice:.3f}, loss: {best_loss:.3f}')
+    if profile and profile_path is not None and profile_log:
+        write_profile_json(profile_log, profile_path)
 
     # load best model weights
-    model.load_state_dict(best_model_wts)
+    model.load_state_dict(best_state.state_dict())
     return model, best_loss, best_dice, best_bce
 
 
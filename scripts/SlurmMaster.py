@@ -5,69 +5,89 @@
 
 import sys
 import os
-import shutil
-import random
 from pathlib import Path
+import shlex
 import argparse
 import configparser
 import json
 import ast
-import subprocess
 import itertools
 from datetime import datetime
 
+from mre.executors import make_job, get_executor, pack_jobs, write_task_table
+from mre.fingerprint import find_completed_run, relink_run
+from mre.snapshot import snapshot_code
+
+DATA_ROOT = '/ocean/projects/asc170022p/bpollack/predictElasticity'
+
 
 class SlurmMaster:
-    def __init__(self, config):
+    def __init__(self, config, backend='slurm', data_root=DATA_ROOT, dedup='skip', array=False,
+                 pack=1, max_concurrent=None, asha=False, **executor_kwargs):
+        '''Run the sweep in `config` (an .ini file).
+
+        Args:
+            config (str): Path to the config file.
+            backend (str): 'slurm' (sbatch scripts), 'local' (process pool on this machine, see
+                `mre.executors.LocalExecutor` for the resource limits in `executor_kwargs`) or
+                'dry' (only print the jobs).
+            data_root (str): Root of the slurm_outputs, notes and staging dirs.
+            dedup (str): For MRE sweeps, what to do with config x subject group combinations that
+                already completed with the same code: 'skip' them, 'relink' their outputs under
+                the new model_version, or 'off' to run everything.
+            array (bool): With the slurm backend, submit the whole sweep as one job array instead
+                of one sbatch per job.
+            pack (int): Jobs run one after the other in each array task, for short jobs (e.g.
+                make_xr patients).  The 24 h time limit is per task.
+            max_concurrent (int): Limit on the array tasks running at once.
+            asha (bool): For MRE sweeps, stop underperforming configs early by successive halving
+                (see `mre.asha`), with rungs set by the asha_min_epochs and asha_eta configs.
+        '''
         self.date = datetime.today().strftime('%Y-%m-%d_%H-%M-%S')
-        self.log_dir = Path(
-            '/ocean/projects/asc170022p/bpollack/predictElasticity/data/slurm_outputs', self.date)
+        self.data_root = Path(data_root)
+        self.log_dir = Path(self.data_root, 'data', 'slurm_outputs', self.date)
         self.log_dir.mkdir(parents=True, exist_ok=True)
-        self.notes_dir = Path('/ocean/projects/asc170022p/bpollack/predictElasticity/data/notes',
-                              self.date)
+        self.notes_dir = Path(self.data_root, 'data', 'notes', self.date)
         self.notes_dir.mkdir(parents=True, exist_ok=True)
         self.config = Path(config)
         self.parse_config()
-        random.seed(self.date)
-        self.mre_id = random.randint(10000, 90000)
-        print('making staging dir')
-        self.staging_dir = (
-            f'/ocean/projects/asc170022p/bpollack/predictElasticity/staging/{self.date}')
-        os.mkdir(f'/ocean/projects/asc170022p/bpollack/predictElasticity/staging/{self.date}')
-        shutil.copytree('/ocean/projects/asc170022p/bpollack/predictElasticity/mre',
-                        '/ocean/projects/asc170022p/bpollack/predictElasticity/staging/' +
-                        f'{self.date}/mre{self.mre_id}')
-        shutil.copy('/ocean/projects/asc170022p/bpollack/predictElasticity/__init__.py',
-                    '/ocean/projects/asc170022p/bpollack/predictElasticity/staging/' +
-                    f'{self.date}/__init__.py')
-        shutil.copy('/ocean/projects/asc170022p/bpollack/predictElasticity/setup.py',
-                    '/ocean/projects/asc170022p/bpollack/predictElasticity/staging/' +
-                    f'{self.date}/setup.py')
-        shutil.rmtree('/ocean/projects/asc170022p/bpollack/predictElasticity/staging/' +
-                      f'{self.date}/mre{self.mre_id}/__pycache__')
-        os.system(f"sed -i 's/import mre/import mre{self.mre_id}/g' " +
-                  "/ocean/projects/asc170022p/bpollack/predictElasticity/staging/" +
-                  f'{self.date}/mre{self.mre_id}/*.py')
-        os.system(f"sed -i 's/from mre/from mre{self.mre_id}/g' " +
-                  "/ocean/projects/asc170022p/bpollack/predictElasticity/staging/" +
-                  f"{self.date}/mre{self.mre_id}/*.py")
-        os.system(f"sed -i 's/mre/mre{self.mre_id}/g' " +
-                  "/ocean/projects/asc170022p/bpollack/predictElasticity/staging/" +
-                  f"{self.date}/setup.py")
-        os.chdir(f'/ocean/projects/asc170022p/bpollack/predictElasticity/staging/{self.date}')
-        os.system('python setup.py develop')
+        self.backend = backend
+        if dedup not in ['skip', 'relink', 'off']:
+            raise ValueError(f'Unknown dedup "{dedup}", use one of "skip", "relink", "off"')
+        self.dedup = dedup
+        self.array = array and backend == 'slurm'
+        self.pack = pack
+        self.max_concurrent = max_concurrent
+        self.asha_dir = Path(self.log_dir, 'asha') if asha else None
+        if backend == 'local':
+            # not the checkout, `python -m` would import its mre instead of the snapshot
+            executor_kwargs.setdefault('cwd', str(self.log_dir))
+        self.executor = get_executor(backend, **executor_kwargs)
+        self.snapshot_dir = None
+        if backend != 'dry':
+            self.stage_code()
 
-    def generate_slurm_script(self, number, conf, subj, subj_num, date, project):
-        '''Make a slurm submission script.'''
+    def stage_code(self):
+        '''Snapshot the mre package (once per code version) for the jobs of this sweep.'''
+        since = datetime.now()
+        self.snapshot_dir = snapshot_code(Path(self.data_root, 'staging', 'snapshots'))
+        self.staging_dir = str(Path(self.data_root, 'staging', self.date))
+        os.makedirs(self.staging_dir, exist_ok=True)
+        print(f'code snapshot {self.snapshot_dir}, '
+              f'{(datetime.now() - since).total_seconds():.1f} s')
+
+    def job_args(self, number, conf, subj, subj_num, date, project):
+        '''Module, command line arguments, subject group name and whether a GPU is needed for one
+        job of the sweep.'''
         if project == 'MRE':
             module = 'train_mre_model.py'
-            self.gpu = True
+            gpu = True
         elif project == 'CHAOS':
             module = 'train_seg_model.py'
-            self.gpu = True
+            gpu = True
         elif project == 'XR':
             module = 'make_xr.py'
-            self.gpu = False
+            gpu = False
 
         if type(subj) is list:
             subj_name = f'GROUP{subj_num}'
@@ -75,39 +95,68 @@ class SlurmMaster:
         else:
             subj_name = subj
 
-        print(conf)
         arg_string = ''
         for i in conf:
             if type(conf[i]) is list:
-                print(conf[i])
-                clean_vals = ' '.join(conf[i])
+                clean_vals = ' '.join(str(val) for val in conf[i])
                 arg_string += f' --{i} {clean_vals}'
             else:
                 arg_string += f' --{i}={conf[i]}'
-        # arg_string = ' '.join(f'--{i}={conf[i]}' for i in conf)
-        # script_name = f'/tmp/slurm_script_{self.date}_n{number}_subj{subj_name}'
-        script_name = self.staging_dir+f'/slurm_script_{self.date}_n{number}_subj{subj_name}'
-        script = open(script_name, 'w')
-        script.write('#!/bin/bash\n')
-        if self.gpu:
+        if gpu:
             if project == 'MRE':
                 arg_string += f' --subj {subj} --subj_group={subj_name}'
+                # requeued after a preemption (see write_header), so checkpoint unless the sweep
+                # sets its own interval
+                arg_string += ' --resume=True'
+                if 'checkpoint_every' not in conf:
+                    arg_string += ' --checkpoint_every=5'
+                if self.asha_dir is not None:
+                    arg_string += f' --asha_dir={str(self.asha_dir)}'
             else:
                 arg_string += f' --subj {subj}'
             arg_string += f' --model_version={date}_n{number}'
+        else:
+            arg_string += f' --subj={subj}'
+        return module, arg_string, subj_name, gpu
+
+    def generate_slurm_script(self, number, conf, subj, subj_num, date, project):
+        '''Make a slurm submission script.'''
+        print(conf)
+        module, arg_string, subj_name, self.gpu = self.job_args(number, conf, subj, subj_num, date,
+                                                                project)
+        # arg_string = ' '.join(f'--{i}={conf[i]}' for i in conf)
+        # script_name = f'/tmp/slurm_script_{self.date}_n{number}_subj{subj_name}'
+        script_name = self.staging_dir+f'/slurm_script_{self.date}_n{number}_subj{subj_name}'
+        script = open(script_name, 'w')
+        self.write_header(script, self.gpu, f'{str(self.log_dir)}/job_n{number}_subj{subj_name}')
+        script.write(f'python -m mre.{module.replace(".py", "")} {arg_string}\n')
+
+        script.close()
+        print(arg_string)
+        return script_name
+
+    def write_header(self, script, gpu, log_name, array_size=None):
+        '''Write the sbatch options and environment setup of a job script.  For a job array of
+        `array_size` tasks, `log_name` should contain the %A/%a placeholders.'''
+        script.write('#!/bin/bash\n')
+        if gpu:
             script.write('#SBATCH -N 1\n')
             script.write(f'#SBATCH -p {self.node["partition"]}\n')
             script.write(f'#SBATCH --gpus={self.node["ngpus"]}\n')
         else:
-            arg_string += f' --subj={subj}'
             script.write('#SBATCH -A bi561ip\n')
             script.write('#SBATCH --partition=DBMI\n')
             script.write('#SBATCH --mem=120GB\n')
             script.write('#SBATCH -C EGRESS\n')
         script.write('#SBATCH -t 24:00:00\n')
+        # preempted jobs go back in the queue, MRE runs resume from their last checkpoint
+        script.write('#SBATCH --requeue\n')
         script.write('#SBATCH --mail-user=brianleepollack@gmail.com\n')
-        script.write(f'#SBATCH --output={str(self.log_dir)}/job_n{number}_subj{subj_name}.stdout\n')
-        script.write(f'#SBATCH --error={str(self.log_dir)}/job_n{number}_subj{subj_name}.stderr\n')
+        script.write(f'#SBATCH --output={log_name}.stdout\n')
+        script.write(f'#SBATCH --error={log_name}.stderr\n')
+        if array_size is not None:
+            max_tasks = f'%{self.max_concurrent}' if self.max_concurrent else ''
+            script.write(f'#SBATCH --array=0-{array_size - 1}{max_tasks}\n')
         script.write('\n')
 
         script.write('set -x\n')
@@ -120,11 +169,20 @@ class SlurmMaster:
         script.write('\n')
         script.write('nvidia-smi\n')
 
-        script.write(f'python /ocean/projects/asc170022p/bpollack/predictElasticity/staging/'
-                     f'{self.date}/mre{self.mre_id}/{module} {arg_string}\n')
+        script.write(f'export PYTHONPATH={self.snapshot_dir}:$PYTHONPATH\n')
+        # not the submit dir, `python -m` would import a checkout there instead of the snapshot
+        script.write(f'cd {str(self.log_dir)}\n')
 
-        script.close()
-        print(arg_string)
+    def generate_array_script(self, jobs, gpu):
+        '''Make a single job array script for `jobs`, `self.pack` jobs per array task.  The task
+        index -> jobs table is written next to it (see `mre.executors.run_task`).'''
+        tasks = pack_jobs(jobs, self.pack)
+        table_name = write_task_table(tasks, Path(self.staging_dir, f'tasks_{self.date}.json'))
+        script_name = self.staging_dir+f'/slurm_array_{self.date}'
+        with open(script_name, 'w') as script:
+            self.write_header(script, gpu, f'{str(self.log_dir)}/array_%A_%a', len(tasks))
+            script.write(f'python -m mre.executors {table_name} $SLURM_ARRAY_TASK_ID\n')
+        print(f'{len(jobs)} jobs in {len(tasks)} array tasks: {script_name}')
         return script_name
 
     def parse_config(self):
@@ -178,24 +236,66 @@ class SlurmMaster:
         if self.project != 'XR':
             self.config_combos = product_dict(**self.config_dict)
 
-    def submit_scripts(self):
+    def iter_jobs(self):
+        '''(number, conf, subj, subj_num) of every job in the sweep.'''
         if self.project != 'XR':
             for i, conf in enumerate(self.config_combos):
                 # for j, subj in enumerate(self.subj_list):
                 for j in self.only_group:
-                    subj = self.subj_list[j]
-                    script_name = self.generate_slurm_script(i, conf, subj, j, self.date,
-                                                             self.project)
-                    print(script_name)
-                    subprocess.call(f'sbatch {script_name}', shell=True)
+                    yield i, conf, self.subj_list[j], j
         else:
             # for j, subj in enumerate(self.subj_list):
             for j in self.only_group:
-                subj = self.subj_list[j]
-                script_name = self.generate_slurm_script(0, self.config_dict, subj, j, self.date,
+                yield 0, self.config_dict, self.subj_list[j], j
+
+    def completed_run(self, arg_string):
+        '''Record of a completed run of the train_mre_model job with these arguments, or None.'''
+        from mre.train_mre_model import build_parser, process_kwargs, run_fingerprint
+        kwargs = vars(build_parser().parse_args(shlex.split(arg_string)))
+        paths = {key: kwargs.pop(key) for key in ['data_path', 'data_file', 'output_path',
+                                                  'model_version', 'subj_group', 'verbose']}
+        fingerprint = run_fingerprint(paths['data_path'], paths['data_file'],
+                                      process_kwargs(kwargs))
+        record = find_completed_run(paths['output_path'], fingerprint)
+        if record is not None and self.dedup == 'relink':
+            relink_run(paths['output_path'], record, paths['model_version'], paths['subj_group'])
+        return record
+
+    def submit_scripts(self):
+        skipped = {}
+        array_jobs = []
+        for number, conf, subj, subj_num in self.iter_jobs():
+            module, arg_string, subj_name, gpu = self.job_args(number, conf, subj, subj_num,
+                                                             self.date, self.project)
+            if self.project == 'MRE' and self.dedup != 'off':
+                record = self.completed_run(arg_string)
+                if record is not None:
+                    action = 'relinked' if self.dedup == 'relink' else 'skipped'
+                    print(f'n{number} {subj_name} already done as {record["model_version"]} '
+                          f'{record["subj_group"]}, {action}')
+                    skipped[f'job_n{number}_subj{subj_name}'] = record['fingerprint']
+                    continue
+            script_name = None
+            if self.array:
+                array_jobs.append(make_job(f'job_n{number}_subj{subj_name}', module, arg_string,
+                                           self.log_dir, pythonpath=self.snapshot_dir))
+                continue
+            elif self.backend == 'slurm':
+                script_name = self.generate_slurm_script(number, conf, subj, subj_num, self.date,
                                                          self.project)
                 print(script_name)
-                subprocess.call(f'sbatch {script_name}', shell=True)
+            job = make_job(f'job_n{number}_subj{subj_name}', module, arg_string, self.log_dir,
+                           script_name, pythonpath=self.snapshot_dir)
+            self.executor.submit(job)
+        if skipped:
+            print(f'{len(skipped)} jobs already completed')
+        if array_jobs:
+            script_name = self.generate_array_script(array_jobs, gpu)
+            self.executor.submit_script(f'array_{self.date}', script_name)
+        codes = self.executor.wait()
+        if self.asha_dir is not None:
+            print(f'successive halving results: python -m mre.asha {str(self.asha_dir)}')
+        return codes
 
 
 def product_dict(**kwargs):
@@ -210,8 +310,32 @@ def product_dict(**kwargs):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Submit a series of SLURM jobs.')
     parser.add_argument('config', type=str, help='Path to config_file.')
+    parser.add_argument('--backend', type=str, default='slurm', choices=['slurm', 'local', 'dry'],
+                        help='Submit to slurm, run on this machine, or only print the jobs.')
+    parser.add_argument('--data_root', type=str, default=DATA_ROOT,
+                        help='Root of the slurm_outputs, notes and staging dirs.')
+    parser.add_argument('--n_workers', type=int, default=1, help='Concurrent local jobs.')
+    parser.add_argument('--threads', type=int, default=None, help='CPU threads per local job.')
+    parser.add_argument('--mem_gb', type=float, default=None, help='Memory limit per local job.')
+    parser.add_argument('--gpus', type=int, nargs='*', default=None,
+                        help='GPU ids shared by the local jobs.')
+    parser.add_argument('--dedup', type=str, default='skip', choices=['skip', 'relink', 'off'],
+                        help='Skip or relink runs that already completed with the same config.')
+    parser.add_argument('--array', action='store_true',
+                        help='Submit the sweep as a single slurm job array.')
+    parser.add_argument('--pack', type=int, default=1,
+                        help='Jobs run one after the other in each array task.')
+    parser.add_argument('--max_concurrent', type=int, default=None,
+                        help='Maximum number of array tasks running at once.')
+    parser.add_argument('--asha', action='store_true',
+                        help='Stop underperforming MRE configs early by successive halving.')
     args = parser.parse_args()
 
-    SM = SlurmMaster(args.config)
-    SM.submit_scripts()
-    print(SM.notes)
+    executor_kwargs = {}
+    if args.backend == 'local':
+        executor_kwargs = dict(n_workers=args.n_workers, threads=args.threads,
+                               mem_gb=args.mem_gb, gpus=args.gpus)
+    SM = SlurmMaster(args.config, args.backend, args.data_root, args.dedup, args.array, args.pack,
+                     args.max_concurrent, args.asha, **executor_kwargs)
+    print(SM.submit_scripts())
+    print(getattr(SM, 'notes', ''))
@@ -11,5 +11,6 @@ setup(name='mre',
     author_email='brianleepollack@gmail.com',
     license='Pitt',
     packages=find_packages(),
+    package_data={'mre': ['splits/*.json']},
     include_package_data=True,
     zip_safe=False)
@@ -0,0 +1,52 @@
+from mre.asha import ASHA, rung_epochs, promotable, summarize
+
+
+def test_rungs():
+    assert rung_epochs(300, 10, 3) == [10, 30, 90, 270]
+    assert rung_epochs(40, 10, 2) == [10, 20]
+    assert promotable(1.0, [1.0])
+    assert promotable(1.0, [1.0, 2.0, 3.0], eta=3)
+    assert not promotable(2.0, [1.0, 2.0, 3.0], eta=3)
+
+
+def test_asha_stops_worse_trials(tmp_path):
+    # six configs of a sweep, reporting in turn; lower index = lower loss
+    trials = {i: ASHA(tmp_path, f'n{i}', 'GROUP0', max_epochs=40, min_epochs=2, eta=2)
+              for i in [2, 5, 0, 3, 1, 4]}
+    stopped = {}
+    for epoch in range(40):
+        for i, trial in list(trials.items()):
+            if trial.report(epoch, (i+1)/(epoch+1)):
+                stopped[i] = epoch + 1
+                del trials[i]
+    # asynchronous: n2 got to every rung first, so it was never compared against n0
+    assert list(trials) == [2, 0]
+    assert stopped == {5: 2, 3: 2, 4: 2, 1: 4}
+
+    summary = summarize(tmp_path)['GROUP0']
+    assert summary['n0'] == {'epochs': 40, 'best_loss': 1/40, 'stopped_at': None}
+    assert summary['n5']['stopped_at'] == 2
+    assert summary['n5']['epochs'] == 2
+
+    # other subject groups do not compete with GROUP0
+    other = ASHA(tmp_path, 'n9', 'GROUP1', max_epochs=40, min_epochs=2, eta=2)
+    assert not other.report(0, 10.0) and not other.report(1, 10.0)
+
+
+def test_asha_restore(tmp_path):
+    trial = ASHA(tmp_path, 'n0', 'GROUP0', max_epochs=40, min_epochs=4, eta=2)
+    trial.restore()
+    for epoch, loss in enumerate([3.0, 1.0, 2.0, 2.5, 2.5]):
+        trial.report(epoch, loss)
+
+    # requeued after a checkpoint at epoch 2: the epochs after it are trained again
+    resumed = ASHA(tmp_path, 'n0', 'GROUP0', max_epochs=40, min_epochs=4, eta=2)
+    resumed.restore(2)
+    assert resumed.best_loss == 1.0
+    resumed.report(3, 2.0)
+    summary = summarize(tmp_path)['GROUP0']['n0']
+    assert summary['epochs'] == 4 and summary['best_loss'] == 1.0
+
+    resumed.restore()
+    assert resumed.best_loss == float('inf')
+    assert summarize(tmp_path)['GROUP0']['n0']['epochs'] == 0
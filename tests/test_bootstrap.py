@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_curve, auc
+
+from mre.bootstrap import resample_indices, confusion_counts, auroc, linear_r2
+
+
+def test_bootstrap_stats_match_per_resample():
+    rng = np.random.default_rng(0)
+    true = rng.uniform(1000, 8000, 60).round(-2)
+    pred = true + rng.normal(0, 800, 60).round(-2)
+    idx = resample_indices(60, n_boot=20, seed=1)
+    assert idx.shape == (20, 60)
+    np.testing.assert_array_equal(idx, resample_indices(60, n_boot=20, seed=1))
+
+    labels = (true >= 4000).astype(int)
+    aucs = auroc(labels, pred, idx)
+    r2s = linear_r2(true, pred, idx)
+    tp, fn, tn, fp = confusion_counts(true, pred, 4000, idx)
+    for i, boot in enumerate(idx):
+        fpr, tpr, _ = roc_curve(labels[boot], pred[boot])
+        assert np.isclose(aucs[i], auc(fpr, tpr))
+        slope, intercept = np.polyfit(true[boot], pred[boot], 1)
+        resid = pred[boot] - slope*true[boot] - intercept
+        assert np.isclose(r2s[i], 1 - resid.var()/pred[boot].var())
+        df = pd.DataFrame({'mre': true[boot], 'pred': pred[boot]})
+        assert tp[i] == len(df.query('mre>4000 and pred>4000'))
+        assert fn[i] == len(df.query('mre>4000 and pred<4000'))
+        assert tn[i] == len(df.query('mre<4000 and pred<4000'))
+        assert fp[i] == len(df.query('mre<4000 and pred>4000'))
+
+    # the point estimates of roc_curves count values at the threshold
+    assert confusion_counts(np.array([4000]), np.array([4000]), 4000, inclusive=True) == (
+        1, 0, 1, 0)
@@ -0,0 +1,76 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from mre.checkpoint import AsyncCheckpointer, BestState, load_checkpoint
+
+
+def make_run():
+    model = nn.Linear(4, 1)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=2, gamma=0.5)
+    return model, optimizer, scheduler
+
+
+def train_epoch(model, optimizer, scheduler):
+    # random batches, so the resumed run only matches if the RNG state is restored
+    for _ in range(3):
+        inputs = torch.randn(8, 4)
+        optimizer.zero_grad()
+        loss = ((model(inputs) - inputs.sum(1, keepdim=True))**2).mean()
+        loss.backward()
+        optimizer.step()
+    scheduler.step()
+
+
+def test_resume_matches_uninterrupted_run(tmp_path):
+    torch.manual_seed(0)
+    model, optimizer, scheduler = make_run()
+    checkpointer = AsyncCheckpointer(tmp_path/'ckpt.pt', every=2)
+    for epoch in range(4):
+        train_epoch(model, optimizer, scheduler)
+        if checkpointer.due(epoch):
+            checkpointer.save(epoch, model, optimizer, scheduler,
+                              best_state=model.state_dict(), best_loss=float(epoch))
+        if epoch == 1:
+            checkpointer.wait()
+            preempted = (tmp_path/'ckpt.pt').read_bytes()
+    checkpointer.wait()
+
+    (tmp_path/'ckpt.pt').write_bytes(preempted)
+    torch.manual_seed(1)
+    resumed, optimizer, scheduler = make_run()
+    epoch, best_state, best_loss = load_checkpoint(tmp_path/'ckpt.pt', resumed, optimizer,
+                                                   scheduler)
+    assert (epoch, best_loss) == (1, 1.0)
+    assert torch.equal(best_state['weight'], resumed.weight)
+    for epoch in range(epoch + 1, 4):
+        train_epoch(resumed, optimizer, scheduler)
+    assert torch.equal(resumed.weight, model.weight)
+    assert scheduler.get_last_lr() == [2.5e-3]
+
+
+def test_best_state_keeps_a_copy():
+    model = nn.Sequential(nn.Linear(4, 4), nn.BatchNorm1d(4))
+    best_state = BestState(model)
+    buffers = {key: val.data_ptr() for key, val in best_state.state_dict().items()}
+    best = {key: val.clone() for key, val in model.state_dict().items()}
+    with torch.no_grad():
+        model[0].weight.add_(1)
+    for key, val in best_state.state_dict().items():
+        assert torch.equal(val, best[key])
+
+    best_state.update(model.state_dict())
+    assert torch.equal(best_state.state_dict()['0.weight'], model[0].weight)
+    # updates reuse the preallocated buffers
+    assert {key: val.data_ptr() for key, val in best_state.state_dict().items()} == buffers
+
+
+def test_checkpoint_fingerprint(tmp_path):
+    model, optimizer, scheduler = make_run()
+    checkpointer = AsyncCheckpointer(tmp_path/'ckpt.pt', fingerprint='abc')
+    checkpointer.save(0, model, optimizer, scheduler)
+    checkpointer.wait()
+    assert load_checkpoint(tmp_path/'ckpt.pt', model, optimizer, fingerprint='abc')[0] == 0
+    with pytest.raises(ValueError, match='different config'):
+        load_checkpoint(tmp_path/'ckpt.pt', model, optimizer, fingerprint='abd')
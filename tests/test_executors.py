@@ -0,0 +1,81 @@
+from mre.executors import (make_job, get_executor, pack_jobs, write_task_table, run_task,
+                           job_command)
+
+
+def test_local_executor(tmp_path):
+    executor = get_executor('local', n_workers=2, threads=1, mem_gb=8)
+    for i in range(3):
+        executor.submit(make_job(f'job_n{i}_subj{i}', 'synthetic.py',
+                                 f'--out_dir {tmp_path}/xr{i} --n_subj 1 --shape 2 8 8',
+                                 tmp_path/'slurm_outputs'))
+    codes = executor.wait()
+    assert codes == {f'job_n{i}_subj{i}': 0 for i in range(3)}
+    assert (tmp_path/'xr2'/'xarray_0000.nc').exists()
+    assert (tmp_path/'slurm_outputs'/'job_n0_subj0.stderr').exists()
+
+    dry = get_executor('dry', verbose=False)
+    dry.submit(make_job('job_n0_subj0', 'make_xr.py', '--subj=0006', tmp_path))
+    assert dry.jobs[0]['args'] == ['--subj=0006']
+    # the memory limit is set by a wrapper that execs the job
+    command = job_command(dry.jobs[0], 'python', mem_gb=2)
+    assert command[:2] == ['python', '-c'] and command[3:5] == [str(2*1024**3), 'python']
+
+
+def test_job_array_tasks(tmp_path):
+    jobs = [make_job(f'job_n0_subj{i}', 'synthetic.py',
+                     f'--out_dir {tmp_path}/xr{i} --n_subj 1 --shape 2 8 8', tmp_path/'logs')
+            for i in range(5)]
+    tasks = pack_jobs(jobs, 2)
+    assert [[job['name'] for job in task] for task in tasks] == [
+        ['job_n0_subj0', 'job_n0_subj1'], ['job_n0_subj2', 'job_n0_subj3'], ['job_n0_subj4']]
+    assert len(pack_jobs(jobs)) == 5
+
+    table = write_task_table(tasks, tmp_path/'tasks.json')
+    assert run_task(table, 1) == 0
+    assert (tmp_path/'xr2'/'xarray_0000.nc').exists()
+    assert (tmp_path/'xr3'/'xarray_0000.nc').exists()
+    assert not (tmp_path/'xr0').exists()
+    assert (tmp_path/'logs'/'job_n0_subj3.stdout').exists()
+
+
+def test_snapshot_code(tmp_path):
+    import sys
+    import subprocess
+    from mre.fingerprint import code_version
+    from mre.snapshot import snapshot_code
+
+    snap_dir = snapshot_code(tmp_path)
+    assert snap_dir.name == code_version()
+    mtime = (snap_dir/'mre'/'__init__.py').stat().st_mtime_ns
+    assert snapshot_code(tmp_path) == snap_dir
+    assert (snap_dir/'mre'/'__init__.py').stat().st_mtime_ns == mtime
+    assert (snap_dir/'mre'/'splits').is_dir()
+
+    out = subprocess.run([sys.executable, '-c', 'import mre; print(mre.__file__)'],
+                         env={'PYTHONPATH': str(snap_dir)}, cwd=tmp_path, capture_output=True,
+                         text=True)
+    assert out.stdout.startswith(str(snap_dir))
+
+
+def test_slurm_scripts_run_the_snapshot(tmp_path):
+    import sys
+    from pathlib import Path
+    sys.path.insert(0, str(Path(__file__).parents[1]/'scripts'))
+    from SlurmMaster import SlurmMaster
+
+    config = tmp_path/'sweep.ini'
+    config.write_text("[Node]\npartition = GPU\nngpus = 1\n\n"
+                      "[Hyper]\nlr = [0.001, 0.01]\nsubj_group = [['0006', '0020']]\n")
+    master = SlurmMaster(config, backend='slurm', data_root=tmp_path)
+    number, conf, subj, subj_num = next(master.iter_jobs())
+    script = Path(master.generate_slurm_script(number, conf, subj, subj_num, master.date,
+                                               'MRE')).read_text()
+    lines = script.splitlines()
+    # `python -m` puts the working directory first on sys.path, ahead of the snapshot
+    assert f'export PYTHONPATH={master.snapshot_dir}:$PYTHONPATH' in lines
+    assert f'cd {master.log_dir}' in lines
+    command = next(i for i, line in enumerate(lines)
+                   if line.startswith('python -m mre.train_mre_model'))
+    assert lines.index(f'cd {master.log_dir}') < command
+    # requeued jobs resume from checkpoints, which are off by default
+    assert '--resume=True --checkpoint_every=5' in lines[command]
@@ -0,0 +1,40 @@
+from mre.fingerprint import (config_fingerprint, code_version, write_run_record,
+                             find_completed_run, relink_run)
+from mre.train_mre_model import build_parser, process_kwargs, run_fingerprint
+
+
+def test_fingerprint_dedup(tmp_path):
+    def fingerprint(arg_string):
+        kwargs = vars(build_parser().parse_args(arg_string.split()))
+        data_path, data_file = kwargs.pop('data_path'), kwargs.pop('data_file')
+        return run_fingerprint(data_path, data_file, process_kwargs(kwargs))
+
+    base = '--lr=0.001 --inputs t1_pre_water t2 --subj 0006 0020 --code_version=abc'
+    fp = fingerprint(base + ' --model_version=a_n0 --subj_group=GROUP0')
+    # names and output locations do not change the fingerprint, configs and code do
+    assert fp == fingerprint(base + ' --model_version=b_n3 --subj_group=GROUP5 --num_workers=8')
+    assert fp != fingerprint(base.replace('0.001', '0.01'))
+    assert fp != fingerprint(base.replace('abc', 'abd'))
+    assert len(code_version()) == 16
+    assert config_fingerprint({'lr': 1e-3}, 'abc') != config_fingerprint({'lr': 1e-3}, 'abd')
+
+    config_file = tmp_path/'config'/'a_n0_GROUP0.pkl'
+    model_file = tmp_path/'trained_models'/'GROUP0'/'model_a_n0.pkl'
+    for path in [config_file, model_file]:
+        path.parent.mkdir(parents=True)
+        path.write_text('done')
+    assert find_completed_run(tmp_path, fp) is None
+    write_run_record(tmp_path, fp, 'a_n0', 'GROUP0', config=config_file, model=model_file)
+    record = find_completed_run(tmp_path, fp)
+    assert record['files']['model'] == 'trained_models/GROUP0/model_a_n0.pkl'
+
+    links = relink_run(tmp_path, record, 'b_n3', 'GROUP5')
+    assert (tmp_path/'trained_models'/'GROUP5'/'model_b_n3.pkl').read_text() == 'done'
+    assert len(links) == 2
+    # names that occur in the fixed parts of the layout or in each other
+    links = relink_run(tmp_path, record, 'config_GROUP0', 'GROUP0x')
+    assert (tmp_path/'config'/'config_GROUP0_GROUP0x.pkl').read_text() == 'done'
+    assert (tmp_path/'trained_models'/'GROUP0x'/'model_config_GROUP0.pkl').exists()
+
+    model_file.unlink()
+    assert find_completed_run(tmp_path, fp) is None
@@ -11,3 +11,16 @@ def test_import():
     from mre import segmentation
     from mre import train_mre_model
     from mre import train_seg_model
+
+
+def test_lazy_imports():
+    # run in a fresh interpreter, other tests may already have imported these
+    import sys
+    import subprocess
+    code = ('import sys, mre.train_mre_model, mre.make_xr; '
+            'print(",".join(m for m in ["torchvision", "tensorboardX", "lmfit", "medpy", '
+            '"SimpleITK", "iterstrat", "sklearn", "torchsummary", "scipy.signal"] '
+            'if m in sys.modules))')
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == ''
@@ -0,0 +1,145 @@
+import copy
+import pytest
+import torch
+
+from mre import inference
+from mre.pytorch_arch_models_genesis import UNet3D
+
+
+@pytest.mark.parametrize('method', ['trace', 'export'])
+def test_export_round_trip(tmp_path, method):
+    if method == 'export' and not hasattr(torch, 'export'):
+        pytest.skip('torch.export not available')
+    torch.manual_seed(0)
+    model = UNet3D().eval()
+    inputs = torch.randn(1, 1, 8, 32, 32)
+
+    path = inference.export_model(model, tmp_path/'unet', (inputs,), method=method)
+    artifact = inference.load_model_artifact(path)
+    with torch.no_grad():
+        assert torch.allclose(artifact(inputs), model(inputs), atol=1e-5)
+
+
+@pytest.mark.parametrize('kernel_size,padding', [(3, 1), (1, 0)])
+def test_fuse_separable_conv(kernel_size, padding):
+    from mre.pytorch_arch_deeplab import SeparableConv3d, _ASPPModule, fuse_separable_convs
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(SeparableConv3d(4, 8, kernel_size, padding=padding),
+                                _ASPPModule(8, 6, kernel_size, padding, 1))
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm3d):
+            module.running_mean.uniform_(-1, 1)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 2)
+            module.bias.data.uniform_(-1, 1)
+    model.eval()
+    inputs = torch.randn(2, 4, 6, 16, 16)
+    with torch.no_grad():
+        expected = model(inputs)
+
+        fused = copy.deepcopy(model)
+        fuse_separable_convs(fused, channels_last=True)
+        assert not any(isinstance(m, torch.nn.BatchNorm3d) for m in fused.modules())
+        if kernel_size == 1:
+            assert isinstance(fused[0].conv1, torch.nn.Identity)
+        weights = {k for k in fused.state_dict() if k.endswith('weight')}
+        assert weights <= set(model.state_dict())
+        result = fused(inputs.contiguous(memory_format=torch.channels_last_3d))
+    assert torch.allclose(result, expected, atol=1e-5)
+
+    # nothing to fold into a bias: no new state_dict key
+    block = SeparableConv3d(4, 8, kernel_size, padding=padding, bias=False, norm='gn').eval()
+    with torch.no_grad():
+        expected = block(inputs)
+        block.fuse()
+        keys = {'pointwise.weight', 'norm.weight', 'norm.bias'}
+        assert set(block.state_dict()) == keys | ({'conv1.weight'} if kernel_size > 1 else set())
+        assert torch.allclose(block(inputs), expected, atol=1e-5)
+
+
+def _randomize_bn(model):
+    for module in model.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2)
+            module.weight.data.uniform_(0.5, 2)
+            module.bias.data.uniform_(-0.5, 0.5)
+    return model
+
+
+@pytest.mark.parametrize('arch', ['unet3d', 'deeplab'])
+def test_freeze_for_inference(arch):
+    from mre.pytorch_arch_3d import GeneralUNet3D
+    from mre.pytorch_arch_deeplab import DeepLab
+    torch.manual_seed(0)
+    if arch == 'unet3d':
+        model = GeneralUNet3D(2, 1, 4, 1, True, False)
+        inputs = torch.randn(2, 1, 8, 32, 32)
+    else:
+        model = DeepLab(1, 1)
+        inputs = torch.randn(1, 1, 16, 32, 32)
+    model = _randomize_bn(model).eval()
+
+    frozen = inference.freeze_for_inference(model)
+    assert not any(isinstance(m, torch.nn.BatchNorm3d) for m in frozen.modules())
+    assert sum(p.numel() for p in frozen.parameters()) < sum(p.numel() for p in model.parameters())
+    with torch.no_grad():
+        assert torch.allclose(frozen(inputs), model(inputs), atol=1e-4)
+
+
+def test_freeze_cont_batchnorm():
+    from mre.pytorch_arch_models_genesis import ContBatchNorm3d
+    torch.manual_seed(0)
+    model = _randomize_bn(UNet3D()).eval()
+    inputs = torch.randn(1, 1, 8, 32, 32)
+
+    # by default ContBatchNorm3d keeps using batch statistics, so nothing changes
+    frozen = inference.freeze_for_inference(model)
+    assert any(isinstance(m, ContBatchNorm3d) for m in frozen.modules())
+    with torch.no_grad():
+        assert torch.allclose(frozen(inputs), model(inputs), atol=1e-4)
+
+    fixed = inference.fix_cont_batchnorm(copy.deepcopy(model)).eval()
+    frozen = inference.freeze_for_inference(model, fix_cont_bn=True)
+    assert not any(isinstance(m, torch.nn.modules.batchnorm._BatchNorm)
+                   for m in frozen.modules())
+    with torch.no_grad():
+        assert torch.allclose(frozen(inputs), fixed(inputs), atol=1e-4)
+
+
+def test_sliding_window_predict():
+    from mre.pytorch_arch_3d import GeneralUNet3D
+    torch.manual_seed(0)
+    # a pointwise model gives the same answer whatever the tiling
+    model = torch.nn.Conv3d(2, 3, 1).eval()
+    inputs = torch.randn(2, 2, 12, 40, 50)
+    tiled = inference.sliding_window_predict(model, inputs, tile_size=(8, 32, 32), overlap=0.5,
+                                             tile_batch=3)
+    with torch.no_grad():
+        assert torch.allclose(tiled, model(inputs), atol=1e-5)
+
+    model = GeneralUNet3D(2, 1, 4, 1, True, False).eval()
+    inputs = torch.randn(1, 1, 6, 70, 45)
+    tiled = inference.sliding_window_predict(model, inputs, tile_size=(8, 32, 32), tile_batch=4)
+    assert tiled.shape == (1, 1, 6, 70, 45)
+    assert torch.isfinite(tiled).all()
+
+
+@pytest.mark.parametrize('precision', ['bf16', 'int8'])
+def test_quantize_mask_model(precision):
+    from mre import quantization
+    if precision == 'int8' and not {'x86', 'fbgemm'} & set(
+            torch.backends.quantized.supported_engines):
+        pytest.skip('no x86 quantized engine')
+    torch.manual_seed(0)
+    model = _randomize_bn(UNet3D()).eval()
+    volumes = [torch.randn(1, 1, 8, 32, 32) for _ in range(2)]
+    # bf16 keeps the batch statistics of ContBatchNorm3d, int8 has to fix them
+    reference = inference.freeze_for_inference(model, fix_cont_bn=precision == 'int8')
+
+    reduced = quantization.quantize_model(model, precision, calib_volumes=volumes)
+    with torch.no_grad():
+        assert reduced(volumes[0]).shape == (1, 1, 8, 32, 32)
+    dices = quantization.check_agreement(reference, reduced, volumes, min_dice=0.0,
+                                         verbose=False)
+    assert min(dices) > 0.8
@@ -0,0 +1,40 @@
+import numpy as np
+from scipy import ndimage as ndi
+
+from mre.synthetic import make_synthetic_cohort
+from mre import masks
+from mre.masks import erode_mask, eroded_masks
+
+
+def test_erode_mask_matches_slice_loop():
+    ds = make_synthetic_cohort(n_subj=2, nx=24, ny=20, nz=6, seed=3)
+    mask = ds['mask_mre'].sel(mask_type='combo').transpose('subject', 'x', 'y', 'z').values[0]
+    mask[:, :, 0] = 0
+    expected = mask.copy()
+    for i in range(mask.shape[2]):
+        if mask[:, :, i].mean() > 0:
+            expected[:, :, i] = ndi.binary_erosion(mask[:, :, i],
+                                                   iterations=2).astype(mask.dtype)
+    np.testing.assert_array_equal(erode_mask(mask, 2), expected)
+    np.testing.assert_array_equal(erode_mask(mask, 1, '3d'),
+                                  ndi.binary_erosion(mask, ndi.generate_binary_structure(3, 1)))
+
+
+def test_eroded_masks_memo_and_cache(tmp_path, monkeypatch):
+    ds = make_synthetic_cohort(n_subj=3, nx=24, ny=20, nz=6, seed=3)
+    masks.clear_memo()
+    eroded = eroded_masks(ds, 2, cache_dir=tmp_path)
+    assert eroded.dims == ('subject', 'x', 'y', 'z')
+    assert len(list(tmp_path.glob('eroded_mask_mre_combo_2d_i2.nc'))) == 1
+
+    # a subset is served from memory, a new session from the file
+    calls = []
+    monkeypatch.setattr(masks, 'erode_mask', lambda *args: calls.append(args))
+    subset = eroded_masks(ds.isel(subject=[2, 0]), 2)
+    np.testing.assert_array_equal(subset.values, eroded.values[[2, 0]])
+    masks.clear_memo()
+    again = eroded_masks(ds, 2, cache_dir=tmp_path)
+    np.testing.assert_array_equal(again.values, eroded.values)
+    assert calls == []
+    np.testing.assert_array_equal(eroded_masks(ds, 0).values,
+                                  ds['mask_mre'].sel(mask_type='combo').values)
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import ndimage as ndi
+import pytest
+
+from mre.synthetic import make_synthetic_cohort
+from mre.mre_datasets import ModelCompare, ModelComparePandas
+
+
+def compare_ds(seed=0):
+    '''A ModelCompare-like dataset: the synthetic stiffness and three noisy predictions.'''
+    rng = np.random.default_rng(seed)
+    ds = make_synthetic_cohort(n_subj=4, nx=24, ny=20, nz=6, seed=seed)
+    preds = ['best_4', 'best_4_class_only', 'other']
+    true = ds['image_mre'].sel(mre_type='mre').values
+    image = np.stack([true] + [true*rng.uniform(0.7, 1.3, true.shape) for _ in preds], axis=1)
+    image[0, 1, :3] = np.nan
+    shape = (ds.sizes['subject'], len(preds) + 1)
+    return xr.Dataset(
+        {'image_mre': (['subject', 'mre_type', 'x', 'y', 'z'], image),
+         'mask_mre': ds['mask_mre'],
+         'val_slope': (['subject', 'mre_type'], rng.uniform(0.5, 1.5, shape)),
+         'val_intercept': (['subject', 'mre_type'], rng.uniform(-500, 500, shape))},
+        coords={'subject': ds.subject, 'mre_type': ['mre_raw'] + preds, 'mask_type': ds.mask_type,
+                'x': ds.x, 'y': ds.y, 'z': ds.z})
+
+
+def loop_compare(ds, do_cor, do_aug):
+    '''The original subject x prediction loop of ModelComparePandas.'''
+    pred_names = [pred for pred in list(ds.mre_type.values) if
+                  pred not in ['mre_raw', 'mre_mask', 'mre_pred', 'mre_wave', 'wave']]
+    pred_dict = {pred: [] for pred in pred_names}
+    for subj in ds.subject:
+        mask = ds.sel(subject=subj, mask_type='combo')['mask_mre'].values.copy()
+        if do_aug:
+            for i in range(mask.shape[2]):
+                if mask[:, :, i].mean() > 0:
+                    mask[:, :, i] = ndi.binary_erosion(
+                        mask[:, :, i], iterations=2).astype(mask.dtype)
+        mask = np.where(mask > 0, mask, np.nan)
+        for pred in pred_names:
+            region = (ds.sel(subject=subj, mre_type=pred)['image_mre'].values * mask).flatten()
+            region = region[~np.isnan(region)]
+            if do_cor and pred != 'best_4_class_only':
+                slope = ds.sel(subject=subj, mre_type=pred)['val_slope'].values
+                intercept = ds.sel(subject=subj, mre_type=pred)['val_intercept'].values
+                region = np.where((region-intercept)/slope > 0, (region-intercept)/slope, 0)
+            pred_dict[pred].append(np.nanmean(region))
+    return pd.DataFrame(pred_dict, index=ds.subject.values)
+
+
+@pytest.mark.parametrize('do_cor', [False, True])
+@pytest.mark.parametrize('do_aug', [False, True])
+def test_model_compare_pandas_matches_loop(do_cor, do_aug):
+    ds = compare_ds()
+    pd.testing.assert_frame_equal(ModelComparePandas(ds, do_cor=do_cor, do_aug=do_aug).df,
+                                  loop_compare(ds, do_cor, do_aug), rtol=1e-12)
+
+
+def test_model_compare_pandas_int16():
+    ds = compare_ds()
+    ds['image_mre'] = ds['image_mre'].fillna(0).astype(np.int16)
+    ds['mask_mre'] = ds['mask_mre'].astype(np.int16)
+    pd.testing.assert_frame_equal(ModelComparePandas(ds, do_cor=True, do_aug=True).df,
+                                  loop_compare(ds, True, True), rtol=1e-12)
+
+
+def write_compare_files(tmp_path):
+    '''Base files and two prediction files in the layout written by `train_mre_model`.'''
+    base = make_synthetic_cohort(n_subj=4, nx=24, ny=20, nz=6, wave_name='mre_wave',
+                                 out_dir=tmp_path/'base')
+    rng = np.random.default_rng(0)
+    pred_dict = {}
+    for name in ['best_4', 'other']:
+        pred = base.sel(mre_type='mre')[['image_mre']]
+        pred['image_mre'] = pred['image_mre']*rng.uniform(0.7, 1.3, pred['image_mre'].shape)
+        pred['val_slope'] = ('subject', rng.uniform(0.5, 1.5, 4))
+        pred['val_intercept'] = ('subject', rng.uniform(-500, 500, 4))
+        pred = pred.assign_coords(mre_type='mre_pred')
+        # predictions come from the test sets of several subject groups
+        for group, subjs in enumerate([['0002', '0000'], ['0001', '0003']]):
+            path = tmp_path/name/f'xarray_pred_{group}.nc'
+            path.parent.mkdir(exist_ok=True)
+            pred.sel(subject=subjs).to_netcdf(path)
+        pred_dict[name] = str(tmp_path/name/'*.nc')
+    return base, pred_dict
+
+
+def test_model_compare_is_lazy(tmp_path):
+    base, pred_dict = write_compare_files(tmp_path)
+    compare = ModelCompare(str(tmp_path/'base'/'*.nc'), pred_dict)
+    ds = compare.ds
+    assert ds['image_mre'].chunks[0] == (1, 1, 1, 1)
+    assert ds['image_mre'].dtype == np.float32
+    assert list(ds.mre_type.values) == ['mre', 'mre_mask', 'mre_raw', 'mre_wave', 'best_4',
+                                        'other']
+
+    for name in pred_dict:
+        pred = xr.open_mfdataset(pred_dict[name], combine='nested', concat_dim='subject')
+        pred = pred.sortby('subject').load()
+        np.testing.assert_allclose(ds['image_mre'].sel(mre_type=name),
+                                   pred['image_mre'].astype(np.float32))
+        np.testing.assert_array_equal(ds['val_slope'].sel(mre_type=name), pred['val_slope'])
+    np.testing.assert_array_equal(ds['image_mre'].sel(mre_type='mre'),
+                                  base['image_mre'].sel(mre_type='mre').astype(np.float32))
+    assert (ds['val_slope'].sel(mre_type='mre') == 1).all()
+
+    compare.save(tmp_path/'compare.nc')
+    with xr.open_dataset(tmp_path/'compare.nc', chunks={}) as saved:
+        assert saved['image_mre'].encoding['dtype'] == np.int16
+        scale = saved['image_mre'].encoding['scale_factor']
+        np.testing.assert_allclose(saved['image_mre'], ds['image_mre'], atol=scale/2 + 1e-3)
@@ -0,0 +1,137 @@
+import pytest
+import torch
+
+from mre import prediction
+
+
+@pytest.mark.parametrize('lap_kernel', [3, 5, 9, 25, 35])
+def test_laplacian_slices_matches_kornia(lap_kernel):
+    kornia = pytest.importorskip('kornia')
+    torch.manual_seed(0)
+    wave = torch.randn(2, 1, 4, 64, 64)
+    laplace = kornia.filters.Laplacian(lap_kernel)
+    expected = torch.stack([laplace(wave[:, :, z]) for z in range(wave.size(2))], dim=2)
+
+    result = prediction.laplacian_slices(wave, lap_kernel)
+    assert result.shape == wave.shape
+    assert torch.allclose(result, expected, atol=1e-5)
+
+
+def test_helmholtz_backward():
+    torch.manual_seed(0)
+    mu = torch.rand(1, 1, 4, 32, 32, requires_grad=True)
+    wave = torch.randn(1, 1, 4, 32, 32, requires_grad=True)
+    freq = torch.FloatTensor([-5])
+    loss = prediction.helmholtz(mu, wave, freq, lap_kernel=25)
+    loss.backward()
+    assert torch.isfinite(loss)
+    assert wave.grad is not None and mu.grad is not None
+
+
+def test_spectral_loss_matches_full_fft():
+    from mre.spectral_loss import SpectralLoss
+
+    torch.manual_seed(0)
+    pred = torch.randn(3, 1, 8, 32, 30)
+    target = torch.randn(3, 1, 8, 32, 30)
+    mask = (torch.rand(3, 1, 8, 32, 30) > 0.3).float()
+
+    # per-sample standardized power spectrum over the full spatial fftn
+    expected = 0
+    for i in range(pred.shape[0]):
+        pows = []
+        for x in [pred[i:i+1]*mask[i:i+1], target[i:i+1]*mask[i:i+1]]:
+            power = torch.fft.fftn(x, dim=(-3, -2, -1)).abs()**2
+            pows.append((power - power.mean())/power.std())
+        expected += ((pows[0] - pows[1])**2).sum()
+    expected = expected/pred.numel()
+
+    spectral = SpectralLoss()
+    assert torch.allclose(spectral(pred, target, mask), expected, rtol=1e-4)
+    names = ['a', 'b', 'c']
+    assert torch.allclose(spectral(pred, target, mask, names=names), expected, rtol=1e-4)
+    assert torch.allclose(spectral(pred, target, mask, names=names), expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize('backend', ['eager', 'script'])
+def test_masked_mse_fused_matches_separate_losses(backend):
+    torch.manual_seed(0)
+    pred = torch.randn(2, 1, 4, 16, 16)
+    target = torch.randn(2, 1, 4, 16, 16)
+    mask = (torch.rand(2, 1, 4, 16, 16) > 0.2).float()
+
+    fused = prediction.get_masked_mse_fused(backend)
+    pixel, subj, slice_mse = fused(pred, target, mask, True)
+    assert torch.allclose(pixel, prediction.masked_mse(pred, target, mask))
+    assert torch.allclose(subj, prediction.masked_mse_subj(pred, target, mask), atol=1e-6)
+    assert torch.allclose(slice_mse, prediction.masked_mse_slice(pred, target, mask), atol=1e-6)
+
+
+@pytest.mark.parametrize('do_cor', [False, True])
+def test_get_linear_fit_matches_subject_loop(do_cor):
+    import numpy as np
+    from mre.synthetic import make_synthetic_cohort
+
+    ds = make_synthetic_cohort(n_subj=5, nx=24, ny=20, nz=6, seed=2)
+    rng = np.random.default_rng(2)
+    true = ds['image_mre'].sel(mre_type='mre')
+    ds['image_mre'].loc[{'mre_type': 'mre_pred'}] = true*rng.uniform(0.8, 1.2, true.shape)
+    ds['val_slope'] = ('subject', rng.uniform(0.8, 1.2, 5))
+    ds['val_intercept'] = ('subject', rng.uniform(-100, 100, 5))
+    slope, intercept = np.mean(ds['val_slope'].values), np.mean(ds['val_intercept'].values)
+
+    # the original per-subject pass
+    true_means, pred_means = [], []
+    for subj in ds.subject:
+        mask = ds.sel(subject=subj, mask_type='combo')['mask_mre'].values
+        true_region = ds.sel(subject=subj, mre_type='mre')['image_mre'].values * mask
+        pred_region = ds.sel(subject=subj, mre_type='mre_pred')['image_mre'].values * mask
+        pred_region = np.where(pred_region > 0, pred_region, np.nan)
+        if do_cor:
+            pred_region = (pred_region - intercept)/slope
+            pred_region = np.where(pred_region > 0, pred_region, 0)
+        true_means.append(np.nanmean(np.where(true_region > 0, true_region, np.nan)))
+        pred_means.append(np.nan_to_num(np.nanmean(pred_region)))
+
+    df = prediction.get_linear_fit(ds, do_cor, make_plot=False, verbose=False, return_df=True)
+    np.testing.assert_allclose(df['true'], true_means, rtol=1e-10)
+    np.testing.assert_allclose(df['predict'], pred_means, rtol=1e-10)
+    fit = prediction.get_linear_fit(ds, do_cor, make_plot=False, verbose=False)
+    np.testing.assert_allclose(fit, np.polyfit(true_means, pred_means, 1), rtol=1e-8)
+
+
+def test_train_model_resumes_after_the_last_epoch(tmp_path):
+    from mre.checkpoint import AsyncCheckpointer
+    from mre.asha import ASHA, summarize
+
+    def run(num_epochs, resume, pruner=None):
+        torch.manual_seed(0)
+        model = torch.nn.Conv3d(2, 1, 1)
+        optimizer = torch.optim.SGD(model.parameters(), lr=1e-2)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1)
+        samples = [(torch.randn(2, 4, 8, 8), torch.rand(1, 4, 8, 8), torch.ones(1, 4, 8, 8),
+                    f'{i:04d}') for i in range(2)]
+        batches = torch.utils.data.DataLoader(samples, batch_size=2)
+        checkpointer = AsyncCheckpointer(tmp_path/'ckpt.pt', every=1)
+        model, _, _ = prediction.train_model(
+            model, optimizer, scheduler, 'cpu', {'train': batches, 'test': batches},
+            num_epochs=num_epochs, do_val=False, pruner=pruner, checkpointer=checkpointer,
+            resume=resume)
+        return model
+
+    trained = run(2, resume=False)
+    # preempted after the training, e.g. while writing the predictions
+    resumed = run(2, resume=True)
+    assert torch.equal(resumed.weight, trained.weight)
+
+    # a trial stopped at a rung stays stopped when its job is requeued
+    (tmp_path/'ckpt.pt').unlink()
+    pruner = ASHA(tmp_path/'asha', 'n1', 'GROUP0', max_epochs=10, min_epochs=2, eta=2)
+    (tmp_path/'asha'/'GROUP0'/'rung_2').mkdir()
+    (tmp_path/'asha'/'GROUP0'/'rung_2'/'n0.json').write_text('{"loss": -1.0}')
+    run(10, resume=False, pruner=pruner)
+    assert pruner.stopped_at == 2
+    requeued = ASHA(tmp_path/'asha', 'n1', 'GROUP0', max_epochs=10, min_epochs=2, eta=2)
+    run(10, resume=True, pruner=requeued)
+    assert requeued.stopped_at == 2
+    assert summarize(tmp_path/'asha')['GROUP0']['n1']['epochs'] == 2
@@ -0,0 +1,37 @@
+import json
+import torch
+
+from mre.profiling import StepProfiler, write_profile_json
+
+
+def test_step_profiler(tmp_path):
+    model = torch.nn.Conv3d(1, 1, 3, padding=1)
+    loader = [torch.randn(2, 1, 4, 8, 8) for _ in range(3)]
+    prof = StepProfiler('cpu')
+    for data in prof.wrap(loader):
+        with prof.section('transfer'):
+            inputs = data.to('cpu')
+        with prof.section('forward'):
+            outputs = model(inputs)
+        with prof.section('loss'):
+            loss = outputs.pow(2).mean()
+        with prof.section('backward'):
+            loss.backward()
+        prof.end_step(inputs.size(0))
+
+    summary = prof.summary()
+    assert summary['steps'] == 3 and summary['samples'] == 6
+    assert summary['forward_time'] > 0 and summary['samples_per_sec'] > 0
+
+    path = write_profile_json({'train': [summary, summary]}, tmp_path/'profile'/'run.json')
+    with open(path) as f:
+        assert json.load(f)['train']['mean']['steps'] == 3
+
+
+def test_step_profiler_disabled():
+    prof = StepProfiler('cpu', enabled=False)
+    for _ in prof.wrap(range(3)):
+        with prof.section('forward'):
+            pass
+        prof.end_step(1)
+    assert prof.steps == 0
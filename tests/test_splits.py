@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mre import splits
+from mre.splits import available_splits, resolve_split, split_name, stratified_split
+
+
+def test_resolve_split(tmp_path):
+    assert split_name('smart', 'rad_freeze') in available_splits()
+    test_list = ['1736', '0735']
+    train_list, val_list, test_out = resolve_split('smart_rad_freeze', test_list,
+                                                   cache_dir=tmp_path)
+    assert test_out == test_list
+    assert len(val_list) == 30
+    assert not set(test_list) & (set(train_list) | set(val_list))
+    assert not set(train_list) & set(val_list)
+
+    # a second job of the sweep reads the resolved folds from the shared cache
+    assert len(list(tmp_path.glob('smart_rad_freeze_*.json'))) == 1
+    splits._RESOLVED.clear()
+    assert resolve_split('smart_rad_freeze', test_list[::-1], cache_dir=tmp_path)[:2] == (
+        train_list, val_list)
+
+    with pytest.raises(KeyError):
+        resolve_split('smart_rad_freeze', test_list, version=99)
+
+
+def test_stratified_split(tmp_path):
+    subjects = [f'{i:04d}' for i in range(40)]
+    df = pd.DataFrame({'gender': np.arange(40) % 2}, index=subjects)
+    df.to_pickle(tmp_path/'strat.pkl')
+    train_list, val_list, _ = stratified_split(tmp_path/'strat.pkl', ['0000'], 100, test_size=10,
+                                               cache_dir=tmp_path/'cache')
+    assert len(train_list) + len(val_list) == 39 and '0000' not in train_list + val_list
+
+    # cached folds no longer need the pickle
+    (tmp_path/'strat.pkl').unlink()
+    assert stratified_split(tmp_path/'strat.pkl', ['0000'], 100, test_size=10,
+                            cache_dir=tmp_path/'cache')[:2] == (train_list, val_list)
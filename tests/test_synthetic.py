@@ -0,0 +1,29 @@
+import numpy as np
+
+from mre.synthetic import make_synthetic_cohort, synthetic_clinical_df, CLINICAL
+
+
+def test_gold_cohort(tmp_path):
+    ds = make_synthetic_cohort(n_subj=3, nx=16, ny=12, nz=8, seed=1, out_dir=tmp_path)
+    assert dict(ds.sizes) == {'subject': 3, 'sequence': 9, 'mask_type': 3, 'mre_type': 5, 'x': 16,
+                              'y': 12, 'z': 8, 'z_idx': 4}
+    assert ds['image_mri'].dims == ('subject', 'sequence', 'x', 'y', 'z')
+    assert list(ds.mre_type.values) == ['mre', 'mre_mask', 'mre_raw', 'wave', 'mre_pred']
+    assert all(key in ds for key in CLINICAL)
+    liver = ds['mask_mre'].sel(mask_type='liver').values
+    stiffness = ds['image_mre'].sel(mre_type='mre').values
+    assert (stiffness[liver == 0] == 0).all() and (stiffness[liver == 1] > 0).all()
+    assert len(list(tmp_path.glob('xarray_*.nc'))) == 3
+
+    again = make_synthetic_cohort(n_subj=3, nx=16, ny=12, nz=8, seed=1)
+    np.testing.assert_array_equal(ds['image_mri'].values, again['image_mri'].values)
+    assert synthetic_clinical_df(ds).shape == (3, len(CLINICAL))
+
+
+def test_raw_cohort():
+    ds = make_synthetic_cohort(n_subj=2, nx=16, ny=16, nz=8, nz_mre=3, wave=False,
+                               layout='raw')
+    assert ds['image_mri'].dims == ('subject', 'sequence', 'x', 'y', 'z_mri')
+    assert ds['image_mre'].dims == ('subject', 'mre_type', 'x', 'y', 'z_mre')
+    assert ds.sizes['z_mre'] == 3
+    assert 'wave' not in ds.mre_type.values and 'age' not in ds